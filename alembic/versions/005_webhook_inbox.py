@@ -0,0 +1,47 @@
+"""Add webhook_events inbox table for fast-ack payment callbacks.
+
+Revision ID: 005_webhook_inbox
+Revises: 004_bootstrap_core_tables
+Create Date: 2025-12-08 10:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "005_webhook_inbox"
+down_revision = "004_bootstrap_core_tables"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Create webhook_events (004 create_all may already have created it on fresh installs)."""
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table("webhook_events"):
+        return
+    op.create_table(
+        "webhook_events",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("provider", sa.String(length=20), nullable=False),
+        sa.Column("event_key", sa.String(length=64), nullable=False),
+        sa.Column("payment_ref", sa.String(length=64), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text()),
+        sa.Column("next_attempt_at", sa.DateTime(timezone=True)),
+        sa.Column("claimed_at", sa.DateTime(timezone=True)),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("processed_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_webhook_events_id", "webhook_events", ["id"])
+    op.create_index("ix_webhook_events_event_key", "webhook_events", ["event_key"], unique=True)
+    op.create_index("ix_webhook_events_payment_ref", "webhook_events", ["payment_ref"])
+    op.create_index(
+        "ix_webhook_events_status_next_attempt", "webhook_events", ["status", "next_attempt_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("webhook_events")
@@ -0,0 +1,49 @@
+"""Unique (order, type) constraints so payment crediting is insert-or-skip.
+
+Revision ID: 006_credit_unique_constraints
+Revises: 005_webhook_inbox
+Create Date: 2025-12-10 10:00:00.000000
+
+Existing duplicate (order_id, type) rows must be cleaned up before upgrading,
+otherwise MySQL rejects the constraint.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "006_credit_unique_constraints"
+down_revision = "005_webhook_inbox"
+branch_labels = None
+depends_on = None
+
+_CONSTRAINTS = (
+    ("transactions", "uq_transactions_order_type", ["order_id", "type"]),
+    ("balance_logs", "uq_balance_logs_order_type", ["related_order_id", "type"]),
+)
+
+
+def _existing_names(bind, table: str) -> set:
+    inspector = sa.inspect(bind)
+    names = {c["name"] for c in inspector.get_unique_constraints(table)}
+    # MySQL reports unique constraints as unique indexes
+    names.update(i["name"] for i in inspector.get_indexes(table))
+    return names
+
+
+def upgrade() -> None:
+    """Add the constraints (004 create_all may already have created them on fresh installs)."""
+    bind = op.get_bind()
+    for table, name, columns in _CONSTRAINTS:
+        if name not in _existing_names(bind, table):
+            op.create_unique_constraint(name, table, columns)
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    # MySQL may have reused the unique index for the related_order_id foreign key
+    if "ix_balance_logs_related_order_id" not in _existing_names(bind, "balance_logs"):
+        op.create_index("ix_balance_logs_related_order_id", "balance_logs", ["related_order_id"])
+    for table, name, _ in _CONSTRAINTS:
+        if name in _existing_names(bind, table):
+            op.drop_constraint(name, table, type_="unique")
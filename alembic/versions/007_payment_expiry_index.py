@@ -0,0 +1,32 @@
+"""Index payments on (status, expires_at) for the expiry sweeper.
+
+Revision ID: 007_payment_expiry_index
+Revises: 006_credit_unique_constraints
+Create Date: 2025-12-12 10:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "007_payment_expiry_index"
+down_revision = "006_credit_unique_constraints"
+branch_labels = None
+depends_on = None
+
+_INDEX = "ix_payments_status_expires_at"
+
+
+def _has_index(bind) -> bool:
+    return any(i["name"] == _INDEX for i in sa.inspect(bind).get_indexes("payments"))
+
+
+def upgrade() -> None:
+    """Create the index (004 create_all may already have created it on fresh installs)."""
+    if not _has_index(op.get_bind()):
+        op.create_index(_INDEX, "payments", ["status", "expires_at"])
+
+
+def downgrade() -> None:
+    if _has_index(op.get_bind()):
+        op.drop_index(_INDEX, table_name="payments")
@@ -0,0 +1,42 @@
+"""Add deposit_wallets table for per-user static Cryptomus wallets.
+
+Revision ID: 008_deposit_wallets
+Revises: 007_payment_expiry_index
+Create Date: 2025-12-15 10:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "008_deposit_wallets"
+down_revision = "007_payment_expiry_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Create deposit_wallets (004 create_all may already have created it on fresh installs)."""
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table("deposit_wallets"):
+        return
+    op.create_table(
+        "deposit_wallets",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("currency", sa.String(length=10), nullable=False),
+        sa.Column("network", sa.String(length=20), nullable=False),
+        sa.Column("address", sa.String(length=255), nullable=False),
+        sa.Column("wallet_uuid", sa.String(length=64)),
+        sa.Column("order_id", sa.String(length=64), nullable=False),
+        sa.Column("is_active", sa.Boolean(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint("user_id", "currency", "network", name="uq_deposit_wallets_user_currency_network"),
+    )
+    op.create_index("ix_deposit_wallets_id", "deposit_wallets", ["id"])
+    op.create_index("ix_deposit_wallets_user_id", "deposit_wallets", ["user_id"])
+    op.create_index("ix_deposit_wallets_order_id", "deposit_wallets", ["order_id"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_table("deposit_wallets")
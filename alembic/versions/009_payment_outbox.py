@@ -0,0 +1,45 @@
+"""Add payment_outbox table for asynchronous Cryptomus invoice creation.
+
+Revision ID: 009_payment_outbox
+Revises: 008_deposit_wallets
+Create Date: 2025-12-16 10:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "009_payment_outbox"
+down_revision = "008_deposit_wallets"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Create payment_outbox (004 create_all may already have created it on fresh installs)."""
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table("payment_outbox"):
+        return
+    op.create_table(
+        "payment_outbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("payment_id", sa.String(length=64), nullable=False),
+        sa.Column("kind", sa.String(length=30), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text()),
+        sa.Column("next_attempt_at", sa.DateTime(timezone=True)),
+        sa.Column("claimed_at", sa.DateTime(timezone=True)),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("processed_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_payment_outbox_id", "payment_outbox", ["id"])
+    op.create_index("ix_payment_outbox_payment_id", "payment_outbox", ["payment_id"], unique=True)
+    op.create_index(
+        "ix_payment_outbox_status_next_attempt", "payment_outbox", ["status", "next_attempt_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("payment_outbox")
@@ -22,6 +22,8 @@ from app.models.proxy import UpstreamProvider, ProductMapping
 from app.api.v1.endpoints.session import get_current_admin_user
 from app.schemas.user import UserResponse, AdminBalanceAdjustRequest
 from app.services.order_service import OrderService
+from app.services.proxy_service import ProxyService
+from app.services.session_service import SessionService
 from app.models.user import User
 from app.models.order import BalanceLog, Order, Payment, OrderType, OrderStatus
 from app.models.proxy import ProxyProduct
@@ -99,6 +101,9 @@ async def toggle_user_status(
     
     user.is_active = not user.is_active
     await db.commit()
+    await SessionService.invalidate_user(user.username)
+    await SessionService.invalidate_user_api_keys(db, user_id)
+    await SessionService.bump_session_version(user_id)
     
     return {"message": f"User {'activated' if user.is_active else 'deactivated'} successfully"}
 
@@ -139,7 +144,7 @@ async def adjust_user_balance(
     if amount > 0:
         now = datetime.utcnow()
         order = Order(
-            order_number=await OrderService.generate_order_number(),
+            order_number=OrderService.generate_order_number(),
             user_id=user_id,
             type=OrderType.RECHARGE,
             amount=amount,
@@ -167,6 +172,7 @@ async def adjust_user_balance(
     db.add(balance_log)
 
     await db.commit()
+    await SessionService.bump_session_version(user_id)
     
     return {
         "message": "Balance adjusted successfully",
@@ -657,6 +663,7 @@ async def update_proxy_product(
     
     await db.commit()
     await db.refresh(product)
+    await ProxyService.invalidate_products(product_id)
     
     return ProxyProductResponse.from_orm(product)
 
@@ -680,6 +687,7 @@ async def delete_proxy_product(
     
     await db.delete(product)
     await db.commit()
+    await ProxyService.invalidate_products(product_id)
     
     return {"message": "Proxy product deleted successfully"}
 
@@ -703,6 +711,7 @@ async def toggle_proxy_product_status(
     
     product.is_active = not product.is_active
     await db.commit()
+    await ProxyService.invalidate_products(product_id)
     
     return {"message": f"Proxy product {'activated' if product.is_active else 'deactivated'} successfully"}
 
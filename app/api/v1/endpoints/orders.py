@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from decimal import Decimal
@@ -7,13 +8,18 @@ from app.core.config import settings
 from app.core.database import get_db
 from app.schemas.order import (
     OrderResponse, OrderList, PaymentResponse, TransactionResponse,
-    BalanceLogResponse, RechargeRequest, RechargeResponse, PaymentCallback
+    BalanceLogResponse, RechargeRequest, RechargeResponse, PaymentCallback,
+    DepositWalletResponse
 )
 from app.services.order_service import OrderService
 from app.services.crypto_payment import crypto_payment_service
 from app.services.cryptomus_client import get_cryptomus_client
+from app.services.deposit_wallet import DepositWalletService
+from app.services.payment_events import stream_payment_events
+from app.services.webhook_inbox import WebhookInboxService
 from app.models.order import OrderType, OrderStatus, PaymentMethod, CryptoCurrency
 from app.models.user import User
+from app.utils import qr
 from app.api.v1.endpoints.session import get_current_active_user
 import json
 import logging
@@ -38,6 +44,36 @@ async def get_orders(
     )
 
 
+@router.get("/deposit-wallet", response_model=DepositWalletResponse)
+async def get_deposit_wallet(
+    network: Optional[str] = None,
+    currency: str = "USDT",
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """获取用户的静态充值地址（首次请求时创建）；向该地址转账即自动到账"""
+    if not DepositWalletService.enabled():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Static deposit wallets are not enabled"
+        )
+    network = network or next(iter(sorted(crypto_payment_service.allowed_networks)))
+    try:
+        wallet = await DepositWalletService.get_or_create(db, current_user.id, currency, network)
+    except RuntimeError as e:
+        logger.error(f"Deposit wallet creation failed: {e}")
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Failed to create deposit wallet")
+
+    qr_code = qr.render(wallet.address, "svg").data_uri() if qr.available() else None
+    return DepositWalletResponse(
+        currency=wallet.currency,
+        network=wallet.network,
+        address=wallet.address,
+        qr_code=qr_code,
+        created_at=wallet.created_at,
+    )
+
+
 @router.get("/{order_id}", response_model=OrderResponse)
 async def get_order(
     order_id: int,
@@ -157,142 +193,56 @@ async def cryptomus_webhook(
     request: Request,
     db: AsyncSession = Depends(get_db)
 ):
-    """Cryptomus Webhook回调接口"""
+    """Cryptomus Webhook回调接口：验签后写入收件箱立即应答，由后台任务按支付单顺序处理"""
+    body = await request.body()
     try:
-        # 获取请求数据
-        body = await request.body()
         webhook_data = json.loads(body.decode('utf-8'))
-        
-        # 获取Cryptomus签名
-        signature = webhook_data.get("sign")
-        if not signature:
-            logger.warning("Cryptomus webhook missing signature")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Missing signature"
-            )
-        
-        # 验证签名
-        if not crypto_payment_service.verify_webhook_signature(webhook_data, signature):
-            logger.warning("Invalid Cryptomus webhook signature")
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Invalid signature"
-            )
-        
-        # 获取支付信息
-        payment_uuid = webhook_data.get('uuid')
-        order_id = webhook_data.get('order_id')
-        payment_status = webhook_data.get('status') or webhook_data.get('payment_status', 'check')
-        transaction_hash = webhook_data.get('txid')
-        confirmations = webhook_data.get('confirmations', 0)
-        required_confirmations = webhook_data.get('required_confirmations') or webhook_data.get('confirmations_required')
-        
-        if not payment_uuid and not order_id:
-            logger.error("Cryptomus webhook missing payment identifiers")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Missing payment identifiers"
-            )
-
-        resolved_payment_id = order_id
-        if not resolved_payment_id and payment_uuid:
-            try:
-                async with get_cryptomus_client() as client:
-                    info = await client.get_payment_info(payment_id=payment_uuid)
-                resolved_payment_id = (info.get('result') or {}).get('order_id')
-            except Exception as lookup_error:
-                logger.warning(
-                    "Failed to resolve Cryptomus order_id for uuid %s: %s",
-                    payment_uuid,
-                    lookup_error,
-                )
-        if not resolved_payment_id:
-            resolved_payment_id = payment_uuid
-        if not resolved_payment_id:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing payment identifier")
-
-        # 从DB获取支付记录（强一致校验）
-        payment_record = await OrderService.get_payment_by_id(db, resolved_payment_id)
-        if not payment_record:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found")
-
-        confirmations = crypto_payment_service._parse_int(confirmations)
-        if confirmations is None:
-            confirmations = 0
-        required_confirmations = crypto_payment_service._parse_int(required_confirmations)
-        if required_confirmations is None:
-            required_confirmations = payment_record.required_confirmations
-
-        # 基础校验：订单/商户/金额/币种
-        stored_payment = await crypto_payment_service.get_cached_payment(resolved_payment_id)
-        if order_id and payment_record.order_id and order_id != (stored_payment or {}).get('order_id', order_id):
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order id mismatch")
-        if settings.CRYPTOMUS_MERCHANT_UUID and webhook_data.get('merchant') and webhook_data.get('merchant') != settings.CRYPTOMUS_MERCHANT_UUID:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid merchant")
-
-        incoming_amount = webhook_data.get('order_amount') or webhook_data.get('amount')
-        if incoming_amount is not None:
-            try:
-                from decimal import Decimal
-                if Decimal(str(payment_record.amount)) != Decimal(str(incoming_amount)):
-                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount mismatch")
-            except Exception:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount parse error")
-
-        incoming_currency = webhook_data.get('currency')
-        if incoming_currency and payment_record.crypto_currency and str(incoming_currency).upper() != payment_record.crypto_currency.value:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Currency mismatch")
-        
-        # 转换状态
-        converted_status = crypto_payment_service._convert_cryptomus_status(payment_status)
-
-        if converted_status in ['confirmed', 'paid'] and required_confirmations and confirmations < required_confirmations:
-            confirmations = required_confirmations
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        logger.error(f"Invalid JSON in Cryptomus webhook: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid JSON"
+        )
+    if not isinstance(webhook_data, dict):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON")
 
-        # 如果已经是终态且重复通知，直接返回成功（幂等）
-        if stored_payment and crypto_payment_service._is_final_status(stored_payment.get('status', '')) and crypto_payment_service._is_final_status(converted_status) and converted_status == stored_payment.get('status'):
-            return {"status": "success", "detail": "duplicate webhook"}
-        
-        # 更新支付状态
-        await crypto_payment_service.update_payment_status(
-            payment_id=resolved_payment_id,
-            status=converted_status,
-            transaction_hash=transaction_hash,
-            confirmations=confirmations,
-            required_confirmations=required_confirmations
+    # 获取Cryptomus签名
+    signature = webhook_data.get("sign")
+    if not signature:
+        logger.warning("Cryptomus webhook missing signature")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Missing signature"
         )
-        
-        # 如果支付已确认，处理订单
-        if converted_status in ['confirmed', 'paid']:
-            success = await OrderService.confirm_payment(
-                db,
-                resolved_payment_id,
-                transaction_hash,
-                confirmations,
-                required_confirmations=required_confirmations
-            )
 
-            if success:
-                logger.info(f"Cryptomus payment confirmed: {resolved_payment_id}")
-            else:
-                logger.error(f"Failed to confirm Cryptomus payment: {resolved_payment_id}")
+    # 验证签名
+    if not crypto_payment_service.verify_webhook_signature(webhook_data, signature):
+        logger.warning("Invalid Cryptomus webhook signature")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid signature"
+        )
 
-        logger.info(f"Cryptomus webhook processed: {resolved_payment_id} - {payment_status}")
-        return {"status": "success"}
-        
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in Cryptomus webhook: {str(e)}")
+    payment_ref = webhook_data.get('order_id') or webhook_data.get('uuid')
+    if not payment_ref:
+        logger.error("Cryptomus webhook missing payment identifiers")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid JSON"
+            detail="Missing payment identifiers"
         )
+
+    try:
+        created = await WebhookInboxService.enqueue(db, "cryptomus", payment_ref, body)
     except Exception as e:
-        logger.error(f"Error processing Cryptomus webhook: {str(e)}")
+        # 未落库时返回 5xx，让 Cryptomus 稍后重试
+        logger.error(f"Failed to enqueue Cryptomus webhook: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
         )
+    if not created:
+        return {"status": "success", "detail": "duplicate webhook"}
+    return {"status": "success"}
 
 
 @router.get("/balance/logs", response_model=list[BalanceLogResponse])
@@ -348,11 +298,14 @@ async def monitor_payment(
             detail="Payment not found"
         )
     
-    # 获取支付状态
-    payment_status = await crypto_payment_service.get_payment_status(payment_id)
+    # 读取缓存中的支付状态（由后台轮询与Webhook更新，不在此处查询上游）
+    payment_status = await crypto_payment_service.get_cached_payment(payment_id)
+    if payment_status is None:
+        payment_status = await crypto_payment_service.get_payment_status(payment_id)
+    payment_status = dict(payment_status)
 
     status_value = (payment_status.get('status') or '').lower()
-    if status_value in ['confirmed', 'paid']:
+    if status_value in ['confirmed', 'paid'] and payment.status != 'confirmed':
         confirmations = crypto_payment_service._parse_int(payment_status.get('confirmations'))
         required_confirmations = crypto_payment_service._parse_int(payment_status.get('required_confirmations'))
         if required_confirmations is None:
@@ -373,13 +326,48 @@ async def monitor_payment(
     return payment_status
 
 
+@router.get("/payments/{payment_id}/events")
+async def payment_events(
+    payment_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """支付状态推送（SSE）：状态与确认数变化时实时推送，到达终态后结束"""
+    payment = await OrderService.get_payment_by_id(db, payment_id)
+    if not payment or payment.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment not found"
+        )
+    fallback = {
+        'payment_id': payment_id,
+        'status': payment.status,
+        'confirmations': payment.confirmations,
+        'required_confirmations': payment.required_confirmations,
+    }
+    # 提前结束事务归还数据库连接，推送期间不占用连接池
+    await db.commit()
+
+    async def load_current():
+        return await crypto_payment_service.get_cached_payment(payment_id) or fallback
+
+    return StreamingResponse(
+        stream_payment_events(payment_id, load_current, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/payments/{payment_id}/qrcode")
 async def get_payment_qrcode(
     payment_id: str,
+    request: Request,
+    format: str = Query("json", pattern="^(json|svg|png)$"),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    """获取支付二维码"""
+    """获取支付二维码：format=json 返回数据URL，svg/png 直接返回本地渲染的图片（可长期缓存）"""
     # 检查支付是否属于当前用户
     payment = await OrderService.get_payment_by_id(db, payment_id)
     if not payment or payment.user_id != current_user.id:
@@ -387,9 +375,13 @@ async def get_payment_qrcode(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Payment not found"
         )
-    
-    # 生成二维码
-    if payment.wallet_address and payment.crypto_amount and payment.crypto_currency:
+    if not (payment.wallet_address and payment.crypto_amount and payment.crypto_currency):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Payment does not support QR code"
+        )
+
+    if format == "json":
         qr_code = crypto_payment_service.generate_qr_code(
             payment_id,
             payment.wallet_address,
@@ -397,11 +389,23 @@ async def get_payment_qrcode(
             payment.crypto_currency.value
         )
         return {"qr_code": qr_code}
-    else:
+
+    if not qr.available():
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Payment does not support QR code"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="QR rendering unavailable"
         )
+    image = qr.render(
+        crypto_payment_service.qr_payload(
+            payment.wallet_address, str(payment.crypto_amount), payment.crypto_currency.value
+        ),
+        format,
+    )
+    # 支付地址与金额不会变化，图片内容不变，可长期缓存
+    headers = {"Cache-Control": "private, max-age=31536000, immutable", "ETag": image.etag}
+    if request.headers.get("if-none-match") == image.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=image.content, media_type=image.media_type, headers=headers)
 
 
 @router.post("/payments/{payment_id}/verify")
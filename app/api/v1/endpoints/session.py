@@ -2,18 +2,17 @@ from __future__ import annotations
 
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.core.database import get_db
-from app.core.security import get_password_hash, verify_password
+from app.core.security import get_password_hash_async, verify_password_async
 from app.models.user import APIKey, User
 from app.schemas.session import SessionEnvelope, SessionLogin, SessionLogoutResponse
 from app.schemas.user import APIKeyCreate, APIKeyResponse, PasswordChange, UserCreate
 from app.services.session_service import SessionService
-from app.utils.cache import CacheService
 
 router = APIRouter(prefix="/session", tags=["session"], include_in_schema=False)
 security = HTTPBearer()
@@ -30,7 +29,7 @@ async def get_current_active_user(
             detail="Not authenticated",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = await SessionService.resolve_user_from_token(db, credentials.credentials)
+    user = await SessionService.resolve_cached_user(db, credentials.credentials)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -74,10 +73,12 @@ async def login(login_data: SessionLogin, db: AsyncSession = Depends(get_db)):
 
 @router.get("/state", response_model=SessionEnvelope, include_in_schema=False)
 async def session_state(
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     credentials: HTTPAuthorizationCredentials = Depends(security),
 ):
-    """获取当前用户的统一会话状态。"""
+    """获取当前用户的统一会话状态（支持 ETag/304，按版本号缓存）。"""
     if not credentials or not credentials.credentials:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -85,7 +86,8 @@ async def session_state(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = await SessionService.resolve_user_from_token(db, credentials.credentials)
+    token = credentials.credentials
+    user = await SessionService.resolve_cached_user(db, token)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -94,8 +96,24 @@ async def session_state(
         )
     if not user.is_active:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
-    
-    return await SessionService.build_session_envelope(user, existing_token=credentials.credentials, db=db)
+
+    version = await SessionService.get_session_version(user.id)
+    if version is None:
+        fresh_user = await SessionService.get_user_by_id(db, user.id)
+        return await SessionService.build_session_envelope(fresh_user or user, existing_token=token, db=db)
+
+    etag = SessionService.session_etag(user.id, version)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+
+    response.headers.update(cache_headers)
+    envelope = await SessionService.get_cached_session_envelope(user.id, version, token)
+    if envelope is None:
+        fresh_user = await SessionService.get_user_by_id(db, user.id)
+        envelope = await SessionService.build_session_envelope(fresh_user or user, existing_token=token, db=db)
+        await SessionService.cache_session_envelope(user.id, version, envelope)
+    return envelope
 
 
 @router.post("/logout", response_model=SessionLogoutResponse, include_in_schema=False)
@@ -154,7 +172,8 @@ async def delete_api_key(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="API key not found")
     api_key.is_active = False
     await db.commit()
-    await CacheService.delete(f"api_key:{api_key.api_key}")
+    await SessionService.invalidate_api_key(api_key.api_key)
+    await SessionService.bump_session_version(current_user.id)
     return {"message": "API key deleted successfully"}
 
 
@@ -165,11 +184,14 @@ async def change_password(
     current_user: User = Depends(get_current_active_user),
 ):
     """修改当前账户密码。"""
-    if not verify_password(payload.current_password, current_user.password_hash):
+    # current_user 可能是缓存快照，修改前重新加载数据库记录
+    user = await SessionService.get_user_by_id(db, current_user.id)
+    if not user or not await verify_password_async(payload.current_password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect",
         )
-    current_user.password_hash = get_password_hash(payload.new_password)
+    user.password_hash = await get_password_hash_async(payload.new_password)
     await db.commit()
+    await SessionService.invalidate_user(user.username)
     return {"message": "Password changed successfully"}
@@ -2,6 +2,7 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from typing import Any, Awaitable, Callable
 import logging
 
 logger = logging.getLogger(__name__)
@@ -34,6 +35,21 @@ async def init_db():
         await conn.run_sync(Base.metadata.create_all)
 
 
+def add_after_commit(session: AsyncSession, callback: Callable[[], Awaitable[Any]]) -> None:
+    """Register a coroutine factory to run once get_db has committed the session."""
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+async def run_after_commit(session: AsyncSession) -> None:
+    """Run (and clear) callbacks registered via add_after_commit; failures are logged only."""
+    callbacks = session.info.pop("after_commit", [])
+    for callback in callbacks:
+        try:
+            await callback()
+        except Exception as e:
+            logger.warning(f"after_commit callback failed: {e}")
+
+
 # Dependency: db session
 async def get_db() -> AsyncSession:
     """
@@ -43,7 +59,9 @@ async def get_db() -> AsyncSession:
     try:
         yield session
         await session.commit()
+        await run_after_commit(session)
     except Exception:
+        session.info.pop("after_commit", None)
         await session.rollback()
         raise
     finally:
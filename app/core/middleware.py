@@ -0,0 +1,221 @@
+"""
+纯 ASGI 中间件：请求日志 + API Key 鉴权/限流
+
+相比 @app.middleware("http")（BaseHTTPMiddleware），这里不创建额外任务和队列，
+也不缓冲流式响应；路径匹配规则在导入时预编译。
+"""
+
+import logging
+import time
+import uuid
+from typing import Iterable, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.services.proxy_service import ProxyService
+from app.services.session_service import APIKeyPrincipal, SessionService
+from app.utils.cache import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "x-request-id"
+
+
+class PathMatcher:
+    """预编译的路径匹配：以 "/" 结尾的模式按前缀匹配，其余（含根路径）精确匹配。"""
+
+    def __init__(self, patterns: Iterable[str]):
+        exact = set()
+        prefixes = []
+        for pattern in patterns:
+            if pattern != "/" and pattern.endswith("/"):
+                prefixes.append(pattern)
+            else:
+                exact.add(pattern)
+        self.exact = frozenset(exact)
+        self.prefixes: Tuple[str, ...] = tuple(prefixes)
+
+    def matches(self, path: str) -> bool:
+        return path in self.exact or (bool(self.prefixes) and path.startswith(self.prefixes))
+
+
+SKIP_AUTH_PATHS = PathMatcher([
+    "/api/v1/session/login",
+    "/api/v1/session/register",
+    "/docs",
+    "/redoc",
+    "/openapi.json",
+    "/health",
+    "/",
+    "/frontend/",
+    "/css/",
+    "/js/",
+    "/pages/",
+    "/public/docs",
+    "/public/redoc",
+    "/public/openapi.json",
+    "/public/info",
+])
+
+API_KEY_REQUIRED_PREFIXES: Tuple[str, ...] = (
+    "/api/v1/proxy",
+)
+
+
+def get_request_id(scope: Scope) -> str:
+    """读取当前请求ID（由 RequestLoggingMiddleware 写入）"""
+    return scope.get("state", {}).get("request_id", "N/A")
+
+
+class RequestLoggingMiddleware:
+    """记录请求耗时，并生成/透传 X-Request-ID。"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = Headers(scope=scope).get(REQUEST_ID_HEADER)
+        request_id = incoming[:64] if incoming else uuid.uuid4().hex[:8]
+        scope.setdefault("state", {})["request_id"] = request_id
+        method = scope["method"]
+        path = scope["path"]
+        start = time.perf_counter()
+        status_code = 500
+        logger.info("[%s] %s %s - received", request_id, method, path)
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)[REQUEST_ID_HEADER] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            logger.exception("[%s] %s %s - unhandled exception: %s", request_id, method, path, exc)
+            raise
+
+        duration_ms = int((time.perf_counter() - start) * 1000)
+        logger.info("[%s] %s %s - completed with %s in %sms", request_id, method, path, status_code, duration_ms)
+
+
+class APIKeyAuthMiddleware:
+    """API Key 鉴权与限流，仅作用于受保护前缀。"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        rate_limiter: Optional[RateLimiter] = None,
+        skip_paths: PathMatcher = SKIP_AUTH_PATHS,
+        protected_prefixes: Tuple[str, ...] = API_KEY_REQUIRED_PREFIXES,
+    ):
+        self.app = app
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.skip_paths = skip_paths
+        self.protected_prefixes = protected_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        request_id = get_request_id(scope)
+
+        if self.skip_paths.matches(path):
+            logger.debug("[%s] %s skipped auth (public path)", request_id, path)
+            await self.app(scope, receive, send)
+            return
+
+        # Only enforce auth under specific prefixes
+        if not path.startswith(self.protected_prefixes):
+            logger.debug("[%s] %s not in protected prefixes, skipping API key check", request_id, path)
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        api_key = headers.get("x-api-key")
+
+        # 仅使用API Key认证，不再支持JWT认证
+        if not api_key:
+            logger.warning("[%s] %s missing API key for protected endpoint", request_id, path)
+            await JSONResponse(status_code=401, content={"detail": "API key required"})(scope, receive, send)
+            return
+
+        logger.debug("[%s] %s attempting API key authentication with key: %s", request_id, path, api_key[:10] + "...")
+        # 缓存记录携带用户状态；命中本地/Redis缓存时不会触达数据库
+        api_key_info = await SessionService.get_api_key_info(api_key)
+        if not api_key_info:
+            logger.warning("[%s] %s invalid API key: %s", request_id, path, api_key)
+            await JSONResponse(status_code=401, content={"detail": "Invalid API key"})(scope, receive, send)
+            return
+        if not api_key_info.get("user_is_active"):
+            logger.warning("[%s] %s API key user inactive or missing (user_id=%s)", request_id, path, api_key_info["user_id"])
+            await JSONResponse(
+                status_code=403, content={"detail": "User is inactive or not found"}
+            )(scope, receive, send)
+            return
+
+        rate_limit = api_key_info.get("rate_limit") or settings.DEFAULT_RATE_LIMIT
+        limit_result = await self.rate_limiter.check(api_key, max_requests=rate_limit)
+        rate_limit_headers = limit_result.headers()
+        if not limit_result.allowed:
+            logger.warning("[%s] %s API key %s exceeded rate limit (%s req/min)", request_id, path, api_key, rate_limit)
+            await JSONResponse(
+                status_code=429, content={"detail": "Rate limit exceeded"}, headers=rate_limit_headers
+            )(scope, receive, send)
+            return
+
+        user = APIKeyPrincipal.from_api_key_info(api_key_info)
+        logger.info("[%s] %s API key authentication successful for user_id=%s", request_id, path, user.id)
+
+        state = scope.setdefault("state", {})
+        state["user"] = user
+        state["user_id"] = user.id
+        state["api_key_id"] = api_key_info["api_key_id"]
+        state["auth_type"] = "api_key"
+        logger.debug("[%s] %s authenticated via api_key (user_id=%s)", request_id, path, user.id)
+
+        start_time = time.perf_counter()
+        status_code = 500
+        process_time = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, process_time
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                process_time = int((time.perf_counter() - start_time) * 1000)
+                response_headers = MutableHeaders(scope=message)
+                response_headers["X-Process-Time"] = str(process_time)
+                for name, value in rate_limit_headers.items():
+                    response_headers[name] = value
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+        # Record API usage (best-effort)
+        try:
+            client = scope.get("client")
+            async with AsyncSessionLocal() as db:
+                await ProxyService.record_api_usage(
+                    db=db,
+                    user_id=api_key_info["user_id"],
+                    api_key_id=api_key_info["api_key_id"],
+                    endpoint=path,
+                    method=scope["method"],
+                    status_code=status_code,
+                    response_time=process_time,
+                    ip_address=client[0] if client else None,
+                    user_agent=headers.get("user-agent", ""),
+                )
+        except Exception as e:
+            logger.error("[%s] Failed to record API usage: %s", request_id, e)
@@ -1,5 +1,8 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Dict, Optional
+from fastapi import HTTPException, status
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from app.core.config import settings
@@ -7,6 +10,21 @@ from app.core.config import settings
 # 密码加密上下文
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt 专用线程池：哈希计算不阻塞事件循环（bcrypt 计算期间释放 GIL）
+PASSWORD_HASH_WORKERS = getattr(settings, "PASSWORD_HASH_WORKERS", 4)
+# 排队等待的哈希任务上限，超出后直接返回 503，避免登录风暴堆积
+PASSWORD_HASH_MAX_QUEUE = getattr(settings, "PASSWORD_HASH_MAX_QUEUE", 256)
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_semaphore: Optional[asyncio.Semaphore] = None
+_hash_stats: Dict[str, int] = {
+    "in_flight": 0,
+    "waiting": 0,
+    "max_waiting": 0,
+    "completed": 0,
+    "rejected": 0,
+}
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码"""
@@ -24,6 +42,51 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def _run_hashing(func: Callable[..., Any], *args: Any) -> Any:
+    """在 bcrypt 线程池中执行，并发数受限，排队过长时拒绝"""
+    global _hash_semaphore
+    if _hash_semaphore is None:
+        _hash_semaphore = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+    if _hash_stats["waiting"] >= PASSWORD_HASH_MAX_QUEUE:
+        _hash_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+    _hash_stats["waiting"] += 1
+    _hash_stats["max_waiting"] = max(_hash_stats["max_waiting"], _hash_stats["waiting"])
+    try:
+        await _hash_semaphore.acquire()
+    finally:
+        _hash_stats["waiting"] -= 1
+
+    _hash_stats["in_flight"] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_stats["in_flight"] -= 1
+        _hash_stats["completed"] += 1
+        _hash_semaphore.release()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """验证密码（在线程池中执行）"""
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """生成密码哈希（在线程池中执行）"""
+    return await _run_hashing(get_password_hash, password)
+
+
+def password_hash_stats() -> Dict[str, int]:
+    """bcrypt 线程池的并发与排队统计"""
+    return {"workers": PASSWORD_HASH_WORKERS, "max_queue": PASSWORD_HASH_MAX_QUEUE, **_hash_stats}
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """创建访问令牌"""
     to_encode = data.copy()
@@ -4,25 +4,46 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import asyncio
 import time
 import logging
 import os
-import uuid
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
 from app.core.config import settings
 from app.core.database import AsyncSessionLocal, engine
+from app.core.middleware import APIKeyAuthMiddleware, RequestLoggingMiddleware
+from app.core.security import password_hash_stats
 from app.api.v1.api import api_router
 from app.api.v1.public_api import public_router
+from app.services.crypto_payment import crypto_payment_service
+from app.services.cryptomus_client import (
+    close_cryptomus_client,
+    cryptomus_client_stats,
+    init_cryptomus_client,
+)
+from app.services.payment_events import payment_events_stats
+from app.services.payment_outbox import PaymentOutboxService
+from app.services.payment_poller import PaymentExpirySweeper, PaymentPoller
 from app.services.session_service import SessionService
-from app.services.proxy_service import ProxyService
-from app.utils.cache import RateLimiter, init_redis
+from app.services.webhook_inbox import WebhookInboxService
+from app.utils import ids, qr
+from app.utils.cache import (
+    CacheService,
+    RateLimiter,
+    close_redis,
+    init_redis,
+    redis_health,
+    run_pubsub_listener,
+    run_redis_supervisor,
+)
 
-api_rate_limiter = RateLimiter()
-API_KEY_REQUIRED_PREFIXES = [
-    "/api/v1/proxy",
-]
+api_rate_limiter = RateLimiter(
+    lease_size=getattr(settings, "RATE_LIMIT_LEASE_SIZE", 0),
+    lease_ttl=getattr(settings, "RATE_LIMIT_LEASE_TTL", 1.0),
+    memory_capacity=getattr(settings, "RATE_LIMIT_MEMORY_CAPACITY", 50000),
+)
 
 # Logging
 # Configure logging (console + rotating file)
@@ -48,10 +69,38 @@ root_logger.addHandler(file_handler)
 async def lifespan(app: FastAPI):
     """App lifecycle management."""
     logger.info("Starting up...")
+    # Business ids embed this worker id; duplicates across processes weaken uniqueness
+    logger.info(f"ID generator worker id: {ids.worker_id()} (pid {os.getpid()})")
 
-    # Initialize Redis (non-fatal if unavailable)
+    # Initialize Redis (non-fatal if unavailable; the supervisor keeps reconnecting)
     await init_redis()
 
+    # Shared pooled HTTP session for Cryptomus (keep-alive, no TLS handshake per call)
+    await init_cryptomus_client()
+
+    # API key bloom filter (non-fatal: lookups fall through to cache/DB until built)
+    try:
+        async with AsyncSessionLocal() as db:
+            await SessionService.load_api_key_filter(db)
+    except Exception as e:
+        logger.warning(f"API key bloom filter build failed: {e}")
+
+    background_tasks = [
+        # Redis health checks, circuit breaker recovery and reconnect with backoff
+        asyncio.create_task(run_redis_supervisor()),
+        # Cross-worker cache invalidation / bloom filter sync
+        asyncio.create_task(run_pubsub_listener()),
+        asyncio.create_task(SessionService.run_api_key_filter_refresher()),
+        # Payment webhook inbox worker (webhooks are acked once persisted)
+        asyncio.create_task(WebhookInboxService.run_worker()),
+        # Cryptomus invoice creation for recharges (requests only write the outbox)
+        asyncio.create_task(PaymentOutboxService.run_worker()),
+        # One batched upstream poll per interval for all pending crypto payments
+        asyncio.create_task(PaymentPoller.run()),
+        # Batched expiry of stale pending payments/orders
+        asyncio.create_task(PaymentExpirySweeper.run()),
+    ]
+
     # IMPORTANT: Do NOT create tables at runtime in production to avoid drift.
     # Database schema should be managed exclusively by Alembic migrations.
     # If you really need runtime create_all (e.g., local dev), enable via env setting.
@@ -68,6 +117,11 @@ async def lifespan(app: FastAPI):
     yield
 
     logger.info("Shutting down...")
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await close_cryptomus_client()
+    await close_redis()
 
 
 # Create FastAPI app
@@ -121,141 +175,10 @@ app.add_middleware(
 )
 
 
-# Request logging middleware (runs first - defined last)
-@app.middleware("http")
-async def request_logging_middleware(request: Request, call_next):
-    """Log each incoming request with timing information."""
-    request_id = uuid.uuid4().hex[:8]
-    request.state.request_id = request_id
-    start = time.time()
-    logger.info("[%s] %s %s - received", request_id, request.method, request.url.path)
-
-    try:
-        response = await call_next(request)
-    except Exception as exc:
-        logger.exception("[%s] %s %s - unhandled exception: %s", request_id, request.method, request.url.path, exc)
-        raise
-
-    duration_ms = int((time.time() - start) * 1000)
-    logger.info("[%s] %s %s - completed with %s in %sms", request_id, request.method, request.url.path, response.status_code, duration_ms)
-    return response
-
-
-# API key auth middleware (runs second - defined first)
-@app.middleware("http")
-async def api_key_auth_middleware(request: Request, call_next):
-    """API key auth and rate limit middleware."""
-    request_id = getattr(request.state, "request_id", "N/A")
-    path = request.url.path
-    
-    # Skip auth for these exact paths and prefixes
-    skip_auth_patterns = [
-        "/api/v1/session/login",
-        "/api/v1/session/register",
-        "/docs",
-        "/redoc",
-        "/openapi.json",
-        "/health",
-        "/",
-        "/frontend/",
-        "/css/",
-        "/js/",
-        "/pages/",
-        "/public/docs",
-        "/public/redoc",
-        "/public/openapi.json",
-        "/public/info",
-    ]
-
-    # Check if path matches any skip pattern (exact match or prefix match)
-    should_skip = False
-    for pattern in skip_auth_patterns:
-        if pattern == '/':
-            # Special case: root path should only match exactly
-            if path == pattern:
-                should_skip = True
-                break
-        elif pattern.endswith('/'):
-            # Directory prefix match
-            if path.startswith(pattern):
-                should_skip = True
-                break
-        else:
-            # Exact match
-            if path == pattern:
-                should_skip = True
-                break
-
-    if should_skip:
-        logger.debug("[%s] %s skipped auth (public path)", request_id, path)
-        return await call_next(request)
-
-    # Only enforce auth under specific prefixes
-    if not any(path.startswith(prefix) for prefix in API_KEY_REQUIRED_PREFIXES):
-        logger.debug("[%s] %s not in protected prefixes, skipping API key check", request_id, path)
-        return await call_next(request)
-
-    api_key_info = None
-    user = None
-    auth_type = None
-    api_key = request.headers.get("X-API-Key")
-
-    # 仅使用API Key认证，不再支持JWT认证
-    if api_key:
-        # API key认证
-        logger.debug("[%s] %s attempting API key authentication with key: %s", request_id, path, api_key[:10] + "...")
-        async with AsyncSessionLocal() as db:
-            api_key_info = await SessionService.get_api_key_info(db, api_key)
-            if not api_key_info:
-                logger.warning("[%s] %s invalid API key: %s", request_id, path, api_key)
-                return JSONResponse(status_code=401, content={"detail": "Invalid API key"})
-            user = await SessionService.get_user_by_id(db, api_key_info["user_id"])
-            if not user or not user.is_active:
-                logger.warning("[%s] %s API key user inactive or missing (user_id=%s)", request_id, path, api_key_info["user_id"])
-                return JSONResponse(
-                    status_code=403, content={"detail": "User is inactive or not found"}
-                )
-        rate_limit = api_key_info.get("rate_limit") or settings.DEFAULT_RATE_LIMIT
-        if not await api_rate_limiter.is_allowed(api_key, max_requests=rate_limit):
-            logger.warning("[%s] %s API key %s exceeded rate limit (%s req/min)", request_id, path, api_key, rate_limit)
-            return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded"})
-        auth_type = "api_key"
-        logger.info("[%s] %s API key authentication successful for user_id=%s", request_id, path, user.id)
-    else:
-        # 没有API Key，认证失败
-        logger.warning("[%s] %s missing API key for protected endpoint", request_id, path)
-        return JSONResponse(status_code=401, content={"detail": "API key required"})
-
-    request.state.user = user
-    request.state.user_id = user.id
-    request.state.api_key_id = api_key_info["api_key_id"] if api_key_info else None
-    request.state.auth_type = auth_type
-    logger.debug("[%s] %s authenticated via %s (user_id=%s)", request_id, path, auth_type, user.id)
-
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = int((time.time() - start_time) * 1000)
-
-    if api_key_info:
-        # Record API usage (best-effort)
-        try:
-            async with AsyncSessionLocal() as db:
-                await ProxyService.record_api_usage(
-                    db=db,
-                    user_id=api_key_info["user_id"],
-                    api_key_id=api_key_info["api_key_id"],
-                    endpoint=str(request.url.path),
-                    method=request.method,
-                    status_code=response.status_code,
-                    response_time=process_time,
-                    ip_address=request.client.host if request.client else None,
-                    user_agent=request.headers.get("user-agent", ""),
-                )
-        except Exception as e:
-            logger.error("[%s] Failed to record API usage: %s", request_id, e)
-
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+# Pure ASGI middlewares (no BaseHTTPMiddleware task/queue overhead, streaming-safe).
+# Starlette runs the last added middleware first: request logging wraps API key auth.
+app.add_middleware(APIKeyAuthMiddleware, rate_limiter=api_rate_limiter)
+app.add_middleware(RequestLoggingMiddleware)
 
 
 # Exception handlers
@@ -278,7 +201,23 @@ async def general_exception_handler(request: Request, exc: Exception):
 @app.get("/health", include_in_schema=False)
 async def health_check():
     """Health check."""
-    return {"status": "healthy", "version": settings.VERSION, "timestamp": time.time()}
+    return {
+        "status": "healthy",
+        "version": settings.VERSION,
+        "timestamp": time.time(),
+        "rate_limiter_memory": api_rate_limiter.memory_stats(),
+        "password_hashing": password_hash_stats(),
+        "redis": redis_health(),
+        "cache": CacheService.stats(),
+        "cryptomus": cryptomus_client_stats(),
+        "payment_store": crypto_payment_service.store_stats(),
+        "webhook_inbox": WebhookInboxService.stats(),
+        "payment_outbox": PaymentOutboxService.stats(),
+        "payment_poller": PaymentPoller.stats(),
+        "payment_expiry": PaymentExpirySweeper.stats(),
+        "payment_events": payment_events_stats(),
+        "qr_cache": qr.cache_stats(),
+    }
 
 
 @app.get("/", include_in_schema=False)
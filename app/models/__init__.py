@@ -1,5 +1,5 @@
 from app.models.user import User, APIKey
 from app.models.proxy import ProxyProduct, ProxyOrder, APIUsage
-from app.models.order import Order, Payment, Transaction, BalanceLog
+from app.models.order import Order, Payment, Transaction, BalanceLog, WebhookEvent, DepositWallet, PaymentOutbox
 
-__all__ = ["User", "APIKey", "ProxyProduct", "ProxyOrder", "APIUsage", "Order", "Payment", "Transaction", "BalanceLog"]
+__all__ = ["User", "APIKey", "ProxyProduct", "ProxyOrder", "APIUsage", "Order", "Payment", "Transaction", "BalanceLog", "WebhookEvent", "DepositWallet", "PaymentOutbox"]
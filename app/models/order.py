@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, DECIMAL, Text, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, DECIMAL, Text, ForeignKey, Enum, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -56,6 +56,10 @@ class Order(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # 过期清理按 (status, expires_at) 范围扫描
+        Index("ix_payments_status_expires_at", "status", "expires_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     payment_id = Column(String(64), unique=True, index=True, nullable=False)
@@ -82,6 +86,10 @@ class Payment(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # 每个订单每种类型只记一笔，重复入账由约束拦截
+        UniqueConstraint("order_id", "type", name="uq_transactions_order_type"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     transaction_id = Column(String(64), unique=True, index=True, nullable=False)
@@ -101,6 +109,9 @@ class Transaction(Base):
 
 class BalanceLog(Base):
     __tablename__ = "balance_logs"
+    __table_args__ = (
+        UniqueConstraint("related_order_id", "type", name="uq_balance_logs_order_type"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -117,3 +128,64 @@ class BalanceLog(Base):
     user = relationship("User", foreign_keys=[user_id], back_populates="balance_logs")
     related_order = relationship("Order")
     admin = relationship("User", foreign_keys=[admin_id])
+
+
+class WebhookEvent(Base):
+    """支付回调收件箱：回调验签后先落库并立即应答，由后台任务按支付顺序处理"""
+    __tablename__ = "webhook_events"
+    __table_args__ = (
+        Index("ix_webhook_events_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String(20), nullable=False, default="cryptomus")
+    event_key = Column(String(64), unique=True, index=True, nullable=False)  # 回调原文哈希，重复推送去重
+    payment_ref = Column(String(64), nullable=False, index=True)  # order_id（缺失时为 uuid）
+    payload = Column(Text, nullable=False)
+    status = Column(String(20), default="pending", nullable=False)  # pending, processing, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime(timezone=True))
+    claimed_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True))
+
+
+class PaymentOutbox(Base):
+    """支付发件箱：充值请求在同一事务写入订单、支付与待创建的上游账单，由后台任务调用 Cryptomus"""
+    __tablename__ = "payment_outbox"
+    __table_args__ = (
+        Index("ix_payment_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    payment_id = Column(String(64), unique=True, index=True, nullable=False)  # 一笔支付只对应一个上游账单
+    kind = Column(String(30), nullable=False, default="create_invoice")
+    payload = Column(Text, nullable=False)  # 创建账单所需参数（JSON）
+    status = Column(String(20), default="pending", nullable=False)  # pending, processing, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime(timezone=True))
+    claimed_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True))
+
+
+class DepositWallet(Base):
+    """用户静态充值钱包：每个用户每个币种/网络一个固定地址，入账完全由回调驱动"""
+    __tablename__ = "deposit_wallets"
+    __table_args__ = (
+        UniqueConstraint("user_id", "currency", "network", name="uq_deposit_wallets_user_currency_network"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    currency = Column(String(10), nullable=False)
+    network = Column(String(20), nullable=False)
+    address = Column(String(255), nullable=False)
+    wallet_uuid = Column(String(64))  # Cryptomus 钱包 uuid（停用钱包时使用）
+    order_id = Column(String(64), unique=True, index=True, nullable=False)  # 创建钱包时传给 Cryptomus 的 order_id，回调据此定位
+    is_active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    user = relationship("User")
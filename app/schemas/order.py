@@ -152,6 +152,14 @@ class RechargeResponse(BaseModel):
     crypto_payment: Optional[Dict[str, Any]] = None
 
 
+class DepositWalletResponse(BaseModel):
+    currency: str
+    network: str
+    address: str
+    qr_code: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
 # 支付回调Schema
 class PaymentCallback(BaseModel):
     payment_id: str
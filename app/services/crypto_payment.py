@@ -3,18 +3,26 @@
 集成Cryptomus支付网关，支持真实的加密货币支付处理
 """
 
+import asyncio
 import uuid
 import logging
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 
 from app.services.cryptomus_client import get_cryptomus_client
+from app.services.payment_events import publish_payment_event
 from app.core.config import settings
-from app.utils.cache import CacheService
+from app.utils import qr
+from app.utils.cache import CacheService, LocalTTLCache, cached
 
 logger = logging.getLogger(__name__)
 
+CURRENCIES_CACHE_TTL = getattr(settings, "CRYPTO_CURRENCIES_CACHE_TTL", 600)
+# 逻辑过期后仍可返回旧值的窗口：期间后台刷新，Cryptomus 故障时继续使用旧值
+CURRENCIES_STALE_TTL = getattr(settings, "CRYPTO_CURRENCIES_STALE_TTL", 86400)
+CURRENCIES_LOCAL_TTL = getattr(settings, "CRYPTO_CURRENCIES_LOCAL_TTL", 30)
+
 
 class CryptoPaymentService:
     """加密货币支付服务 - 集成Cryptomus"""
@@ -36,26 +44,58 @@ class CryptoPaymentService:
             }
         }
         
-        # 内部支付会话存储（用于缓存和状态跟踪）
-        self._payments: Dict[str, Dict] = {}
         self.cache_ttl_seconds = 2 * 60 * 60  # 2小时缓存
+        # 进程内支付副本（Redis 为共享数据源，这里只在 Redis 不可用时兜底）：
+        # 有界 LRU + TTL，终态支付只保留很短时间
+        self.final_payment_ttl_seconds = getattr(settings, "PAYMENT_LOCAL_FINAL_TTL", 60)
+        self._payments = LocalTTLCache(
+            maxsize=getattr(settings, "PAYMENT_LOCAL_CACHE_SIZE", 5000),
+            ttl=self.cache_ttl_seconds,
+            register=False,
+        )
+        # 币种列表：很少变化，进程内只保留很短时间，过期后走 Redis 缓存
+        self._currencies_local = LocalTTLCache(maxsize=1, ttl=CURRENCIES_LOCAL_TTL)
+        self._last_currencies: Optional[Dict[str, Any]] = None
 
     def _cache_key(self, payment_id: str) -> str:
         return f"payment:{payment_id}"
 
-    async def _save_payment(self, payment_id: str, data: Dict[str, Any]) -> None:
-        """保存支付信息到内存+Redis"""
-        self._payments[payment_id] = data
+    def _remember_local(self, payment_id: str, data: Dict[str, Any]) -> None:
+        ttl = self.final_payment_ttl_seconds if self._is_final_status(data.get('status', '')) else None
+        self._payments.set(payment_id, data, ttl=ttl)
+
+    async def _save_payment(self, payment_id: str, data: Dict[str, Any], notify: bool = True) -> None:
+        """保存支付信息到内存+Redis，并向状态推送的订阅者发布更新"""
+        self._remember_local(payment_id, data)
         await CacheService.set(self._cache_key(payment_id), data, ttl=self.cache_ttl_seconds)
+        if notify:
+            await publish_payment_event(payment_id, data)
 
     async def _load_payment(self, payment_id: str) -> Optional[Dict[str, Any]]:
         """优先从Redis读取，再回退内存"""
         cached = await CacheService.get(self._cache_key(payment_id))
         if cached:
-            self._payments[payment_id] = cached
+            self._remember_local(payment_id, cached)
             return cached
         return self._payments.get(payment_id)
 
+    async def forget_payments(self, payment_ids: List[str]) -> None:
+        """删除已结束支付的缓存副本（Redis + 进程内）"""
+        if not payment_ids:
+            return
+        await CacheService.delete_many([self._cache_key(payment_id) for payment_id in payment_ids])
+        for payment_id in payment_ids:
+            self._payments.delete(payment_id)
+
+    def store_stats(self) -> Dict[str, Any]:
+        """进程内支付副本的容量统计（/health 使用）"""
+        return {
+            "size": len(self._payments),
+            "maxsize": self._payments.maxsize,
+            "evictions": self._payments.evictions,
+            "final_ttl": self.final_payment_ttl_seconds,
+        }
+
     async def get_cached_payment(self, payment_id: str) -> Optional[Dict[str, Any]]:
         """获取已存储的支付信息（不调用上游）"""
         return await self._load_payment(payment_id)
@@ -99,6 +139,42 @@ class CryptoPaymentService:
             success_url
         )
     
+    async def remember_pending_invoice(
+        self,
+        payment_id: str,
+        amount: float,
+        currency: str,
+        network: str,
+        expires_at: datetime,
+        required_confirmations: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        上游账单创建前的占位支付信息（账单由发件箱后台任务创建）
+
+        monitor/SSE 先读到该占位；provider 不是 cryptomus，后台轮询不会为其查询上游。
+        """
+        payment_info = {
+            'payment_id': payment_id,
+            'order_id': payment_id,
+            'wallet_address': None,
+            'address_qr_code': None,
+            'crypto_amount': None,
+            'crypto_currency': currency.upper(),
+            'usd_amount': str(amount),
+            'network': network.upper(),
+            'payment_url': None,
+            'status': 'pending',
+            'cryptomus_status': 'creating',
+            'confirmations': 0,
+            'required_confirmations': required_confirmations,
+            'expires_at': expires_at.isoformat(),
+            'created_at': datetime.utcnow().isoformat(),
+            'updated_at': datetime.utcnow().isoformat(),
+            'provider': 'cryptomus_pending',
+        }
+        await self._save_payment(payment_id, payment_info, notify=False)
+        return payment_info
+
     async def _create_cryptomus_payment(
         self,
         amount: float,
@@ -189,7 +265,7 @@ class CryptoPaymentService:
         }
 
         # 缓存支付信息（内存 + Redis）
-        await self._save_payment(payment_id, {**payment_info, 'cryptomus_data': result})
+        await self._save_payment(payment_id, {**payment_info, 'cryptomus_data': result}, notify=False)
 
         logger.info(f"Created Cryptomus payment: {payment_id} for {amount} USD")
         return payment_info
@@ -240,10 +316,82 @@ class CryptoPaymentService:
         }
         
         # 缓存支付信息（内存 + Redis）
-        await self._save_payment(payment_id, payment_info)
+        await self._save_payment(payment_id, payment_info, notify=False)
         
         return payment_info
     
+    def _merge_cryptomus_result(self, cached_payment: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """将 Cryptomus payment/info 或 payment/list 返回的条目合并进已存储的支付信息"""
+        raw_status = result.get('payment_status') or result.get('status') or 'check'
+        updated_confirmations = self._parse_int(result.get('confirmations'))
+        updated_required = self._parse_int(
+            result.get('required_confirmations') or result.get('confirmations_required')
+        )
+        return {
+            **cached_payment,
+            'status': self._convert_cryptomus_status(raw_status),
+            'cryptomus_status': raw_status,
+            'confirmations': updated_confirmations if updated_confirmations is not None else cached_payment.get('confirmations', 0),
+            'required_confirmations': updated_required if updated_required is not None else cached_payment.get('required_confirmations'),
+            'transaction_hash': result.get('txid') or cached_payment.get('transaction_hash'),
+            'wallet_address': result.get('address') or cached_payment.get('wallet_address'),
+            'address_qr_code': result.get('address_qr_code') or cached_payment.get('address_qr_code'),
+            'network': result.get('network') or cached_payment.get('network'),
+            'payment_url': result.get('url') or cached_payment.get('payment_url'),
+            'expires_at': result.get('expired_at') or cached_payment.get('expires_at'),
+            'payer_amount': result.get('payer_amount') or cached_payment.get('payer_amount'),
+            'payer_currency': result.get('payer_currency') or cached_payment.get('payer_currency'),
+            'payment_amount': result.get('payment_amount') or cached_payment.get('payment_amount'),
+            'merchant_amount': result.get('merchant_amount') or cached_payment.get('merchant_amount'),
+            'is_final': result.get('is_final') if result.get('is_final') is not None else cached_payment.get('is_final'),
+            'updated_at': datetime.utcnow().isoformat()
+        }
+
+    def _status_changed(self, before: Dict[str, Any], after: Dict[str, Any]) -> bool:
+        """轮询结果只有在前端可见的状态字段变化时才推送"""
+        fields = ('status', 'cryptomus_status', 'confirmations', 'transaction_hash', 'wallet_address')
+        return any(before.get(field) != after.get(field) for field in fields)
+
+    def _needs_upstream_check(self, cached_payment: Optional[Dict[str, Any]]) -> bool:
+        """仅未到终态的 Cryptomus 支付需要查询上游"""
+        return bool(
+            cached_payment
+            and self.use_cryptomus
+            and cached_payment.get('provider') == 'cryptomus'
+            and not self._is_final_status(cached_payment.get('status', ''))
+        )
+
+    def _uncached_stub(self, payment_id: str) -> Dict[str, Any]:
+        """缓存缺失时用于查询上游的最小支付信息（order_id 即我方 payment_id）"""
+        return {
+            'payment_id': payment_id,
+            'order_id': payment_id,
+            'provider': 'cryptomus',
+            'status': 'pending',
+            'cryptomus_status': 'check',
+            'confirmations': 0,
+        }
+
+    async def _fetch_cryptomus_status(self, client, payment_id: str, cached_payment: Dict[str, Any]) -> Dict[str, Any]:
+        """单笔查询 payment/info 并写回缓存；失败返回原缓存"""
+        # 优先使用 Cryptomus 返回的 uuid；否则使用下单时传入的 order_id（即我方 payment_id）
+        lookup_kwargs = {}
+        if cached_payment.get('cryptomus_uuid'):
+            lookup_kwargs['payment_id'] = cached_payment['cryptomus_uuid']
+        else:
+            lookup_kwargs['order_id'] = cached_payment.get('order_id') or payment_id
+
+        response = await client.get_payment_info(**lookup_kwargs)
+        if response.get('state') not in (0, None):
+            logger.warning(f"Failed to get payment status: {response.get('message', 'Unknown error')}")
+            return cached_payment
+
+        updated_payment = self._merge_cryptomus_result(cached_payment, response.get('result', {}))
+        await self._save_payment(
+            payment_id, updated_payment, notify=self._status_changed(cached_payment, updated_payment)
+        )
+        return updated_payment
+
     async def get_payment_status(self, payment_id: str) -> Dict[str, Any]:
         """
         获取支付状态
@@ -259,63 +407,107 @@ class CryptoPaymentService:
         if not cached_payment:
             return {'payment_id': payment_id, 'status': 'not_found'}
         
-        # 如果是模拟支付，返回缓存状态
-        if cached_payment.get('provider') == 'mock':
+        # 模拟支付或已到终态的支付直接返回缓存，不再查询上游
+        if not self._needs_upstream_check(cached_payment):
             return cached_payment
-        
-        # 如果是Cryptomus支付，查询实时状态
-        if cached_payment.get('provider') == 'cryptomus' and self.use_cryptomus:
-            try:
-                # 优先使用 Cryptomus 返回的 uuid；否则使用下单时传入的 order_id（即我方 payment_id）
-                lookup_kwargs = {}
-                if cached_payment.get('cryptomus_uuid'):
-                    lookup_kwargs['payment_id'] = cached_payment['cryptomus_uuid']
-                else:
-                    lookup_kwargs['order_id'] = cached_payment.get('order_id') or payment_id
-
-                async with get_cryptomus_client() as client:
-                    response = await client.get_payment_info(**lookup_kwargs)
-                
-                if response.get('state') not in (0, None):
-                    logger.warning(f"Failed to get payment status: {response.get('message', 'Unknown error')}")
-                    return cached_payment
-                
-                result = response.get('result', {})
-                
-                # 更新缓存状态
-                raw_status = result.get('payment_status') or result.get('status') or 'check'
-                updated_confirmations = self._parse_int(result.get('confirmations'))
-                updated_required = self._parse_int(
-                    result.get('required_confirmations') or result.get('confirmations_required')
-                )
-                updated_payment = {
-                    **cached_payment,
-                    'status': self._convert_cryptomus_status(raw_status),
-                    'cryptomus_status': raw_status,
-                    'confirmations': updated_confirmations if updated_confirmations is not None else cached_payment.get('confirmations', 0),
-                    'required_confirmations': updated_required if updated_required is not None else cached_payment.get('required_confirmations'),
-                    'transaction_hash': result.get('txid') or cached_payment.get('transaction_hash'),
-                    'wallet_address': result.get('address') or cached_payment.get('wallet_address'),
-                    'address_qr_code': result.get('address_qr_code') or cached_payment.get('address_qr_code'),
-                    'network': result.get('network') or cached_payment.get('network'),
-                    'payment_url': result.get('url') or cached_payment.get('payment_url'),
-                    'expires_at': result.get('expired_at') or cached_payment.get('expires_at'),
-                    'payer_amount': result.get('payer_amount') or cached_payment.get('payer_amount'),
-                    'payer_currency': result.get('payer_currency') or cached_payment.get('payer_currency'),
-                    'payment_amount': result.get('payment_amount') or cached_payment.get('payment_amount'),
-                    'merchant_amount': result.get('merchant_amount') or cached_payment.get('merchant_amount'),
-                    'is_final': result.get('is_final') if result.get('is_final') is not None else cached_payment.get('is_final'),
-                    'updated_at': datetime.utcnow().isoformat()
-                }
-                
-                await self._save_payment(payment_id, updated_payment)
-                return updated_payment
-                
-            except Exception as e:
-                logger.error(f"Failed to get Cryptomus payment status: {str(e)}")
-                return cached_payment
-        
-        return cached_payment
+
+        try:
+            async with get_cryptomus_client() as client:
+                return await self._fetch_cryptomus_status(client, payment_id, cached_payment)
+        except Exception as e:
+            logger.error(f"Failed to get Cryptomus payment status: {str(e)}")
+            return cached_payment
+
+    async def payments_needing_check(self, payment_ids: List[str]) -> List[str]:
+        """返回其中仍需向上游核实状态的支付ID（未到终态的 Cryptomus 支付；缓存缺失的无法判断，同样需要核实）"""
+        if not self.use_cryptomus:
+            return []
+        keys = [self._cache_key(payment_id) for payment_id in payment_ids]
+        cached = await CacheService.get_many(keys)
+        needing = []
+        for payment_id, key in zip(payment_ids, keys):
+            payment = cached.get(key) or self._payments.get(payment_id)
+            if payment is None or self._needs_upstream_check(payment):
+                needing.append(payment_id)
+        return needing
+
+    async def refresh_payments(
+        self,
+        payment_ids: List[str],
+        concurrency: int = 5,
+        history_threshold: int = 20,
+        history_pages: int = 5,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        批量刷新未到终态的支付状态（后台轮询使用）
+
+        待查数量达到 history_threshold 时先翻页 payment/list 批量匹配，
+        剩余的再以有限并发逐笔查询 payment/info；终态支付不会查询上游，
+        缓存缺失的支付按 order_id 查询后写回缓存。
+
+        Returns:
+            支付ID -> 最新支付信息（仅包含本次成功从上游取得状态的支付）
+        """
+        keys = [self._cache_key(payment_id) for payment_id in payment_ids]
+        cached = await CacheService.get_many(keys)
+        pending: Dict[str, Dict[str, Any]] = {}
+        for payment_id, key in zip(payment_ids, keys):
+            payment = cached.get(key) or self._payments.get(payment_id)
+            if payment is None and self.use_cryptomus:
+                # 缓存已过期或被清空：按 order_id 查询上游，结果写回缓存
+                payment = self._uncached_stub(payment_id)
+            if self._needs_upstream_check(payment):
+                pending[payment_id] = payment
+        if not pending:
+            return {}
+
+        refreshed: Dict[str, Dict[str, Any]] = {}
+        async with get_cryptomus_client() as client:
+            if len(pending) >= history_threshold:
+                remaining = set(pending)
+                cursor = None
+                for _ in range(history_pages):
+                    try:
+                        response = await client.get_payment_history(cursor=cursor)
+                    except Exception as e:
+                        logger.warning(f"Cryptomus payment history poll failed: {str(e)}")
+                        break
+                    result = response.get('result') or {}
+                    for item in result.get('items') or []:
+                        payment_id = item.get('order_id')
+                        if payment_id in remaining:
+                            remaining.discard(payment_id)
+                            refreshed[payment_id] = self._merge_cryptomus_result(pending[payment_id], item)
+                    cursor = (result.get('paginate') or {}).get('nextCursor')
+                    if not remaining or not cursor:
+                        break
+                if refreshed:
+                    await CacheService.set_many(
+                        {self._cache_key(payment_id): data for payment_id, data in refreshed.items()},
+                        ttl=self.cache_ttl_seconds,
+                    )
+                    for payment_id, data in refreshed.items():
+                        self._remember_local(payment_id, data)
+                        if self._status_changed(pending[payment_id], data):
+                            await publish_payment_event(payment_id, data)
+
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+
+            async def fetch(payment_id: str) -> None:
+                async with semaphore:
+                    try:
+                        payment = await self._fetch_cryptomus_status(
+                            client, payment_id, pending[payment_id]
+                        )
+                    except Exception as e:
+                        logger.warning(f"Failed to poll Cryptomus payment {payment_id}: {str(e)}")
+                        return
+                    # 上游返回错误时原样返回缓存对象：视为未检查，不计入结果
+                    if payment is not pending[payment_id]:
+                        refreshed[payment_id] = payment
+
+            await asyncio.gather(*(fetch(payment_id) for payment_id in pending if payment_id not in refreshed))
+        return refreshed
     
     async def update_payment_status(
         self,
@@ -337,7 +529,7 @@ class CryptoPaymentService:
         Returns:
             更新后的支付信息
         """
-        payment = await self._load_payment(payment_id) or {'payment_id': payment_id}
+        payment = dict(await self._load_payment(payment_id) or {'payment_id': payment_id})
         
         # 已是终态且状态未变化，直接返回（防重放）
         if self._is_final_status(payment.get('status', '')) and self._is_final_status(status) and status == payment.get('status'):
@@ -363,6 +555,19 @@ class CryptoPaymentService:
         
         return payment
     
+    def qr_payload(self, wallet_address: str, crypto_amount: str, currency: str) -> str:
+        """生成二维码内容（支付URI）"""
+        if currency.upper() == 'BTC':
+            return f"bitcoin:{wallet_address}?amount={crypto_amount}"
+        if currency.upper() in ['ETH', 'USDT', 'USDC']:
+            # 转换为wei单位（对于ETH相关代币）
+            if currency.upper() == 'ETH':
+                return f"ethereum:{wallet_address}?value={int(float(crypto_amount) * 1e18)}"
+            return f"ethereum:{wallet_address}"
+        if currency.upper() == 'TRX':
+            return f"tron:{wallet_address}?amount={crypto_amount}"
+        return wallet_address
+
     def generate_qr_code(self, payment_id: str, wallet_address: str, crypto_amount: str, currency: str) -> str:
         """
         生成支付二维码（仅在Cryptomus未返回时使用）
@@ -374,23 +579,13 @@ class CryptoPaymentService:
             currency: 加密货币类型
             
         Returns:
-            二维码数据URL
+            二维码数据URL（本地渲染的 SVG data URI）
         """
-        # 生成支付URI
-        if currency.upper() == 'BTC':
-            qr_data = f"bitcoin:{wallet_address}?amount={crypto_amount}"
-        elif currency.upper() in ['ETH', 'USDT', 'USDC']:
-            # 转换为wei单位（对于ETH相关代币）
-            if currency.upper() == 'ETH':
-                qr_data = f"ethereum:{wallet_address}?value={int(float(crypto_amount) * 1e18)}"
-            else:
-                qr_data = f"ethereum:{wallet_address}"
-        elif currency.upper() == 'TRX':
-            qr_data = f"tron:{wallet_address}?amount={crypto_amount}"
-        else:
-            qr_data = wallet_address
-        
-        # 使用外部QR码服务生成二维码（仅在Cryptomus未返回二维码时使用）
+        qr_data = self.qr_payload(wallet_address, crypto_amount, currency)
+        if qr.available():
+            return qr.render(qr_data, "svg").data_uri()
+
+        # 未安装 segno 时回退到外部QR码服务
         import urllib.parse
         encoded_qr_data = urllib.parse.quote(qr_data, safe='')
         return f"https://api.qrserver.com/v1/create-qr-code/?size=220x220&data={encoded_qr_data}"
@@ -405,7 +600,7 @@ class CryptoPaymentService:
         Returns:
             取消结果
         """
-        payment = self._payments.get(payment_id, {})
+        payment = dict(await self._load_payment(payment_id) or {'payment_id': payment_id})
         payment.update({
             'status': 'cancelled',
             'cancelled_at': datetime.utcnow().isoformat(),
@@ -418,6 +613,9 @@ class CryptoPaymentService:
     async def get_supported_currencies(self) -> Dict[str, Any]:
         """
         获取支持的加密货币列表
+
+        进程内短缓存 -> Redis（过期后先返回旧值并后台刷新）-> Cryptomus；
+        Cryptomus 不可用时返回最近一次成功的结果。
         
         Returns:
             支持的货币信息
@@ -425,7 +623,27 @@ class CryptoPaymentService:
         if not self.use_cryptomus:
             raise RuntimeError("Cryptomus 未配置，无法获取可用币种")
 
-        # 直接从 Cryptomus 拉取，失败则抛出异常（不做本地兜底）
+        local = self._currencies_local.get("currencies")
+        if local is not None:
+            return local
+        try:
+            currencies = await self._load_supported_currencies()
+        except Exception as e:
+            if self._last_currencies is None:
+                raise
+            logger.warning(f"Cryptomus services unavailable, serving last known currencies: {str(e)}")
+            return self._last_currencies
+        self._currencies_local.set("currencies", currencies)
+        self._last_currencies = currencies
+        return currencies
+
+    @cached(
+        key=lambda service: "crypto:currencies",
+        ttl=CURRENCIES_CACHE_TTL,
+        stale_ttl=CURRENCIES_STALE_TTL,
+    )
+    async def _load_supported_currencies(self) -> Dict[str, Any]:
+        """从 Cryptomus 拉取服务列表并过滤出允许的币种/网络"""
         async with get_cryptomus_client() as client:
             response = await client.get_services()
 
@@ -3,14 +3,16 @@ Cryptomus支付网关Python客户端
 提供与Cryptomus API的完整集成
 """
 
+import asyncio
 import hashlib
 import hmac
 import json
 import logging
 import base64
+import time
 from typing import Dict, Optional, Any, List
 from decimal import Decimal
-from urllib.parse import quote
+from urllib.parse import quote, urlparse
 import aiohttp
 from datetime import datetime
 
@@ -18,6 +20,36 @@ from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 连接池与超时配置（应用级共享会话，复用 TLS 连接）
+CRYPTOMUS_HTTP_POOL_SIZE = getattr(settings, "CRYPTOMUS_HTTP_POOL_SIZE", 20)
+CRYPTOMUS_HTTP_KEEPALIVE = getattr(settings, "CRYPTOMUS_HTTP_KEEPALIVE", 60)
+CRYPTOMUS_HTTP_TIMEOUT = getattr(settings, "CRYPTOMUS_HTTP_TIMEOUT", 15)
+CRYPTOMUS_HTTP_CONNECT_TIMEOUT = getattr(settings, "CRYPTOMUS_HTTP_CONNECT_TIMEOUT", 5)
+
+# 按接口统计的请求次数/错误数/耗时（毫秒）
+_request_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _record_request(endpoint: str, elapsed_ms: float, ok: bool) -> None:
+    stats = _request_stats.get(endpoint)
+    if stats is None:
+        stats = _request_stats[endpoint] = {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+    stats["count"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    if not ok:
+        stats["errors"] += 1
+
+
+def _new_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=CRYPTOMUS_HTTP_POOL_SIZE,
+        keepalive_timeout=CRYPTOMUS_HTTP_KEEPALIVE,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(total=CRYPTOMUS_HTTP_TIMEOUT, connect=CRYPTOMUS_HTTP_CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
 
 class CryptomusClient:
     """Cryptomus支付网关客户端"""
@@ -39,16 +71,25 @@ class CryptomusClient:
             raise ValueError("CRYPTOMUS_API_KEY and CRYPTOMUS_MERCHANT_UUID must be set")
         
         self.session = None
+        # 应用级共享客户端：async with 不会关闭会话，由 close_cryptomus_client 统一关闭
+        self.shared = False
     
     async def __aenter__(self):
         """异步上下文管理器入口"""
-        self.session = aiohttp.ClientSession()
+        if self.session is None or self.session.closed:
+            self.session = _new_session()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """异步上下文管理器出口"""
-        if self.session:
+        if self.session and not self.shared:
+            await self.session.close()
+            self.session = None
+
+    async def close(self) -> None:
+        if self.session and not self.session.closed:
             await self.session.close()
+        self.session = None
     
     def _generate_signature(self, raw_body: bytes, key: str) -> str:
         """
@@ -115,9 +156,12 @@ class CryptomusClient:
         headers['sign'] = self._generate_signature(raw_body, self.api_key)
         
         # 确保session存在
-        if self.session is None:
-            self.session = aiohttp.ClientSession()
+        if self.session is None or self.session.closed:
+            self.session = _new_session()
         
+        metric_key = urlparse(url).path
+        started = time.perf_counter()
+        ok = False
         try:
             async with self.session.request(method, url, headers=headers, data=raw_body) as response:
                 response_data = await response.json()
@@ -137,14 +181,17 @@ class CryptomusClient:
                     logger.error(f"Cryptomus business error: {error_msg}")
                     raise Exception(f"Cryptomus business error: {error_msg}")
                 
+                ok = True
                 return response_data
                 
-        except aiohttp.ClientError as e:
-            logger.error(f"Cryptomus API request failed: {str(e)}")
-            raise Exception(f"Network error: {str(e)}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Cryptomus API request failed: {str(e) or type(e).__name__}")
+            raise Exception(f"Network error: {str(e) or type(e).__name__}")
         except Exception as e:
             logger.error(f"Cryptomus API unexpected error: {str(e)}")
             raise
+        finally:
+            _record_request(metric_key, (time.perf_counter() - started) * 1000, ok)
     
     async def create_payment(
         self,
@@ -425,9 +472,52 @@ class CryptomusClient:
             return False
 
 
+# 应用级共享客户端（lifespan 中创建），未初始化时回退为每次新建
+_shared_client: Optional[CryptomusClient] = None
+
+
+async def init_cryptomus_client() -> None:
+    """创建共享的 Cryptomus 客户端（未配置密钥时跳过）"""
+    global _shared_client
+    if not (settings.CRYPTOMUS_API_KEY and settings.CRYPTOMUS_MERCHANT_UUID):
+        return
+    client = CryptomusClient()
+    client.session = _new_session()
+    client.shared = True
+    _shared_client = client
+
+
+async def close_cryptomus_client() -> None:
+    global _shared_client
+    client, _shared_client = _shared_client, None
+    if client:
+        await client.close()
+
+
+def cryptomus_client_stats() -> Dict[str, Any]:
+    """连接池配置与按接口的请求耗时统计（/health 使用）"""
+    endpoints = {}
+    for endpoint, stats in _request_stats.items():
+        endpoints[endpoint] = {
+            "count": int(stats["count"]),
+            "errors": int(stats["errors"]),
+            "avg_ms": round(stats["total_ms"] / stats["count"], 1) if stats["count"] else 0.0,
+            "max_ms": round(stats["max_ms"], 1),
+        }
+    return {
+        "shared_session": _shared_client is not None,
+        "pool_size": CRYPTOMUS_HTTP_POOL_SIZE,
+        "keepalive": CRYPTOMUS_HTTP_KEEPALIVE,
+        "timeout": CRYPTOMUS_HTTP_TIMEOUT,
+        "endpoints": endpoints,
+    }
+
+
 # ???????
 def get_cryptomus_client() -> CryptomusClient:
     """??Cryptomus?????"""
+    if _shared_client is not None:
+        return _shared_client
     return CryptomusClient()
 
 
@@ -0,0 +1,185 @@
+"""
+静态充值钱包（可选模式，CRYPTOMUS_STATIC_WALLETS 开启）
+
+每个用户每个币种/网络在 Cryptomus 创建一次固定地址，之后充值无需同步调用上游：
+用户直接向该地址转账，Cryptomus 回调（type=wallet）经回调收件箱处理后按实际到账金额入账。
+"""
+
+import logging
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_DOWN
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.models.order import (
+    CryptoCurrency,
+    DepositWallet,
+    Order,
+    OrderStatus,
+    OrderType,
+    Payment,
+    PaymentMethod,
+)
+from app.services.crypto_payment import crypto_payment_service
+from app.services.cryptomus_client import get_cryptomus_client
+from app.services.order_service import OrderService
+from app.services.session_service import SessionService
+
+logger = logging.getLogger(__name__)
+
+STATIC_WALLETS_ENABLED = bool(getattr(settings, "CRYPTOMUS_STATIC_WALLETS", False))
+
+
+class DepositWalletService:
+    """静态充值钱包：获取/创建地址与回调入账"""
+
+    @staticmethod
+    def enabled() -> bool:
+        return STATIC_WALLETS_ENABLED and crypto_payment_service.use_cryptomus
+
+    @staticmethod
+    def wallet_order_id(user_id: int, currency: str, network: str) -> str:
+        return f"dw_{user_id}_{currency}_{network}".lower()
+
+    @staticmethod
+    async def _find(db: AsyncSession, user_id: int, currency: str, network: str) -> Optional[DepositWallet]:
+        result = await db.execute(
+            select(DepositWallet).where(
+                DepositWallet.user_id == user_id,
+                DepositWallet.currency == currency,
+                DepositWallet.network == network,
+            )
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def get_or_create(db: AsyncSession, user_id: int, currency: str, network: str) -> DepositWallet:
+        """获取用户的静态钱包；首次使用时向 Cryptomus 创建（每个用户每个网络只调用一次上游）"""
+        currency = currency.upper()
+        network = network.upper()
+        if currency != crypto_payment_service.allowed_currency or network not in crypto_payment_service.allowed_networks:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported currency or network")
+
+        wallet = await DepositWalletService._find(db, user_id, currency, network)
+        if wallet:
+            if not wallet.is_active:
+                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Deposit wallet is disabled")
+            return wallet
+
+        # 调用上游前结束只读事务，避免 HTTP 期间占用数据库连接
+        await db.commit()
+        order_id = DepositWalletService.wallet_order_id(user_id, currency, network)
+        async with get_cryptomus_client() as client:
+            response = await client.create_static_wallet(
+                currency=currency,
+                network=network,
+                order_id=order_id,
+                url_callback=settings.CRYPTOMUS_WEBHOOK_URL,
+            )
+        if response.get("state") not in (0, None):
+            raise RuntimeError(f"Cryptomus static wallet creation failed: {response.get('message', 'Unknown error')}")
+        result = response.get("result") or {}
+        if not result.get("address"):
+            raise RuntimeError("Cryptomus static wallet creation returned no address")
+
+        wallet = DepositWallet(
+            user_id=user_id,
+            currency=currency,
+            network=network,
+            address=result["address"],
+            wallet_uuid=result.get("wallet_uuid") or result.get("uuid"),
+            order_id=order_id,
+            is_active=True,
+        )
+        db.add(wallet)
+        try:
+            await db.commit()
+            await db.refresh(wallet)
+        except IntegrityError:
+            # 并发请求已创建（Cryptomus 对同一 order_id 返回同一钱包）
+            await db.rollback()
+            wallet = await DepositWalletService._find(db, user_id, currency, network)
+            if wallet is None:
+                raise
+        return wallet
+
+    @staticmethod
+    def _deposit_amount(webhook_data: Dict[str, Any]) -> Decimal:
+        """按实际到账金额入账（USD 计价，USDT 1:1）"""
+        raw = (
+            webhook_data.get("payment_amount_usd")
+            or webhook_data.get("payment_amount")
+            or webhook_data.get("merchant_amount")
+        )
+        try:
+            amount = Decimal(str(raw)).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+        except (InvalidOperation, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount parse error")
+        if amount <= 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid deposit amount")
+        return amount
+
+    @staticmethod
+    async def process_deposit(db: AsyncSession, webhook_data: Dict[str, Any]) -> bool:
+        """处理静态钱包到账回调（幂等：以回调 uuid 作为支付ID去重），本次实际入账返回 True"""
+        result = await db.execute(
+            select(DepositWallet).where(DepositWallet.order_id == webhook_data.get("order_id"))
+        )
+        wallet = result.scalar_one_or_none()
+        if not wallet:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Deposit wallet not found")
+
+        payment_status = webhook_data.get("status") or webhook_data.get("payment_status", "check")
+        if crypto_payment_service._convert_cryptomus_status(payment_status) != "confirmed":
+            logger.info("Deposit to wallet %s not final yet: %s", wallet.order_id, payment_status)
+            return False
+
+        deposit_ref = str(webhook_data.get("uuid") or webhook_data.get("txid") or "")[:64]
+        if not deposit_ref:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing deposit identifier")
+        amount = DepositWalletService._deposit_amount(webhook_data)
+        transaction_hash = webhook_data.get("txid")
+        now = datetime.utcnow()
+
+        try:
+            async with db.begin_nested():
+                order = Order(
+                    order_number=OrderService.generate_order_number(),
+                    user_id=wallet.user_id,
+                    type=OrderType.RECHARGE,
+                    amount=amount,
+                    status=OrderStatus.PENDING,
+                    description=f"余额充值 - 静态钱包 {wallet.currency}/{wallet.network}",
+                )
+                db.add(order)
+                await db.flush()
+                db.add(Payment(
+                    payment_id=deposit_ref,
+                    order_id=order.id,
+                    user_id=wallet.user_id,
+                    method=PaymentMethod.CRYPTO,
+                    amount=amount,
+                    crypto_currency=CryptoCurrency(wallet.currency),
+                    crypto_amount=webhook_data.get("payment_amount"),
+                    wallet_address=wallet.address,
+                    transaction_hash=transaction_hash,
+                    status="confirmed",
+                    confirmations=crypto_payment_service._parse_int(webhook_data.get("confirmations")) or 0,
+                    confirmed_at=now,
+                ))
+                # payment_id 唯一：同一笔到账的重复回调在此被拦截
+                await db.flush()
+        except IntegrityError:
+            logger.info("Duplicate deposit webhook skipped: %s", deposit_ref)
+            return False
+
+        credited = await OrderService.credit_recharge(db, order.id, wallet.user_id, amount)
+        if credited:
+            SessionService.bump_session_version_after_commit(db, wallet.user_id)
+            logger.info(f"Static wallet deposit credited: {deposit_ref} -> user {wallet.user_id} ({amount})")
+        return credited
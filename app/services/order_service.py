@@ -1,12 +1,13 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import and_, or_, desc, func
+from sqlalchemy import and_, or_, desc, func, update
+from sqlalchemy.exc import IntegrityError
 from typing import Optional, List
 from datetime import datetime, timedelta
 from decimal import Decimal
 import uuid
-import secrets
 
+from app.core.database import add_after_commit
 from app.models.order import Order, Payment, Transaction, BalanceLog, OrderType, OrderStatus, PaymentMethod, CryptoCurrency
 from app.models.user import User
 from app.schemas.order import (
@@ -15,34 +16,31 @@ from app.schemas.order import (
     RechargeRequest, RechargeResponse, OrderStats, PaymentStats, FinanceStats
 )
 from app.services.crypto_payment import crypto_payment_service
+from app.services.payment_outbox import PaymentOutboxService
+from app.services.session_service import SessionService
+from app.utils.ids import new_id
 
 
 class OrderService:
     @staticmethod
-    async def generate_order_number() -> str:
-        """生成订单号"""
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        random_str = secrets.token_hex(4).upper()
-        return f"ORD{timestamp}{random_str}"
+    def generate_order_number() -> str:
+        """生成订单号（单调递增，见 app.utils.ids）"""
+        return new_id("ORD")
 
     @staticmethod
-    async def generate_payment_id() -> str:
+    def generate_payment_id() -> str:
         """生成支付ID"""
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        random_str = secrets.token_hex(6).upper()
-        return f"PAY{timestamp}{random_str}"
+        return new_id("PAY")
 
     @staticmethod
-    async def generate_transaction_id() -> str:
+    def generate_transaction_id() -> str:
         """生成交易ID"""
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        random_str = secrets.token_hex(6).upper()
-        return f"TXN{timestamp}{random_str}"
+        return new_id("TXN")
 
     @staticmethod
     async def create_order(db: AsyncSession, user_id: int, order_data: OrderCreate) -> OrderResponse:
         """创建订单"""
-        order_number = await OrderService.generate_order_number()
+        order_number = OrderService.generate_order_number()
         
         order = Order(
             order_number=order_number,
@@ -142,7 +140,7 @@ class OrderService:
         payment_id_override: Optional[str] = None
     ) -> PaymentResponse:
         """创建支付记录"""
-        payment_id = payment_id_override or await OrderService.generate_payment_id()
+        payment_id = payment_id_override or OrderService.generate_payment_id()
         expires_at = datetime.utcnow() + timedelta(minutes=expires_minutes)
         confirmations_required = required_confirmations
         if confirmations_required is None:
@@ -210,7 +208,7 @@ class OrderService:
         transaction_data: TransactionCreate
     ) -> TransactionResponse:
         """创建交易记录"""
-        transaction_id = await OrderService.generate_transaction_id()
+        transaction_id = OrderService.generate_transaction_id()
         
         transaction = Transaction(
             transaction_id=transaction_id,
@@ -281,62 +279,80 @@ class OrderService:
         crypto_network: Optional[str] = None,
         success_url: Optional[str] = None
     ) -> RechargeResponse:
-        """用户充值"""
-        # 创建充值订单
-        order_data = OrderCreate(
-            type=OrderType.RECHARGE,
-            amount=amount,
-            description=f"余额充值 - {payment_method.value}"
-        )
-        order = await OrderService.create_order(db, user_id, order_data)
-        
+        """用户充值
+
+        加密货币支付：订单、支付与发件箱记录在同一事务提交后立即返回，
+        Cryptomus 账单由发件箱后台任务创建，地址/金额通过 monitor 或 SSE 推送给前端。
+        """
         # 如果是加密货币支付，使用支付服务
         if payment_method == PaymentMethod.CRYPTO and crypto_currency:
             if not crypto_network:
                 raise ValueError("crypto_network is required for crypto payments")
-            # 预先生成支付ID，确保链路一致
-            payment_identifier = await OrderService.generate_payment_id()
-            crypto_payment = await crypto_payment_service.create_payment(
-                float(amount),
-                crypto_currency.value,
-                payment_id=payment_identifier,
-                network=crypto_network,
-                success_url=success_url
+            # 同步校验，避免写入注定失败的账单任务
+            if not crypto_payment_service.use_cryptomus:
+                raise RuntimeError("Cryptomus 未配置，无法创建真实支付")
+            crypto_network = crypto_network.upper()
+            if crypto_currency.value not in crypto_payment_service.supported_currencies:
+                raise ValueError(f"Unsupported currency: {crypto_currency.value}")
+            if crypto_network not in crypto_payment_service.allowed_networks:
+                raise ValueError(f"Unsupported network for USDT: {crypto_network}")
+
+            order = Order(
+                order_number=OrderService.generate_order_number(),
+                user_id=user_id,
+                type=OrderType.RECHARGE,
+                amount=amount,
+                description=f"余额充值 - {payment_method.value}",
+                status=OrderStatus.PENDING
             )
-            
-            payment_data = PaymentCreate(
+            db.add(order)
+            await db.flush()
+
+            payment_identifier = OrderService.generate_payment_id()
+            expires_at = datetime.utcnow() + timedelta(minutes=30)
+            required_confirmations = 1 if crypto_currency == CryptoCurrency.USDT else 2
+            payment = Payment(
+                payment_id=payment_identifier,
                 order_id=order.id,
+                user_id=user_id,
                 method=payment_method,
                 amount=amount,
-                crypto_currency=crypto_currency
+                crypto_currency=crypto_currency,
+                expires_at=expires_at,
+                required_confirmations=required_confirmations
             )
-            
-            payment = await OrderService.create_payment(
-                db=db,
-                user_id=user_id,
-                payment_data=payment_data,
-                crypto_amount=Decimal(crypto_payment['crypto_amount']),
-                wallet_address=crypto_payment['wallet_address'],
-                required_confirmations=crypto_payment.get('required_confirmations'),
-                payment_id_override=payment_identifier
+            db.add(payment)
+            PaymentOutboxService.add_invoice(
+                db, payment_identifier, amount, crypto_currency.value, crypto_network, success_url
             )
-            
-            # 优先使用 Cryptomus 返回的二维码数据，缺省再本地生成
-            qr_code = crypto_payment.get('address_qr_code') or crypto_payment_service.generate_qr_code(
-                crypto_payment['payment_id'],
-                crypto_payment['wallet_address'],
-                crypto_payment['crypto_amount'],
-                crypto_payment['crypto_currency']
+            # 占位状态先于提交写入缓存，避免后台任务写入的账单被占位覆盖
+            crypto_payment = await crypto_payment_service.remember_pending_invoice(
+                payment_identifier,
+                float(amount),
+                crypto_currency.value,
+                crypto_network,
+                expires_at,
+                required_confirmations=required_confirmations
             )
-            
+            await db.commit()
+            await db.refresh(order)
+            await db.refresh(payment)
+            await PaymentOutboxService.notify(payment_identifier)
+
             return RechargeResponse(
-                order=order,
-                payment=payment,
-                qr_code=qr_code,
+                order=OrderResponse.from_orm(order),
+                payment=PaymentResponse.from_orm(payment),
+                qr_code=None,
                 crypto_payment=crypto_payment
             )
         else:
             # 其他支付方式的处理
+            order_data = OrderCreate(
+                type=OrderType.RECHARGE,
+                amount=amount,
+                description=f"余额充值 - {payment_method.value}"
+            )
+            order = await OrderService.create_order(db, user_id, order_data)
             payment_data = PaymentCreate(
                 order_id=order.id,
                 method=payment_method,
@@ -362,7 +378,11 @@ class OrderService:
         confirmations: int,
         required_confirmations: Optional[int] = None
     ) -> bool:
-        """确认支付"""
+        """确认支付
+
+        只锁支付行；充值入账通过条件更新认领订单 + 唯一约束兜底，不再逐表探测是否已入账。
+        支付缓存在事务提交后更新（需由 get_db / run_after_commit 提交）。
+        """
         transaction = db.begin_nested() if db.in_transaction() else db.begin()
         async with transaction:
             payment_result = await db.execute(
@@ -382,13 +402,14 @@ class OrderService:
 
             # 检查确认数是否足够
             status = "confirmed" if parsed_confirmations >= payment.required_confirmations else "pending"
-            await crypto_payment_service.update_payment_status(
-                payment_id=payment_id,
-                status=status,
-                transaction_hash=transaction_hash,
-                confirmations=parsed_confirmations,
-                required_confirmations=payment.required_confirmations
-            )
+            cache_update = {
+                "payment_id": payment_id,
+                "status": status,
+                "transaction_hash": transaction_hash,
+                "confirmations": parsed_confirmations,
+                "required_confirmations": payment.required_confirmations,
+            }
+            add_after_commit(db, lambda: crypto_payment_service.update_payment_status(**cache_update))
 
             payment.status = status
             payment.transaction_hash = transaction_hash or payment.transaction_hash
@@ -399,100 +420,100 @@ class OrderService:
             if status != "confirmed":
                 return False
 
-            order_result = await db.execute(
-                select(Order).where(Order.id == payment.order_id).with_for_update()
-            )
+            order_result = await db.execute(select(Order).where(Order.id == payment.order_id))
             order = order_result.scalar_one_or_none()
             if not order:
                 return False
 
-            already_credited = bool(order.credited_at) or order.status == OrderStatus.COMPLETED
-            if order.type == OrderType.RECHARGE and not already_credited:
-                existing_log = await db.execute(
-                    select(BalanceLog.id)
-                    .where(
-                        BalanceLog.related_order_id == order.id,
-                        BalanceLog.type == "recharge"
-                    )
-                    .limit(1)
-                )
-                if existing_log.scalar_one_or_none():
-                    already_credited = True
-
-                existing_txn = await db.execute(
-                    select(Transaction.id)
-                    .where(
-                        Transaction.order_id == order.id,
-                        Transaction.type == "recharge"
-                    )
-                    .limit(1)
+            if order.type != OrderType.RECHARGE:
+                await db.execute(
+                    update(Order)
+                    .where(Order.id == order.id, Order.status == OrderStatus.PENDING)
+                    .values(status=OrderStatus.PAID, paid_at=func.coalesce(Order.paid_at, datetime.utcnow()))
+                    .execution_options(synchronize_session=False)
                 )
-                if existing_txn.scalar_one_or_none():
-                    already_credited = True
-
-            if already_credited:
-                if order.type == OrderType.RECHARGE and not order.credited_at:
-                    order.credited_at = order.completed_at or datetime.utcnow()
-                if order.status == OrderStatus.PENDING:
-                    order.status = OrderStatus.PAID
-                    if not order.paid_at:
-                        order.paid_at = datetime.utcnow()
-                if order.type == OrderType.RECHARGE and order.status != OrderStatus.COMPLETED:
-                    order.status = OrderStatus.COMPLETED
-                    if not order.completed_at:
-                        order.completed_at = datetime.utcnow()
                 return True
 
-            if order.status == OrderStatus.PENDING:
-                order.status = OrderStatus.PAID
-                order.paid_at = datetime.utcnow()
-            elif order.status == OrderStatus.PAID and not order.paid_at:
-                order.paid_at = datetime.utcnow()
-
-            # 如果是充值订单，增加用户余额
-            if order.type == OrderType.RECHARGE:
-                user_result = await db.execute(
-                    select(User).where(User.id == payment.user_id).with_for_update()
-                )
-                user = user_result.scalar_one_or_none()
-                if not user:
-                    return False
-
-                balance_before = Decimal(user.balance or 0)
-                balance_after = balance_before + Decimal(order.amount)
-                user.balance = balance_after
-
-                credited_time = datetime.utcnow()
-
-                transaction = Transaction(
-                    transaction_id=await OrderService.generate_transaction_id(),
-                    order_id=order.id,
-                    user_id=payment.user_id,
-                    type="recharge",
-                    amount=order.amount,
-                    balance_before=balance_before,
-                    balance_after=balance_after,
-                    description="充值到账"
-                )
-                db.add(transaction)
-
-                balance_log = BalanceLog(
-                    user_id=payment.user_id,
-                    type="recharge",
-                    amount=order.amount,
-                    balance_before=balance_before,
-                    balance_after=balance_after,
-                    description="充值到账",
-                    related_order_id=order.id
-                )
-                db.add(balance_log)
-
-                order.status = OrderStatus.COMPLETED
-                order.completed_at = credited_time
-                order.credited_at = credited_time
+            if await OrderService.credit_recharge(db, order.id, payment.user_id, Decimal(order.amount)):
+                SessionService.bump_session_version_after_commit(db, payment.user_id)
 
         return True
 
+    @staticmethod
+    async def credit_recharge(db: AsyncSession, order_id: int, user_id: int, amount: Decimal) -> bool:
+        """充值入账（插入或跳过）：本次实际入账返回 True，已入账过返回 False"""
+        now = datetime.utcnow()
+        try:
+            async with db.begin_nested():
+                # 条件更新认领订单：并发确认同一订单时只有一个能更新到行
+                claim = await db.execute(
+                    update(Order)
+                    .where(
+                        Order.id == order_id,
+                        Order.credited_at.is_(None),
+                        Order.status != OrderStatus.COMPLETED,
+                    )
+                    .values(
+                        status=OrderStatus.COMPLETED,
+                        paid_at=func.coalesce(Order.paid_at, now),
+                        completed_at=now,
+                        credited_at=now,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                if claim.rowcount == 1:
+                    await db.execute(
+                        update(User)
+                        .where(User.id == user_id)
+                        .values(balance=func.coalesce(User.balance, 0) + amount)
+                        .execution_options(synchronize_session=False)
+                    )
+                    balance_result = await db.execute(select(User.balance).where(User.id == user_id))
+                    balance_after = Decimal(balance_result.scalar_one())
+                    balance_before = balance_after - amount
+
+                    db.add(Transaction(
+                        transaction_id=OrderService.generate_transaction_id(),
+                        order_id=order_id,
+                        user_id=user_id,
+                        type="recharge",
+                        amount=amount,
+                        balance_before=balance_before,
+                        balance_after=balance_after,
+                        description="充值到账"
+                    ))
+                    db.add(BalanceLog(
+                        user_id=user_id,
+                        type="recharge",
+                        amount=amount,
+                        balance_before=balance_before,
+                        balance_after=balance_after,
+                        description="充值到账",
+                        related_order_id=order_id
+                    ))
+                    # 唯一约束 (order, type) 兜底：已有入账记录时整个保存点回滚
+                    await db.flush()
+                    return True
+        except IntegrityError:
+            pass
+
+        # 已入账（或历史数据只有入账记录未标记订单）：补齐订单状态
+        await db.execute(
+            update(Order)
+            .where(
+                Order.id == order_id,
+                or_(Order.credited_at.is_(None), Order.status != OrderStatus.COMPLETED),
+            )
+            .values(
+                status=OrderStatus.COMPLETED,
+                paid_at=func.coalesce(Order.paid_at, now),
+                completed_at=func.coalesce(Order.completed_at, now),
+                credited_at=func.coalesce(Order.credited_at, Order.completed_at, now),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return False
+
     @staticmethod
     async def get_order_stats(db: AsyncSession) -> OrderStats:
         """获取订单统计"""
@@ -0,0 +1,119 @@
+"""
+支付状态推送
+
+支付信息写入缓存时发布状态事件：本进程直接分发给订阅者，
+并通过 Redis pub/sub 广播给其他 worker；SSE 接口为每个打开的充值页面维持一个空闲连接。
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from app.core.config import settings
+from app.utils.cache import publish, subscribe_channel
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_EVENTS_CHANNEL = "payment_events"
+PAYMENT_EVENTS_HEARTBEAT = getattr(settings, "PAYMENT_EVENTS_HEARTBEAT", 15)
+PAYMENT_EVENTS_MAX_SECONDS = getattr(settings, "PAYMENT_EVENTS_MAX_SECONDS", 1800)
+_QUEUE_SIZE = 16
+_FINAL_STATUSES = {"confirmed", "paid", "cancelled", "expired", "failed"}
+# 推送给前端时去掉体积大或仅供内部使用的字段
+_OMITTED_FIELDS = {"cryptomus_data", "address_qr_code", "merchant_uuid"}
+
+# 标识本进程，忽略 Redis 回传的自身事件（本进程已直接分发）
+_origin = uuid.uuid4().hex
+_subscribers: Dict[str, Set["asyncio.Queue[Dict[str, Any]]"]] = {}
+_stats: Dict[str, int] = {"published": 0, "delivered": 0, "dropped": 0}
+
+
+def event_payload(payment: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in payment.items() if k not in _OMITTED_FIELDS}
+
+
+def _dispatch(payment_id: str, event: Dict[str, Any]) -> None:
+    for queue in _subscribers.get(payment_id, ()):
+        if queue.full():
+            # 慢连接只需要最新状态，丢弃最旧的事件
+            queue.get_nowait()
+            _stats["dropped"] += 1
+        queue.put_nowait(event)
+        _stats["delivered"] += 1
+
+
+def _handle_message(data: str) -> None:
+    try:
+        message = json.loads(data)
+    except (TypeError, ValueError):
+        return
+    if message.get("o") == _origin:
+        return
+    payment_id = message.get("p")
+    if payment_id in _subscribers:
+        _dispatch(payment_id, message.get("e") or {})
+
+
+async def publish_payment_event(payment_id: str, payment: Dict[str, Any]) -> None:
+    """发布支付状态变化（本进程订阅者立即收到，其他 worker 经 Redis 收到）"""
+    event = event_payload(payment)
+    _stats["published"] += 1
+    _dispatch(payment_id, event)
+    await publish(
+        PAYMENT_EVENTS_CHANNEL,
+        json.dumps({"o": _origin, "p": payment_id, "e": event}, default=str),
+    )
+
+
+def _format_sse(event: Dict[str, Any]) -> str:
+    return f"event: status\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+async def stream_payment_events(
+    payment_id: str,
+    load_current: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+    is_disconnected: Callable[[], Awaitable[bool]],
+) -> AsyncIterator[str]:
+    """SSE 事件流：先推送当前状态，之后推送每次变化；到达终态、客户端断开或超过最长时长后结束"""
+    queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=_QUEUE_SIZE)
+    # 先订阅再读取当前状态，避免两者之间的更新丢失
+    _subscribers.setdefault(payment_id, set()).add(queue)
+    try:
+        current = await load_current()
+        if current:
+            yield _format_sse(event_payload(current))
+            if current.get("status") in _FINAL_STATUSES:
+                return
+
+        deadline = time.monotonic() + PAYMENT_EVENTS_MAX_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=PAYMENT_EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                # 心跳保持连接，防止代理超时断开
+                yield ": ping\n\n"
+                continue
+            yield _format_sse(event)
+            if event.get("status") in _FINAL_STATUSES:
+                return
+    finally:
+        queues = _subscribers.get(payment_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                _subscribers.pop(payment_id, None)
+
+
+def payment_events_stats() -> Dict[str, int]:
+    return {
+        **_stats,
+        "streams": sum(len(queues) for queues in _subscribers.values()),
+    }
+
+
+subscribe_channel(PAYMENT_EVENTS_CHANNEL, _handle_message)
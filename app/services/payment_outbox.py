@@ -0,0 +1,263 @@
+"""
+支付发件箱
+
+充值请求在同一事务内写入订单、支付与发件箱记录后立即返回，
+后台任务认领发件箱记录并调用 Cryptomus 创建账单，结果写回支付记录并通过状态推送通知前端；
+上游调用期间不占用请求与数据库连接，调用失败按指数退避重试，最终失败时结束支付与订单。
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.order import Order, OrderStatus, Payment, PaymentOutbox
+from app.services.crypto_payment import crypto_payment_service
+from app.services.payment_events import publish_payment_event
+from app.utils.cache import publish, subscribe_channel
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_OUTBOX_CHANNEL = "payment_outbox:new"
+PAYMENT_OUTBOX_CONCURRENCY = getattr(settings, "PAYMENT_OUTBOX_CONCURRENCY", 5)
+PAYMENT_OUTBOX_BATCH_SIZE = getattr(settings, "PAYMENT_OUTBOX_BATCH_SIZE", 20)
+PAYMENT_OUTBOX_POLL_INTERVAL = getattr(settings, "PAYMENT_OUTBOX_POLL_INTERVAL", 2.0)
+PAYMENT_OUTBOX_MAX_ATTEMPTS = getattr(settings, "PAYMENT_OUTBOX_MAX_ATTEMPTS", 5)
+# 用户正在等待账单，重试间隔保持较短
+PAYMENT_OUTBOX_RETRY_MAX_DELAY = getattr(settings, "PAYMENT_OUTBOX_RETRY_MAX_DELAY", 30)
+PAYMENT_OUTBOX_LEASE_SECONDS = getattr(settings, "PAYMENT_OUTBOX_LEASE_SECONDS", 60)
+
+_wakeup_event: Optional[asyncio.Event] = None
+_stats: Dict[str, int] = {
+    "enqueued": 0,
+    "created": 0,
+    "retried": 0,
+    "failed": 0,
+}
+
+
+def _wakeup() -> asyncio.Event:
+    # 延迟创建，确保绑定到运行中的事件循环
+    global _wakeup_event
+    if _wakeup_event is None:
+        _wakeup_event = asyncio.Event()
+    return _wakeup_event
+
+
+class PaymentOutboxService:
+    """支付发件箱：入队、认领与创建上游账单"""
+
+    @staticmethod
+    def add_invoice(
+        db: AsyncSession,
+        payment_id: str,
+        amount: Decimal,
+        currency: str,
+        network: str,
+        success_url: Optional[str] = None,
+    ) -> None:
+        """在调用方事务中加入待创建账单（随订单/支付一并提交，提交后调用 notify）"""
+        db.add(PaymentOutbox(
+            payment_id=payment_id,
+            kind="create_invoice",
+            payload=json.dumps({
+                "amount": str(amount),
+                "currency": currency,
+                "network": network,
+                "success_url": success_url,
+            }),
+            status="pending",
+            attempts=0,
+            next_attempt_at=datetime.utcnow(),
+        ))
+
+    @staticmethod
+    async def notify(payment_id: str) -> None:
+        """事务提交后唤醒本进程与其他 worker 的处理循环"""
+        _stats["enqueued"] += 1
+        _wakeup().set()
+        await publish(PAYMENT_OUTBOX_CHANNEL, payment_id)
+
+    @staticmethod
+    def _handle_new_item_message(_: str) -> None:
+        _wakeup().set()
+
+    @staticmethod
+    def _claimable_query(now: datetime):
+        ready = or_(
+            and_(PaymentOutbox.status == "pending", PaymentOutbox.next_attempt_at <= now),
+            and_(
+                PaymentOutbox.status == "processing",
+                PaymentOutbox.claimed_at < now - timedelta(seconds=PAYMENT_OUTBOX_LEASE_SECONDS),
+            ),
+        )
+        return (
+            select(PaymentOutbox)
+            .where(ready)
+            .order_by(PaymentOutbox.id)
+            .limit(PAYMENT_OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+
+    @staticmethod
+    async def process_batch() -> int:
+        """认领一批发件箱记录并以有限并发创建账单，返回认领数量"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(PaymentOutboxService._claimable_query(now))
+            items = result.scalars().all()
+            if not items:
+                return 0
+            for item in items:
+                item.status = "processing"
+                item.claimed_at = now
+                item.attempts = (item.attempts or 0) + 1
+            await db.commit()
+            claimed = [(item.id, item.payment_id, item.payload, item.attempts) for item in items]
+
+        semaphore = asyncio.Semaphore(PAYMENT_OUTBOX_CONCURRENCY)
+
+        async def run(item_id: int, payment_id: str, payload: str, attempts: int) -> None:
+            async with semaphore:
+                await PaymentOutboxService._run_item(item_id, payment_id, payload, attempts)
+
+        await asyncio.gather(*(run(*item) for item in claimed))
+        return len(claimed)
+
+    @staticmethod
+    async def _run_item(item_id: int, payment_id: str, payload: str, attempts: int) -> None:
+        error: Optional[str] = None
+        permanent = False
+        try:
+            params = json.loads(payload)
+            # order_id 即我方 payment_id：重试（含租期到期后重新认领）时 Cryptomus 返回同一张未过期账单
+            payment_info = await crypto_payment_service.create_payment(
+                float(params["amount"]),
+                params["currency"],
+                payment_id=payment_id,
+                network=params["network"],
+                success_url=params.get("success_url"),
+            )
+            await PaymentOutboxService._complete(item_id, payment_id, payment_info)
+            return
+        except (ValueError, RuntimeError) as e:
+            # 币种/网络不支持或未配置 Cryptomus，重试也不会成功
+            error = str(e) or type(e).__name__
+            permanent = True
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        await PaymentOutboxService._finish(item_id, payment_id, attempts, error, permanent)
+
+    @staticmethod
+    async def _complete(item_id: int, payment_id: str, payment_info: Dict[str, Any]) -> None:
+        """账单已创建：写回支付记录并结束发件箱记录，提交后推送给前端"""
+        values: Dict[str, Any] = {"wallet_address": payment_info.get("wallet_address")}
+        if payment_info.get("crypto_amount"):
+            values["crypto_amount"] = Decimal(str(payment_info["crypto_amount"]))
+        if payment_info.get("required_confirmations"):
+            values["required_confirmations"] = payment_info["required_confirmations"]
+        async with AsyncSessionLocal() as db:
+            # 支付已被取消/过期时不再写回
+            await db.execute(
+                update(Payment)
+                .where(Payment.payment_id == payment_id, Payment.status == "pending")
+                .values(**values)
+            )
+            await db.execute(
+                update(PaymentOutbox)
+                .where(PaymentOutbox.id == item_id)
+                .values(status="done", processed_at=datetime.utcnow(), last_error=None)
+            )
+            await db.commit()
+        _stats["created"] += 1
+        # 二维码接口读取数据库中的地址，因此在提交后再推送
+        await publish_payment_event(payment_id, payment_info)
+        logger.info("Cryptomus invoice created from outbox: %s", payment_id)
+
+    @staticmethod
+    async def _finish(item_id: int, payment_id: str, attempts: int, error: str, permanent: bool) -> None:
+        now = datetime.utcnow()
+        if not permanent and attempts < PAYMENT_OUTBOX_MAX_ATTEMPTS:
+            delay = min(2 ** attempts, PAYMENT_OUTBOX_RETRY_MAX_DELAY)
+            _stats["retried"] += 1
+            logger.warning("Invoice for payment %s will retry in %ss: %s", payment_id, delay, error)
+            values: Dict[str, Any] = {
+                "status": "pending",
+                "next_attempt_at": now + timedelta(seconds=delay),
+                "last_error": error,
+            }
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(update(PaymentOutbox).where(PaymentOutbox.id == item_id).values(**values))
+                    await db.commit()
+            except Exception as e:
+                # 状态未落库时租期到期后会被重新认领
+                logger.error("Failed to record outbox item %s result: %s", item_id, e)
+            return
+
+        _stats["failed"] += 1
+        logger.error("Invoice for payment %s failed after %s attempts: %s", payment_id, attempts, error)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Order)
+                    .where(
+                        Order.id == select(Payment.order_id).where(Payment.payment_id == payment_id).scalar_subquery(),
+                        Order.status == OrderStatus.PENDING,
+                    )
+                    .values(status=OrderStatus.CANCELLED)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.execute(
+                    update(Payment)
+                    .where(Payment.payment_id == payment_id, Payment.status == "pending")
+                    .values(status="failed")
+                )
+                await db.execute(
+                    update(PaymentOutbox)
+                    .where(PaymentOutbox.id == item_id)
+                    .values(status="failed", processed_at=now, last_error=error)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error("Failed to record outbox item %s result: %s", item_id, e)
+            return
+        # 通知等待中的充值页面
+        await crypto_payment_service.update_payment_status(payment_id=payment_id, status="failed")
+
+    @staticmethod
+    async def run_worker() -> None:
+        """后台处理循环：有新记录时立即处理，否则按轮询间隔检查重试到期的记录"""
+        if not crypto_payment_service.use_cryptomus:
+            return
+        while True:
+            try:
+                claimed = await PaymentOutboxService.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Payment outbox batch failed: %s", exc)
+                claimed = 0
+            if claimed:
+                continue
+            event = _wakeup()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=PAYMENT_OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+
+    @staticmethod
+    def stats() -> Dict[str, int]:
+        return dict(_stats)
+
+
+subscribe_channel(PAYMENT_OUTBOX_CHANNEL, PaymentOutboxService._handle_new_item_message)
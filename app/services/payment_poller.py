@@ -0,0 +1,261 @@
+"""
+待支付订单的后台任务
+
+- PaymentPoller：每个周期只有一个 worker（Redis 锁）批量刷新所有未到终态的 Cryptomus 支付并写回缓存，
+  前端的 monitor 接口只读缓存；上游调用量与待支付数量相关，而与打开的页面数无关。
+- PaymentExpirySweeper：按 (status, expires_at) 索引分批将过期未支付的支付/订单标记为结束并清理缓存。
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, run_after_commit
+from app.models.order import Order, OrderStatus, Payment, PaymentMethod
+from app.services.crypto_payment import crypto_payment_service
+from app.services.order_service import OrderService
+from app.utils.cache import CacheService
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_POLL_INTERVAL = getattr(settings, "PAYMENT_POLL_INTERVAL", 15)
+PAYMENT_POLL_CONCURRENCY = getattr(settings, "PAYMENT_POLL_CONCURRENCY", 5)
+PAYMENT_POLL_HISTORY_THRESHOLD = getattr(settings, "PAYMENT_POLL_HISTORY_THRESHOLD", 20)
+PAYMENT_POLL_HISTORY_PAGES = getattr(settings, "PAYMENT_POLL_HISTORY_PAGES", 5)
+# 只轮询支付缓存仍有效的时间窗内创建的支付
+PAYMENT_POLL_WINDOW_SECONDS = getattr(
+    settings, "PAYMENT_POLL_WINDOW_SECONDS", crypto_payment_service.cache_ttl_seconds
+)
+_POLL_LOCK_KEY = "lock:payment_poller"
+
+PAYMENT_EXPIRY_SWEEP_INTERVAL = getattr(settings, "PAYMENT_EXPIRY_SWEEP_INTERVAL", 300)
+PAYMENT_EXPIRY_BATCH_SIZE = getattr(settings, "PAYMENT_EXPIRY_BATCH_SIZE", 500)
+# 过期后再等待一段时间，给迟到的链上确认与回调留出余量
+PAYMENT_EXPIRY_GRACE_SECONDS = getattr(settings, "PAYMENT_EXPIRY_GRACE_SECONDS", 600)
+# 结束前向 Cryptomus 复核加密货币支付（缓存缺失的按 order_id 查询）；关闭时直接结束
+PAYMENT_EXPIRY_VERIFY = getattr(settings, "PAYMENT_EXPIRY_VERIFY", True)
+_SWEEP_LOCK_KEY = "lock:payment_expiry_sweeper"
+# 上游显示资金在途的状态：暂不结束，留给下一轮
+_IN_FLIGHT_STATUSES = {"process", "confirm_check", "wrong_amount_waiting"}
+
+_stats: Dict[str, Any] = {
+    "rounds": 0,
+    "skipped_rounds": 0,
+    "payments_checked": 0,
+    "payments_confirmed": 0,
+    "last_round_at": None,
+}
+_sweep_stats: Dict[str, Any] = {
+    "rounds": 0,
+    "expired": 0,
+    "finalized_upstream": 0,
+    "deferred": 0,
+    "unverified": 0,
+    "last_round_at": None,
+}
+
+
+class PaymentPoller:
+    """待支付订单的后台批量状态刷新"""
+
+    @staticmethod
+    async def poll_once() -> int:
+        """执行一轮轮询（其他 worker 正在轮询时跳过），返回本轮检查的支付数量"""
+        # 锁不主动释放、随周期过期：整个集群每个周期只轮询一次
+        if await CacheService.acquire_lock(_POLL_LOCK_KEY, PAYMENT_POLL_INTERVAL * 0.9) is None:
+            _stats["skipped_rounds"] += 1
+            return 0
+        since = datetime.utcnow() - timedelta(seconds=PAYMENT_POLL_WINDOW_SECONDS)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Payment.payment_id).where(
+                    Payment.method == PaymentMethod.CRYPTO,
+                    Payment.status == "pending",
+                    Payment.created_at >= since,
+                )
+            )
+            payment_ids = list(result.scalars().all())
+
+        refreshed = {}
+        if payment_ids:
+            refreshed = await crypto_payment_service.refresh_payments(
+                payment_ids,
+                concurrency=PAYMENT_POLL_CONCURRENCY,
+                history_threshold=PAYMENT_POLL_HISTORY_THRESHOLD,
+                history_pages=PAYMENT_POLL_HISTORY_PAGES,
+            )
+        for payment_id, payment in refreshed.items():
+            if payment.get("status") in ("confirmed", "paid"):
+                await PaymentPoller._confirm(payment_id, payment)
+
+        _stats["rounds"] += 1
+        _stats["payments_checked"] += len(refreshed)
+        _stats["last_round_at"] = datetime.utcnow().isoformat()
+        return len(refreshed)
+
+    @staticmethod
+    async def _confirm(payment_id: str, payment: Dict[str, Any]) -> None:
+        """上游已确认但回调尚未到达时，直接入账（confirm_payment 幂等）"""
+        confirmations = crypto_payment_service._parse_int(payment.get("confirmations")) or 0
+        required_confirmations = crypto_payment_service._parse_int(payment.get("required_confirmations"))
+        if required_confirmations and confirmations < required_confirmations:
+            confirmations = required_confirmations
+        try:
+            async with AsyncSessionLocal() as db:
+                success = await OrderService.confirm_payment(
+                    db,
+                    payment_id,
+                    payment.get("transaction_hash") or "",
+                    confirmations,
+                    required_confirmations=required_confirmations,
+                )
+                await db.commit()
+                await run_after_commit(db)
+        except Exception as e:
+            logger.error(f"Failed to confirm polled payment {payment_id}: {str(e)}")
+            return
+        if success:
+            _stats["payments_confirmed"] += 1
+            logger.info(f"Cryptomus payment confirmed by poller: {payment_id}")
+
+    @staticmethod
+    async def run() -> None:
+        """后台轮询循环（每个 worker 都运行，同一周期由 Redis 锁保证只有一个实际查询上游）"""
+        if not crypto_payment_service.use_cryptomus:
+            return
+        while True:
+            try:
+                await PaymentPoller.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Payment poll round failed: %s", exc)
+            await asyncio.sleep(PAYMENT_POLL_INTERVAL)
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        return dict(_stats)
+
+
+class PaymentExpirySweeper:
+    """过期未支付的支付/订单批量结束"""
+
+    @staticmethod
+    async def sweep_once() -> int:
+        """执行一轮清理（其他 worker 正在清理时跳过），返回结束的支付数量"""
+        if await CacheService.acquire_lock(_SWEEP_LOCK_KEY, PAYMENT_EXPIRY_SWEEP_INTERVAL * 0.9) is None:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(seconds=PAYMENT_EXPIRY_GRACE_SECONDS)
+        total = 0
+        # 按索引顺序 (expires_at, id) 做键集分页：被跳过（资金在途）的行不会被重复扫描
+        after = None
+        while True:
+            conditions = [Payment.status == "pending", Payment.expires_at < cutoff]
+            if after is not None:
+                conditions.append(
+                    or_(
+                        Payment.expires_at > after[0],
+                        and_(Payment.expires_at == after[0], Payment.id > after[1]),
+                    )
+                )
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(Payment.id, Payment.payment_id, Payment.order_id, Payment.method, Payment.expires_at)
+                    .where(*conditions)
+                    .order_by(Payment.expires_at, Payment.id)
+                    .limit(PAYMENT_EXPIRY_BATCH_SIZE)
+                )
+                rows = result.all()
+            if not rows:
+                break
+            after = (rows[-1].expires_at, rows[-1].id)
+            total += await PaymentExpirySweeper._finish_batch(rows)
+            if len(rows) < PAYMENT_EXPIRY_BATCH_SIZE:
+                break
+
+        _sweep_stats["rounds"] += 1
+        _sweep_stats["last_round_at"] = datetime.utcnow().isoformat()
+        return total
+
+    @staticmethod
+    async def _finish_batch(rows: List[Any]) -> int:
+        outcome = {row.payment_id: "expired" for row in rows}
+        if PAYMENT_EXPIRY_VERIFY and crypto_payment_service.use_cryptomus:
+            if not CacheService.available():
+                # 无法区分"缓存已过期"与"Redis 不可用"，本轮不结束任何支付
+                _sweep_stats["unverified"] += len(outcome)
+                return 0
+            # 加密货币支付只结束已向上游核实的；其他支付方式直接结束
+            crypto_ids = [row.payment_id for row in rows if row.method == PaymentMethod.CRYPTO]
+            to_verify = await crypto_payment_service.payments_needing_check(crypto_ids) if crypto_ids else []
+            refreshed = await crypto_payment_service.refresh_payments(
+                to_verify,
+                concurrency=PAYMENT_POLL_CONCURRENCY,
+                history_threshold=PAYMENT_POLL_HISTORY_THRESHOLD,
+                history_pages=PAYMENT_POLL_HISTORY_PAGES,
+            ) if to_verify else {}
+            for payment_id in to_verify:
+                if payment_id not in refreshed:
+                    # 上游查询失败：保持待支付，留给下一轮
+                    outcome.pop(payment_id)
+                    _sweep_stats["unverified"] += 1
+            for payment_id, payment in refreshed.items():
+                status = payment.get("status")
+                if status in ("confirmed", "paid"):
+                    # 实际已支付：走正常入账流程
+                    outcome.pop(payment_id)
+                    await PaymentPoller._confirm(payment_id, payment)
+                elif status in ("failed", "cancelled", "expired"):
+                    outcome[payment_id] = status
+                    _sweep_stats["finalized_upstream"] += 1
+                elif (payment.get("cryptomus_status") or "").lower() in _IN_FLIGHT_STATUSES:
+                    outcome.pop(payment_id)
+                    _sweep_stats["deferred"] += 1
+        if not outcome:
+            return 0
+
+        order_ids = [row.order_id for row in rows if row.payment_id in outcome]
+        async with AsyncSessionLocal() as db:
+            for status in set(outcome.values()):
+                await db.execute(
+                    update(Payment)
+                    .where(
+                        Payment.payment_id.in_([pid for pid, s in outcome.items() if s == status]),
+                        Payment.status == "pending",
+                    )
+                    .values(status=status)
+                    .execution_options(synchronize_session=False)
+                )
+            await db.execute(
+                update(Order)
+                .where(Order.id.in_(order_ids), Order.status == OrderStatus.PENDING)
+                .values(status=OrderStatus.CANCELLED)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+        await crypto_payment_service.forget_payments(list(outcome))
+        _sweep_stats["expired"] += len(outcome)
+        logger.info("Expired %s stale pending payments", len(outcome))
+        return len(outcome)
+
+    @staticmethod
+    async def run() -> None:
+        """后台清理循环（每个 worker 都运行，同一周期由 Redis 锁保证只有一个实际执行）"""
+        while True:
+            try:
+                await PaymentExpirySweeper.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Payment expiry sweep failed: %s", exc)
+            await asyncio.sleep(PAYMENT_EXPIRY_SWEEP_INTERVAL)
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        return dict(_sweep_stats)
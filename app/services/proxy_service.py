@@ -15,18 +15,27 @@ from app.schemas.proxy import (
     ProxyStatsResponse,
 )
 from app.services.order_service import OrderService
+from app.services.session_service import SessionService
 from app.services.upstream_api import (
     StaticProxyService,
     DynamicProxyService,
     MobileProxyService,
 )
-from typing import List, Optional, Dict, Any, Tuple
+from app.utils.cache import CacheService
+from typing import Iterable, List, Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
+PRODUCT_CACHE_TTL = 300
+# 缓存的商品字段（库存随每次购买变化，不进入缓存）
+PRODUCT_SNAPSHOT_FIELDS = (
+    "id", "category", "subcategory", "provider", "product_name",
+    "description", "price", "duration_days", "is_active",
+)
+
 
 class ProxyService:
     CURRENCY_PLACES = Decimal("0.01")
@@ -44,6 +53,50 @@ class ProxyService:
         
         return products
 
+    @staticmethod
+    def _product_cache_key(product_id: int) -> str:
+        return f"product:{product_id}"
+
+    @staticmethod
+    async def get_products_by_ids(db: AsyncSession, product_ids: Iterable[int]) -> Dict[int, ProxyProduct]:
+        """批量解析商品：缓存一次 MGET，未命中的一次 IN 查询并批量回填。
+
+        缓存命中返回的是脱离会话的快照对象（不含库存），只用于读取价格/时长等配置。
+        """
+        ids = list(dict.fromkeys(pid for pid in product_ids if pid is not None))
+        if not ids:
+            return {}
+
+        cached = await CacheService.get_many([ProxyService._product_cache_key(pid) for pid in ids])
+        products: Dict[int, ProxyProduct] = {}
+        for pid in ids:
+            snapshot = cached.get(ProxyService._product_cache_key(pid))
+            if snapshot:
+                products[pid] = ProxyProduct(**snapshot)
+
+        missing = [pid for pid in ids if pid not in products]
+        if missing:
+            result = await db.execute(select(ProxyProduct).where(ProxyProduct.id.in_(missing)))
+            snapshots = {}
+            for product in result.scalars().all():
+                products[product.id] = product
+                snapshots[ProxyService._product_cache_key(product.id)] = {
+                    field: getattr(product, field) for field in PRODUCT_SNAPSHOT_FIELDS
+                }
+            if snapshots:
+                await CacheService.set_many(snapshots, ttl=PRODUCT_CACHE_TTL)
+        return products
+
+    @staticmethod
+    async def get_product(db: AsyncSession, product_id: int) -> Optional[ProxyProduct]:
+        """解析订单关联的商品配置（带缓存）"""
+        return (await ProxyService.get_products_by_ids(db, [product_id])).get(product_id)
+
+    @staticmethod
+    async def invalidate_products(*product_ids: int) -> None:
+        """商品被修改/删除后清理缓存"""
+        await CacheService.delete_many([ProxyService._product_cache_key(pid) for pid in product_ids])
+
     @staticmethod
     async def _prepare_purchase(
         db: AsyncSession,
@@ -187,7 +240,7 @@ class ProxyService:
         now = datetime.utcnow()
         description = f"Purchase {product.product_name}"
         order = Order(
-            order_number=await OrderService.generate_order_number(),
+            order_number=OrderService.generate_order_number(),
             user_id=user.id,
             type=OrderType.PURCHASE,
             amount=total_price,
@@ -200,7 +253,7 @@ class ProxyService:
         await db.flush()
 
         transaction = Transaction(
-            transaction_id=await OrderService.generate_transaction_id(),
+            transaction_id=OrderService.generate_transaction_id(),
             order_id=order.id,
             user_id=user.id,
             type="purchase",
@@ -239,6 +292,7 @@ class ProxyService:
             await db.rollback()
             raise
 
+        await SessionService.bump_session_version(user.id)
         await db.refresh(proxy_order)
         return ProxyOrderResponse.from_orm(proxy_order)
     
@@ -581,10 +635,7 @@ class ProxyService:
             )
         
         # 获取产品信息来确定原套餐时长
-        product_result = await db.execute(
-            select(ProxyProduct).where(ProxyProduct.id == proxy_order.product_id)
-        )
-        product = product_result.scalar_one_or_none()
+        product = await ProxyService.get_product(db, proxy_order.product_id)
         
         if not product:
             raise HTTPException(
@@ -671,10 +722,7 @@ class ProxyService:
             )
         
         # 获取产品信息来确定原套餐时长
-        product_result = await db.execute(
-            select(ProxyProduct).where(ProxyProduct.id == proxy_order.product_id)
-        )
-        product = product_result.scalar_one_or_none()
+        product = await ProxyService.get_product(db, proxy_order.product_id)
         
         if not product:
             raise HTTPException(
@@ -713,7 +761,7 @@ class ProxyService:
         description = f"Renew {product.product_name} for {duration_days} days"
         
         order = Order(
-            order_number=await OrderService.generate_order_number(),
+            order_number=OrderService.generate_order_number(),
             user_id=user.id,
             type=OrderType.PURCHASE,
             amount=total_price,
@@ -726,7 +774,7 @@ class ProxyService:
         await db.flush()
 
         transaction = Transaction(
-            transaction_id=await OrderService.generate_transaction_id(),
+            transaction_id=OrderService.generate_transaction_id(),
             order_id=order.id,
             user_id=user.id,
             type="renewal",
@@ -752,6 +800,7 @@ class ProxyService:
         upstream_result = await ProxyService.renew_dynamic_proxy(
             db, user_id, proxy_order.order_id, duration_days
         )
+        await SessionService.bump_session_version(user_id)
 
         return {
             "upstream_result": upstream_result,
@@ -910,10 +959,7 @@ class ProxyService:
             )
         
         # 获取产品信息来确定原套餐时长
-        product_result = await db.execute(
-            select(ProxyProduct).where(ProxyProduct.id == proxy_order.product_id)
-        )
-        product = product_result.scalar_one_or_none()
+        product = await ProxyService.get_product(db, proxy_order.product_id)
         
         if not product:
             raise HTTPException(
@@ -952,7 +998,7 @@ class ProxyService:
         description = f"Renew {product.product_name} for {duration_days} days"
         
         order = Order(
-            order_number=await OrderService.generate_order_number(),
+            order_number=OrderService.generate_order_number(),
             user_id=user.id,
             type=OrderType.PURCHASE,
             amount=total_price,
@@ -965,7 +1011,7 @@ class ProxyService:
         await db.flush()
 
         transaction = Transaction(
-            transaction_id=await OrderService.generate_transaction_id(),
+            transaction_id=OrderService.generate_transaction_id(),
             order_id=order.id,
             user_id=user.id,
             type="renewal",
@@ -991,6 +1037,7 @@ class ProxyService:
         upstream_result = await ProxyService.renew_mobile_proxy(
             db, user_id, proxy_order.order_id, duration_days
         )
+        await SessionService.bump_session_version(user_id)
 
         return {
             "upstream_result": upstream_result,
@@ -1113,10 +1160,7 @@ class ProxyService:
             )
         
         # 获取产品信息来确定当前代理类型
-        product_result = await db.execute(
-            select(ProxyProduct).where(ProxyProduct.id == proxy_order.product_id)
-        )
-        product = product_result.scalar_one_or_none()
+        product = await ProxyService.get_product(db, proxy_order.product_id)
         
         if not product:
             raise HTTPException(
@@ -1186,10 +1230,7 @@ class ProxyService:
             )
         
         # 获取产品信息来确定代理类型
-        product_result = await db.execute(
-            select(ProxyProduct).where(ProxyProduct.id == proxy_order.product_id)
-        )
-        product = product_result.scalar_one_or_none()
+        product = await ProxyService.get_product(db, proxy_order.product_id)
         
         if not product:
             raise HTTPException(
@@ -1256,10 +1297,7 @@ class ProxyService:
             )
         
         # 获取产品信息来确定代理类型
-        product_result = await db.execute(
-            select(ProxyProduct).where(ProxyProduct.id == proxy_order.product_id)
-        )
-        product = product_result.scalar_one_or_none()
+        product = await ProxyService.get_product(db, proxy_order.product_id)
         
         if not product:
             raise HTTPException(
@@ -1352,10 +1390,7 @@ class ProxyService:
             )
         
         # 获取产品信息来确定代理类型和原套餐时长
-        product_result = await db.execute(
-            select(ProxyProduct).where(ProxyProduct.id == proxy_order.product_id)
-        )
-        product = product_result.scalar_one_or_none()
+        product = await ProxyService.get_product(db, proxy_order.product_id)
         
         if not product:
             raise HTTPException(
@@ -1394,7 +1429,7 @@ class ProxyService:
         description = f"Renew {product.product_name} for {duration_days} days"
         
         order = Order(
-            order_number=await OrderService.generate_order_number(),
+            order_number=OrderService.generate_order_number(),
             user_id=user.id,
             type=OrderType.PURCHASE,
             amount=total_price,
@@ -1407,7 +1442,7 @@ class ProxyService:
         await db.flush()
 
         transaction = Transaction(
-            transaction_id=await OrderService.generate_transaction_id(),
+            transaction_id=OrderService.generate_transaction_id(),
             order_id=order.id,
             user_id=user.id,
             type="renewal",
@@ -1431,6 +1466,7 @@ class ProxyService:
         
         # 调用原有的续费方法
         upstream_result = await ProxyService.renew_static_proxy(db, user_id, order_id, duration_days)
+        await SessionService.bump_session_version(user_id)
         
         return {
             "upstream_result": upstream_result,
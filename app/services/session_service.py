@@ -1,30 +1,114 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import logging
+import re
 import time
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from fastapi import HTTPException, status
-from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.core.config import settings
-from app.core.database import AsyncSessionLocal
+from app.core.database import AsyncSessionLocal, add_after_commit
 from app.core.security import (
     create_access_token,
-    get_password_hash,
-    verify_password,
+    get_password_hash_async,
+    verify_password_async,
     verify_token,
 )
 from app.models.user import APIKey, User
 from app.schemas.session import SessionEnvelope, SessionPageState, SessionUser
 from app.schemas.user import APIKeyCreate, UserCreate
-from app.utils.cache import CacheService
+from app.utils.bloom import BloomFilter, item_digest
+from app.utils.cache import (
+    CacheService,
+    LocalTTLCache,
+    cached,
+    on_pubsub_subscribed,
+    publish,
+    publish_invalidation,
+    pubsub_subscribed,
+    subscribe_channel,
+)
 
 logger = logging.getLogger(__name__)
 
+# api_key:* 缓存记录的结构版本，旧结构（不含用户状态）视为未命中
+API_KEY_CACHE_VERSION = 2
+API_KEY_CACHE_TTL = 3600
+# 逻辑过期后继续返回旧记录并后台刷新的窗口（撤销/禁用会主动删除缓存，不受影响）
+API_KEY_CACHE_STALE_TTL = 300
+
+# Redis 前面的进程内缓存，命中时鉴权无需任何网络/数据库往返
+_api_key_local_cache = LocalTTLCache(
+    maxsize=getattr(settings, "API_KEY_LOCAL_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "API_KEY_LOCAL_CACHE_TTL", 30),
+)
+
+
+# 无效 API Key 的短期负缓存（按摘要存储），挡住重复的错误密钥
+_api_key_negative_cache = LocalTTLCache(
+    maxsize=getattr(settings, "API_KEY_NEGATIVE_CACHE_SIZE", 50000),
+    ttl=getattr(settings, "API_KEY_NEGATIVE_CACHE_TTL", 60),
+)
+
+# 已验签的 JWT 负载缓存（按令牌哈希存储，过期时间不超过 exp）
+_token_cache = LocalTTLCache(
+    maxsize=getattr(settings, "TOKEN_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "TOKEN_CACHE_TTL", 300),
+)
+
+# 会话鉴权用的用户快照缓存（本地 + Redis），密码/状态/角色变化时失效
+USER_CACHE_TTL = 300
+_user_local_cache = LocalTTLCache(
+    maxsize=getattr(settings, "USER_LOCAL_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "USER_LOCAL_CACHE_TTL", 30),
+)
+
+# /session/state 响应缓存：按 session_rev:{user_id} 版本（纪元.版本号）分桶
+SESSION_ENVELOPE_TTL = 300
+
+# 新增 API Key 时广播其摘要，其他 worker 同步加入布隆过滤器
+API_KEY_FILTER_CHANNEL = "api_key_filter:add"
+API_KEY_FILTER_ERROR_RATE = 0.001
+
+# MySQL 1062 重复键错误中的索引名 -> 注册失败提示
+# （create_all 生成的唯一索引为 ix_users_*；早期手工建表时唯一约束以列名命名）
+_MYSQL_DUPLICATE_ENTRY = 1062
+_DUPLICATE_KEY_PATTERN = re.compile(r"for key '(?:[^'.]+\.)?([^'.]+)'\s*$")
+_REGISTER_DUPLICATE_DETAILS = {
+    "ix_users_email": "Email already registered",
+    "email": "Email already registered",
+    "ix_users_username": "Username already registered",
+    "username": "Username already registered",
+}
+# 重建后的这段时间内，过滤器未命中仍回查（覆盖重建快照与订阅之间新增的密钥）
+API_KEY_FILTER_GRACE_SECONDS = getattr(settings, "API_KEY_FILTER_GRACE_SECONDS", 10)
+
+
+class APIKeyPrincipal:
+    """API Key 鉴权后的轻量用户描述，直接由缓存记录构造。"""
+
+    __slots__ = ("id", "is_active", "is_admin")
+
+    def __init__(self, id: int, is_active: bool, is_admin: bool):
+        self.id = id
+        self.is_active = is_active
+        self.is_admin = is_admin
+
+    @classmethod
+    def from_api_key_info(cls, info: dict) -> "APIKeyPrincipal":
+        return cls(
+            id=info["user_id"],
+            is_active=bool(info.get("user_is_active")),
+            is_admin=bool(info.get("user_is_admin")),
+        )
+
 
 class SessionService:
     """统一的用户会话和鉴权服务。"""
@@ -39,36 +123,45 @@ class SessionService:
         "admin": {"reason": "ADMIN_ONLY"},
     }
 
+    # 全部有效 API Key 的布隆过滤器；为 None 时（尚未构建）不做拦截
+    _api_key_filter: Optional[BloomFilter] = None
+    # 重建期间新增的摘要，重建完成后补入新过滤器
+    _api_key_filter_pending: Optional[List[bytes]] = None
+    _api_key_filter_built_at = 0.0
+    _api_key_filter_lock = asyncio.Lock()
+
     @staticmethod
     async def register_user(db: AsyncSession, user_data: UserCreate) -> User:
-        """注册新用户。"""
-        existing = await db.execute(select(User).where(User.username == user_data.username))
-        if existing.scalar_one_or_none():
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Username already registered",
-            )
-
-        existing_email = await db.execute(select(User).where(User.email == user_data.email))
-        if existing_email.scalar_one_or_none():
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered",
-            )
-
+        """注册新用户（用户名/邮箱重复由唯一约束检测）。"""
         now = datetime.utcnow()
         db_user = User(
             username=user_data.username,
             email=user_data.email,
-            password_hash=get_password_hash(user_data.password),
+            password_hash=await get_password_hash_async(user_data.password),
             created_at=now,
             updated_at=now,
         )
         db.add(db_user)
-        await db.commit()
+        try:
+            await db.commit()
+        except IntegrityError as exc:
+            await db.rollback()
+            detail = _REGISTER_DUPLICATE_DETAILS.get(SessionService._duplicate_key_name(exc) or "")
+            if detail is None:
+                raise
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
         await db.refresh(db_user)
         return db_user
 
+    @staticmethod
+    def _duplicate_key_name(exc: IntegrityError) -> Optional[str]:
+        """从 MySQL 重复键错误中取出冲突的索引名（不含表名前缀），其他完整性错误返回 None。"""
+        args = getattr(exc.orig, "args", ())
+        if len(args) < 2 or args[0] != _MYSQL_DUPLICATE_ENTRY:
+            return None
+        match = _DUPLICATE_KEY_PATTERN.search(str(args[1]))
+        return match.group(1) if match else None
+
     @staticmethod
     async def authenticate_credentials(
         db: AsyncSession, username: str, password: str
@@ -78,7 +171,7 @@ class SessionService:
         user = result.scalar_one_or_none()
         if not user:
             return None
-        if not verify_password(password, user.password_hash):
+        if not await verify_password_async(password, user.password_hash):
             return None
         if not user.is_active:
             return None
@@ -97,9 +190,33 @@ class SessionService:
         return result.scalar_one_or_none()
 
     @staticmethod
-    async def resolve_user_from_token(db: AsyncSession, token: str) -> Optional[User]:
-        """从JWT中解析用户。"""
+    def verify_token_cached(token: str) -> Optional[dict]:
+        """验证JWT，已验签的令牌在过期前直接复用缓存结果。"""
+        token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        now = time.time()
+        payload = _token_cache.get(token_hash)
+        if payload is not None:
+            exp = payload.get("exp")
+            if exp and exp <= now:
+                _token_cache.delete(token_hash)
+                return None
+            return payload
+
         payload = verify_token(token)
+        if not payload:
+            return None
+        ttl = _token_cache.ttl
+        exp = payload.get("exp")
+        if exp:
+            ttl = min(ttl, exp - now)
+        if ttl > 0:
+            _token_cache.set(token_hash, payload, ttl=ttl)
+        return payload
+
+    @staticmethod
+    async def resolve_user_from_token(db: AsyncSession, token: str) -> Optional[User]:
+        """从JWT中解析用户（始终读取数据库中的最新记录）。"""
+        payload = SessionService.verify_token_cached(token)
         if not payload:
             return None
         username = payload.get("sub")
@@ -107,6 +224,59 @@ class SessionService:
             return None
         return await SessionService.get_user_by_username(db, username)
 
+    @staticmethod
+    def _user_cache_key(username: str) -> str:
+        return f"session_user:{username}"
+
+    @staticmethod
+    def _user_snapshot(user: User) -> dict:
+        return {
+            "id": user.id,
+            "username": user.username,
+            "email": user.email,
+            "is_active": bool(user.is_active),
+            "is_admin": bool(user.is_admin),
+            "balance": str(user.balance or 0),
+        }
+
+    @staticmethod
+    async def resolve_cached_user(db: AsyncSession, token: str) -> Optional[User]:
+        """从JWT中解析用户，优先使用用户快照缓存。
+
+        命中缓存时返回未绑定会话的 User 快照，仅适用于鉴权与读取 id/角色等字段；
+        需要修改用户或读取实时余额时应重新从数据库加载。
+        """
+        payload = SessionService.verify_token_cached(token)
+        if not payload:
+            return None
+        username = payload.get("sub")
+        if not username:
+            return None
+
+        cache_key = SessionService._user_cache_key(username)
+        snapshot = _user_local_cache.get(cache_key)
+        if snapshot is None:
+            snapshot = await CacheService.get(cache_key)
+            if isinstance(snapshot, dict):
+                _user_local_cache.set(cache_key, snapshot)
+        if isinstance(snapshot, dict):
+            return User(**snapshot)
+
+        user = await SessionService.get_user_by_username(db, username)
+        if not user:
+            return None
+        snapshot = SessionService._user_snapshot(user)
+        _user_local_cache.set(cache_key, snapshot)
+        await CacheService.set(cache_key, snapshot, ttl=USER_CACHE_TTL)
+        return user
+
+    @staticmethod
+    async def invalidate_user(username: str) -> None:
+        """用户密码、状态或角色变化后清除其快照缓存（含其他 worker）。"""
+        cache_key = SessionService._user_cache_key(username)
+        await CacheService.delete(cache_key)
+        await publish_invalidation(cache_key)
+
     @staticmethod
     async def build_session_envelope(
         user: User, 
@@ -144,6 +314,49 @@ class SessionService:
             refreshed_at=datetime.utcnow(),
         )
 
+    @staticmethod
+    async def get_session_version(user_id: int) -> Optional[str]:
+        """读取用户会话版本（"纪元.版本"）；Redis 不可用时返回 None（不做缓存）。
+
+        纪元在 Redis 数据丢失后变化，客户端持有的旧 ETag 不会与重新计数的版本号碰撞。
+        """
+        return await CacheService.get_version(f"session_rev:{user_id}")
+
+    @staticmethod
+    async def bump_session_version(user_id: int) -> None:
+        """余额、API Key、状态或角色变化后递增版本号，使会话缓存和 ETag 失效。"""
+        await CacheService.bump_version(f"session_rev:{user_id}")
+
+    @staticmethod
+    def bump_session_version_after_commit(db: AsyncSession, user_id: int) -> None:
+        """在 get_db 提交事务后再递增版本号，避免缓存未提交前的旧数据。"""
+        add_after_commit(db, lambda: SessionService.bump_session_version(user_id))
+
+    @staticmethod
+    def session_etag(user_id: int, version: str) -> str:
+        return f'W/"session-{user_id}-{version}"'
+
+    @staticmethod
+    async def get_cached_session_envelope(
+        user_id: int, version: str, token: str
+    ) -> Optional[SessionEnvelope]:
+        """读取指定版本的会话缓存（缓存中不含令牌，使用本次请求的令牌）。"""
+        data = await CacheService.get(f"session_envelope:{user_id}:{version}")
+        if not isinstance(data, dict):
+            return None
+        try:
+            return SessionEnvelope(**data, token=token)
+        except Exception:
+            return None
+
+    @staticmethod
+    async def cache_session_envelope(user_id: int, version: str, envelope: SessionEnvelope) -> None:
+        await CacheService.set(
+            f"session_envelope:{user_id}:{version}",
+            envelope.model_dump(mode="json", exclude={"token"}),
+            ttl=SESSION_ENVELOPE_TTL,
+        )
+
     @staticmethod
     def _build_page_states(user: User) -> Dict[str, SessionPageState]:
         """根据用户信息计算各页面可访问性。"""
@@ -238,43 +451,122 @@ class SessionService:
         db.add(api_key)
         await db.commit()
         await db.refresh(api_key)
-        await CacheService.set(
-            f"api_key:{api_key.api_key}",
-            {
-                "user_id": api_key.user_id,
-                "rate_limit": api_key.rate_limit,
-                "is_active": api_key.is_active,
-                "api_key_id": api_key.id,
-            },
-            ttl=3600,
-        )
+        await SessionService._register_api_key(api_key.api_key)
+        await SessionService.bump_session_version(user_id)
+        user = await db.get(User, user_id)
+        if user:
+            await SessionService._cache_api_key_info(
+                api_key.api_key, SessionService._build_api_key_info(api_key, user)
+            )
         return api_key
 
     @staticmethod
-    async def get_api_key_info(db: AsyncSession, api_key: str) -> Optional[dict]:
-        """获取API密钥数据信息。"""
-        cached = await CacheService.get(f"api_key:{api_key}")
-        if cached:
-            return cached
-
-        result = await db.execute(
-            select(APIKey).where(APIKey.api_key == api_key, APIKey.is_active == True)
-        )
-        api_key_obj = result.scalar_one_or_none()
-        if not api_key_obj:
-            return None
-        if api_key_obj.expires_at and api_key_obj.expires_at.timestamp() < time.time():
-            return None
-
-        info = {
+    def _build_api_key_info(api_key_obj: APIKey, user: User) -> dict:
+        """构建缓存用的 API Key 记录（附带用户状态，鉴权时无需再查用户表）。"""
+        return {
             "user_id": api_key_obj.user_id,
             "rate_limit": api_key_obj.rate_limit,
             "is_active": api_key_obj.is_active,
             "api_key_id": api_key_obj.id,
+            "expires_at": api_key_obj.expires_at.timestamp() if api_key_obj.expires_at else None,
+            "user_is_active": bool(user.is_active),
+            "user_is_admin": bool(user.is_admin),
+            "version": API_KEY_CACHE_VERSION,
         }
-        await CacheService.set(f"api_key:{api_key}", info, ttl=3600)
+
+    @staticmethod
+    async def _cache_api_key_info(api_key: str, info: dict) -> None:
+        _api_key_local_cache.set(f"api_key:{api_key}", info)
+        await SessionService._load_api_key_info.prime(api_key, value=info)
+
+    @staticmethod
+    def _is_usable_api_key_info(info: Optional[dict]) -> bool:
+        if not isinstance(info, dict) or info.get("version") != API_KEY_CACHE_VERSION:
+            return False
+        expires_at = info.get("expires_at")
+        return not (expires_at and expires_at < time.time())
+
+    @staticmethod
+    @cached(
+        key=lambda api_key: f"api_key:{api_key}",
+        ttl=API_KEY_CACHE_TTL,
+        stale_ttl=API_KEY_CACHE_STALE_TTL,
+        is_valid=lambda info: SessionService._is_usable_api_key_info(info),
+    )
+    async def _load_api_key_info(api_key: str) -> Optional[dict]:
+        """从数据库加载 API Key 记录（经 cached() 单飞，热点键过期时不会集中打到 MySQL）。"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(APIKey, User)
+                .join(User, User.id == APIKey.user_id)
+                .where(APIKey.api_key == api_key, APIKey.is_active == True)
+            )
+            row = result.first()
+        if not row:
+            return None
+        api_key_obj, user = row
+        if api_key_obj.expires_at and api_key_obj.expires_at.timestamp() < time.time():
+            return None
+        return SessionService._build_api_key_info(api_key_obj, user)
+
+    @staticmethod
+    async def get_api_key_info(api_key: str) -> Optional[dict]:
+        """获取API密钥数据信息（本地缓存 -> Redis -> 数据库）。
+
+        返回的记录包含 user_is_active / user_is_admin，调用方无需再查询用户。
+        """
+        cache_key = f"api_key:{api_key}"
+        local = _api_key_local_cache.get(cache_key)
+        if local is not None:
+            if SessionService._is_usable_api_key_info(local):
+                return local
+            _api_key_local_cache.delete(cache_key)
+
+        # 布隆过滤器 + 负缓存：绝大多数无效密钥在任何 I/O 之前被拒绝
+        digest = item_digest(api_key)
+        key_filter = SessionService._api_key_filter
+        filter_miss = key_filter is not None and not key_filter.contains_digest(digest)
+        if filter_miss and SessionService._api_key_filter_trusted():
+            return None
+        if _api_key_negative_cache.get(digest.hex()):
+            return None
+
+        info = await SessionService._load_api_key_info(api_key)
+        if info is None:
+            _api_key_negative_cache.set(digest.hex(), True)
+            return None
+        if filter_miss:
+            # 漏收的新增广播：补入过滤器
+            SessionService._add_api_key_digest(digest)
+        _api_key_local_cache.set(cache_key, info)
         return info
 
+    @staticmethod
+    def _api_key_filter_trusted() -> bool:
+        """过滤器未命中可直接拒绝：正在订阅新增广播，且距上次重建已超过宽限期"""
+        return (
+            pubsub_subscribed()
+            and time.monotonic() - SessionService._api_key_filter_built_at >= API_KEY_FILTER_GRACE_SECONDS
+        )
+
+    @staticmethod
+    async def invalidate_api_key(api_key: str) -> None:
+        """删除 API Key 缓存并广播给其他 worker。"""
+        cache_key = f"api_key:{api_key}"
+        # 经 cached() 失效：递增失效代数，进行中的后台刷新不会写回旧记录
+        await SessionService._load_api_key_info.invalidate_keys(cache_key)
+        await publish_invalidation(cache_key)
+
+    @staticmethod
+    async def invalidate_user_api_keys(db: AsyncSession, user_id: int) -> None:
+        """用户状态/角色变化后，使其全部 API Key 缓存失效。"""
+        result = await db.execute(select(APIKey.api_key).where(APIKey.user_id == user_id))
+        cache_keys = [f"api_key:{api_key}" for api_key in result.scalars().all()]
+        if not cache_keys:
+            return
+        await SessionService._load_api_key_info.invalidate_keys(*cache_keys)
+        await publish_invalidation(*cache_keys)
+
     @staticmethod
     async def rotate_api_key(db: AsyncSession, user_id: int, api_key_id: int) -> APIKey:
         """轮换API密钥。"""
@@ -288,22 +580,87 @@ class SessionService:
                 detail="API key not found",
             )
 
-        await CacheService.delete(f"api_key:{api_key.api_key}")
+        await SessionService.invalidate_api_key(api_key.api_key)
 
         from app.core.security import generate_api_key
 
         api_key.api_key = generate_api_key()
         await db.commit()
         await db.refresh(api_key)
-
-        await CacheService.set(
-            f"api_key:{api_key.api_key}",
-            {
-                "user_id": api_key.user_id,
-                "rate_limit": api_key.rate_limit,
-                "is_active": api_key.is_active,
-                "api_key_id": api_key.id,
-            },
-            ttl=3600,
-        )
+        await SessionService._register_api_key(api_key.api_key)
+        await SessionService.bump_session_version(user_id)
+        user = await db.get(User, user_id)
+        if user:
+            await SessionService._cache_api_key_info(
+                api_key.api_key, SessionService._build_api_key_info(api_key, user)
+            )
         return api_key
+
+    @staticmethod
+    def _add_api_key_digest(digest: bytes) -> None:
+        """把摘要加入本地过滤器，并清除对应的负缓存。"""
+        _api_key_negative_cache.delete(digest.hex())
+        if SessionService._api_key_filter is not None:
+            SessionService._api_key_filter.add_digest(digest)
+        if SessionService._api_key_filter_pending is not None:
+            SessionService._api_key_filter_pending.append(digest)
+
+    @staticmethod
+    def _handle_api_key_filter_message(data: str) -> None:
+        try:
+            digest = bytes.fromhex(data)
+        except (TypeError, ValueError):
+            return
+        SessionService._add_api_key_digest(digest)
+
+    @staticmethod
+    async def _register_api_key(api_key: str) -> None:
+        """新密钥加入本 worker 的过滤器，并广播给其他 worker。"""
+        digest = item_digest(api_key)
+        SessionService._add_api_key_digest(digest)
+        await publish(API_KEY_FILTER_CHANNEL, digest.hex())
+
+    @staticmethod
+    async def load_api_key_filter(db: AsyncSession) -> int:
+        """根据数据库中全部有效 API Key 重建布隆过滤器，返回密钥数量。"""
+        # 定时重建与重新订阅触发的重建可能并发，串行执行以免互相清空待补摘要
+        async with SessionService._api_key_filter_lock:
+            SessionService._api_key_filter_pending = []
+            try:
+                result = await db.execute(select(APIKey.api_key).where(APIKey.is_active == True))
+                keys = result.scalars().all()
+                capacity = max(getattr(settings, "API_KEY_FILTER_CAPACITY", 100000), len(keys) * 2)
+                key_filter = BloomFilter.from_items(keys, capacity, API_KEY_FILTER_ERROR_RATE)
+                for digest in SessionService._api_key_filter_pending:
+                    key_filter.add_digest(digest)
+                SessionService._api_key_filter = key_filter
+                SessionService._api_key_filter_built_at = time.monotonic()
+            finally:
+                SessionService._api_key_filter_pending = None
+        logger.info("API key bloom filter rebuilt with %s keys", len(keys))
+        return len(keys)
+
+    @staticmethod
+    async def run_api_key_filter_refresher() -> None:
+        """周期性重建布隆过滤器（清除已删除的密钥、校正跨 worker 漏同步）。"""
+        interval = getattr(settings, "API_KEY_FILTER_REFRESH_SECONDS", 300)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await SessionService.load_api_key_filter(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("API key bloom filter refresh failed: %s", exc)
+
+
+    @staticmethod
+    async def _rebuild_api_key_filter() -> None:
+        """（重新）订阅后重建过滤器，补齐未订阅期间错过的新增广播"""
+        async with AsyncSessionLocal() as db:
+            await SessionService.load_api_key_filter(db)
+
+
+subscribe_channel(API_KEY_FILTER_CHANNEL, SessionService._handle_api_key_filter_message)
+on_pubsub_subscribed(SessionService._rebuild_api_key_filter)
@@ -0,0 +1,320 @@
+"""
+支付回调收件箱
+
+Webhook 接口只做验签并写入 webhook_events 后立即应答，
+后台任务按支付单顺序（同一 payment_ref 按 id 先后）认领并处理事件，失败按指数退避重试。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, run_after_commit
+from app.models.order import WebhookEvent
+from app.services.crypto_payment import crypto_payment_service
+from app.services.cryptomus_client import get_cryptomus_client
+from app.services.deposit_wallet import DepositWalletService
+from app.services.order_service import OrderService
+from app.utils.cache import publish, subscribe_channel
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_INBOX_CHANNEL = "webhook_inbox:new"
+WEBHOOK_WORKER_CONCURRENCY = getattr(settings, "WEBHOOK_WORKER_CONCURRENCY", 8)
+WEBHOOK_BATCH_SIZE = getattr(settings, "WEBHOOK_BATCH_SIZE", 50)
+WEBHOOK_POLL_INTERVAL = getattr(settings, "WEBHOOK_POLL_INTERVAL", 5.0)
+WEBHOOK_MAX_ATTEMPTS = getattr(settings, "WEBHOOK_MAX_ATTEMPTS", 10)
+WEBHOOK_RETRY_MAX_DELAY = getattr(settings, "WEBHOOK_RETRY_MAX_DELAY", 300)
+# 处理中的事件超过租期未完成（worker 崩溃等）视为可重新认领
+WEBHOOK_LEASE_SECONDS = getattr(settings, "WEBHOOK_LEASE_SECONDS", 120)
+
+# 这些错误重试也不会成功（验签/金额/币种/商户不符），直接标记失败
+_PERMANENT_STATUS_CODES = {status.HTTP_400_BAD_REQUEST, status.HTTP_403_FORBIDDEN}
+
+_wakeup_event: Optional[asyncio.Event] = None
+_stats: Dict[str, int] = {
+    "enqueued": 0,
+    "duplicates": 0,
+    "processed": 0,
+    "retried": 0,
+    "failed": 0,
+}
+
+
+def _wakeup() -> asyncio.Event:
+    # 延迟创建，确保绑定到运行中的事件循环
+    global _wakeup_event
+    if _wakeup_event is None:
+        _wakeup_event = asyncio.Event()
+    return _wakeup_event
+
+
+class WebhookInboxService:
+    """回调收件箱：入队、认领与处理"""
+
+    @staticmethod
+    async def enqueue(db: AsyncSession, provider: str, payment_ref: str, raw_body: bytes) -> bool:
+        """持久化回调原文并提交；同一原文重复推送返回 False"""
+        event = WebhookEvent(
+            provider=provider,
+            event_key=hashlib.sha256(raw_body).hexdigest(),
+            payment_ref=str(payment_ref)[:64],
+            payload=raw_body.decode("utf-8"),
+            status="pending",
+            attempts=0,
+            next_attempt_at=datetime.utcnow(),
+        )
+        db.add(event)
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            _stats["duplicates"] += 1
+            return False
+
+        _stats["enqueued"] += 1
+        _wakeup().set()
+        await publish(WEBHOOK_INBOX_CHANNEL, payment_ref)
+        return True
+
+    @staticmethod
+    def _handle_new_event_message(_: str) -> None:
+        """其他 worker 入队了新事件，唤醒本进程的处理循环"""
+        _wakeup().set()
+
+    @staticmethod
+    def _claimable_query(now: datetime):
+        earlier = aliased(WebhookEvent)
+        # 同一支付单存在更早的未完成事件时不认领，保证按序处理
+        blocked = (
+            select(earlier.id)
+            .where(
+                earlier.payment_ref == WebhookEvent.payment_ref,
+                earlier.id < WebhookEvent.id,
+                earlier.status.in_(("pending", "processing")),
+            )
+            .exists()
+        )
+        ready = or_(
+            and_(WebhookEvent.status == "pending", WebhookEvent.next_attempt_at <= now),
+            and_(
+                WebhookEvent.status == "processing",
+                WebhookEvent.claimed_at < now - timedelta(seconds=WEBHOOK_LEASE_SECONDS),
+            ),
+        )
+        return (
+            select(WebhookEvent)
+            .where(ready, ~blocked)
+            .order_by(WebhookEvent.id)
+            .limit(WEBHOOK_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+
+    @staticmethod
+    async def process_batch() -> int:
+        """认领一批可处理事件并并发处理（每个支付单至多一个），返回认领数量"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(WebhookInboxService._claimable_query(now))
+            events = result.scalars().all()
+            if not events:
+                return 0
+            for event in events:
+                event.status = "processing"
+                event.claimed_at = now
+                event.attempts = (event.attempts or 0) + 1
+            await db.commit()
+            claimed = [(event.id, event.payload, event.attempts) for event in events]
+
+        semaphore = asyncio.Semaphore(WEBHOOK_WORKER_CONCURRENCY)
+
+        async def run(event_id: int, payload: str, attempts: int) -> None:
+            async with semaphore:
+                await WebhookInboxService._run_event(event_id, payload, attempts)
+
+        await asyncio.gather(*(run(*item) for item in claimed))
+        return len(claimed)
+
+    @staticmethod
+    async def _run_event(event_id: int, payload: str, attempts: int) -> None:
+        error: Optional[str] = None
+        permanent = False
+        try:
+            async with AsyncSessionLocal() as db:
+                try:
+                    await WebhookInboxService._process_cryptomus(db, json.loads(payload))
+                    await db.commit()
+                except Exception:
+                    db.info.pop("after_commit", None)
+                    await db.rollback()
+                    raise
+                await run_after_commit(db)
+        except HTTPException as e:
+            error = str(e.detail)
+            permanent = e.status_code in _PERMANENT_STATUS_CODES
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        await WebhookInboxService._finish(event_id, attempts, error, permanent)
+
+    @staticmethod
+    async def _finish(event_id: int, attempts: int, error: Optional[str], permanent: bool) -> None:
+        now = datetime.utcnow()
+        if error is None:
+            values: Dict[str, Any] = {"status": "done", "processed_at": now, "last_error": None}
+            _stats["processed"] += 1
+        elif permanent or attempts >= WEBHOOK_MAX_ATTEMPTS:
+            values = {"status": "failed", "processed_at": now, "last_error": error}
+            _stats["failed"] += 1
+            logger.error("Webhook event %s failed after %s attempts: %s", event_id, attempts, error)
+        else:
+            delay = min(2 ** attempts, WEBHOOK_RETRY_MAX_DELAY)
+            values = {
+                "status": "pending",
+                "next_attempt_at": now + timedelta(seconds=delay),
+                "last_error": error,
+            }
+            _stats["retried"] += 1
+            logger.warning("Webhook event %s will retry in %ss: %s", event_id, delay, error)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(WebhookEvent).where(WebhookEvent.id == event_id).values(**values))
+                await db.commit()
+        except Exception as e:
+            # 状态未落库时租期到期后会被重新认领，处理逻辑本身是幂等的
+            logger.error("Failed to record webhook event %s result: %s", event_id, e)
+
+    @staticmethod
+    async def _process_cryptomus(db: AsyncSession, webhook_data: Dict[str, Any]) -> None:
+        """处理一条已验签的 Cryptomus 回调（幂等，重复终态直接跳过）"""
+        if settings.CRYPTOMUS_MERCHANT_UUID and webhook_data.get("merchant") and webhook_data.get("merchant") != settings.CRYPTOMUS_MERCHANT_UUID:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid merchant")
+        if webhook_data.get("type") == "wallet":
+            # 静态钱包到账：没有预先创建的支付记录，按到账金额生成充值订单
+            await DepositWalletService.process_deposit(db, webhook_data)
+            return
+
+        payment_uuid = webhook_data.get("uuid")
+        order_id = webhook_data.get("order_id")
+        payment_status = webhook_data.get("status") or webhook_data.get("payment_status", "check")
+        transaction_hash = webhook_data.get("txid")
+        confirmations = webhook_data.get("confirmations", 0)
+        required_confirmations = webhook_data.get("required_confirmations") or webhook_data.get("confirmations_required")
+
+        resolved_payment_id = order_id
+        if not resolved_payment_id and payment_uuid:
+            try:
+                async with get_cryptomus_client() as client:
+                    info = await client.get_payment_info(payment_id=payment_uuid)
+                resolved_payment_id = (info.get("result") or {}).get("order_id")
+            except Exception as lookup_error:
+                logger.warning(
+                    "Failed to resolve Cryptomus order_id for uuid %s: %s",
+                    payment_uuid,
+                    lookup_error,
+                )
+        if not resolved_payment_id:
+            resolved_payment_id = payment_uuid
+        if not resolved_payment_id:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing payment identifier")
+
+        # 从DB获取支付记录（强一致校验）；创建支付的事务可能尚未提交，404 按可重试处理
+        payment_record = await OrderService.get_payment_by_id(db, resolved_payment_id)
+        if not payment_record:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found")
+
+        confirmations = crypto_payment_service._parse_int(confirmations)
+        if confirmations is None:
+            confirmations = 0
+        required_confirmations = crypto_payment_service._parse_int(required_confirmations)
+        if required_confirmations is None:
+            required_confirmations = payment_record.required_confirmations
+
+        # 基础校验：订单/金额/币种（商户已在入口校验）
+        stored_payment = await crypto_payment_service.get_cached_payment(resolved_payment_id)
+        if order_id and payment_record.order_id and order_id != (stored_payment or {}).get("order_id", order_id):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order id mismatch")
+
+        incoming_amount = webhook_data.get("order_amount") or webhook_data.get("amount")
+        if incoming_amount is not None:
+            try:
+                amount_matches = Decimal(str(payment_record.amount)) == Decimal(str(incoming_amount))
+            except (InvalidOperation, ValueError):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount parse error")
+            if not amount_matches:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount mismatch")
+
+        incoming_currency = webhook_data.get("currency")
+        if incoming_currency and payment_record.crypto_currency and str(incoming_currency).upper() != payment_record.crypto_currency.value:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Currency mismatch")
+
+        converted_status = crypto_payment_service._convert_cryptomus_status(payment_status)
+
+        if converted_status in ["confirmed", "paid"] and required_confirmations and confirmations < required_confirmations:
+            confirmations = required_confirmations
+
+        # 已是相同终态的重复通知，直接跳过（幂等）
+        if stored_payment and crypto_payment_service._is_final_status(stored_payment.get("status", "")) and crypto_payment_service._is_final_status(converted_status) and converted_status == stored_payment.get("status"):
+            logger.info("Duplicate Cryptomus webhook skipped: %s - %s", resolved_payment_id, payment_status)
+            return
+
+        await crypto_payment_service.update_payment_status(
+            payment_id=resolved_payment_id,
+            status=converted_status,
+            transaction_hash=transaction_hash,
+            confirmations=confirmations,
+            required_confirmations=required_confirmations,
+        )
+
+        if converted_status in ["confirmed", "paid"]:
+            success = await OrderService.confirm_payment(
+                db,
+                resolved_payment_id,
+                transaction_hash,
+                confirmations,
+                required_confirmations=required_confirmations,
+            )
+            if success:
+                logger.info(f"Cryptomus payment confirmed: {resolved_payment_id}")
+            else:
+                logger.error(f"Failed to confirm Cryptomus payment: {resolved_payment_id}")
+
+        logger.info(f"Cryptomus webhook processed: {resolved_payment_id} - {payment_status}")
+
+    @staticmethod
+    async def run_worker() -> None:
+        """后台处理循环：有新事件时立即处理，否则按轮询间隔检查重试到期的事件"""
+        while True:
+            try:
+                claimed = await WebhookInboxService.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Webhook inbox batch failed: %s", exc)
+                claimed = 0
+            if claimed:
+                continue
+            event = _wakeup()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=WEBHOOK_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+
+    @staticmethod
+    def stats() -> Dict[str, int]:
+        return dict(_stats)
+
+
+subscribe_channel(WEBHOOK_INBOX_CHANNEL, WebhookInboxService._handle_new_event_message)
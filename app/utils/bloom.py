@@ -0,0 +1,49 @@
+import hashlib
+import math
+from typing import Iterable
+
+
+def item_digest(item: str) -> bytes:
+    """布隆过滤器使用的 128 位摘要（也可用于广播，避免传输原始值）"""
+    return hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+
+
+class BloomFilter:
+    """基于 bytearray 的布隆过滤器（双重哈希定位比特位）。"""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def from_items(cls, items: Iterable[str], capacity: int, error_rate: float = 0.001) -> "BloomFilter":
+        bloom = cls(capacity=capacity, error_rate=error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, digest: bytes):
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add_digest(self, digest: bytes) -> None:
+        for pos in self._positions(digest):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def contains_digest(self, digest: bytes) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+    def add(self, item: str) -> None:
+        self.add_digest(item_digest(item))
+
+    def __contains__(self, item: str) -> bool:
+        return self.contains_digest(item_digest(item))
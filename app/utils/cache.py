@@ -1,68 +1,694 @@
+import asyncio
+import functools
 import json
 import logging
+import math
+import random
 import time
-from collections import defaultdict
-from typing import Any, Dict, Optional
+import uuid
+from array import array
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
 import redis.asyncio as redis
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 
 from app.core.config import settings
+from app.utils import codecs
 
 logger = logging.getLogger(__name__)
 
-# Redis客户端
+# Redis客户端：断开或熔断期间为 None，所有调用方按“缓存不可用”降级；
+# 由 run_redis_supervisor 后台任务负责健康检查与重连
 redis_client = None
-async def init_redis():
+
+REDIS_MAX_CONNECTIONS = getattr(settings, "REDIS_MAX_CONNECTIONS", 50)
+REDIS_POOL_TIMEOUT = getattr(settings, "REDIS_POOL_TIMEOUT", 2.0)
+REDIS_SOCKET_TIMEOUT = getattr(settings, "REDIS_SOCKET_TIMEOUT", 1.0)
+REDIS_CONNECT_TIMEOUT = getattr(settings, "REDIS_CONNECT_TIMEOUT", 1.0)
+REDIS_HEALTH_CHECK_INTERVAL = getattr(settings, "REDIS_HEALTH_CHECK_INTERVAL", 5.0)
+REDIS_RECONNECT_MIN_DELAY = getattr(settings, "REDIS_RECONNECT_MIN_DELAY", 0.5)
+REDIS_RECONNECT_MAX_DELAY = getattr(settings, "REDIS_RECONNECT_MAX_DELAY", 30.0)
+# 订阅连接的空闲轮询间隔与断线探测（PING）间隔
+REDIS_PUBSUB_POLL_TIMEOUT = getattr(settings, "REDIS_PUBSUB_POLL_TIMEOUT", 1.0)
+REDIS_PUBSUB_HEALTH_CHECK_INTERVAL = getattr(settings, "REDIS_PUBSUB_HEALTH_CHECK_INTERVAL", 30)
+# 熔断阈值：两次健康检查之间累计这么多次操作失败即断开，避免每个请求都等待超时
+REDIS_FAILURE_THRESHOLD = getattr(settings, "REDIS_FAILURE_THRESHOLD", 20)
+
+_redis_health: Dict[str, Any] = {
+    "state": "disconnected",  # connected / disconnected / open（熔断）
+    "since": time.time(),
+    "failures": 0,
+    "reconnects": 0,
+    "trips": 0,
+    "last_error": None,
+}
+# 事件在首次使用时创建（绑定到运行中的事件循环）
+_redis_connected: Optional[asyncio.Event] = None
+_redis_check_now: Optional[asyncio.Event] = None
+_retired_clients: List[Any] = []
+
+
+def _redis_events() -> Tuple[asyncio.Event, asyncio.Event]:
+    global _redis_connected, _redis_check_now
+    if _redis_connected is None:
+        _redis_connected = asyncio.Event()
+        _redis_check_now = asyncio.Event()
+        if redis_client is not None:
+            _redis_connected.set()
+    return _redis_connected, _redis_check_now
+
+
+def _set_redis_state(state: str, error: Optional[Exception] = None) -> None:
+    if _redis_health["state"] != state:
+        _redis_health["state"] = state
+        _redis_health["since"] = time.time()
+    if error is not None:
+        _redis_health["last_error"] = str(error)
+
+
+def _build_redis_client():
+    # 以字节模式读写，便于存储 msgpack/压缩等二进制编码（见 app.utils.codecs）
+    # 阻塞式连接池：连接用尽时最多等待 REDIS_POOL_TIMEOUT，而不是立即报错
+    pool = redis.BlockingConnectionPool.from_url(
+        settings.REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        decode_responses=False,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def _build_pubsub_client():
+    # 订阅使用独立连接：不设读超时（频道安静不等于断开），断线由定期 PING 探测
+    return redis.Redis.from_url(
+        settings.REDIS_URL,
+        socket_timeout=None,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=REDIS_PUBSUB_HEALTH_CHECK_INTERVAL,
+        decode_responses=False,
+    )
+
+
+async def _close_client(client: Any) -> None:
+    try:
+        close = getattr(client, "aclose", None) or client.close
+        await close()
+        await client.connection_pool.disconnect()
+    except Exception:
+        pass
+
+
+async def _connect_redis() -> bool:
+    """建立新连接池并 PING 验证，成功后替换 redis_client"""
     global redis_client
+    client = _build_redis_client()
     try:
-        redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-        # 测试连接
-        await redis_client.ping()
+        await client.ping()
+    except Exception as e:
+        await _close_client(client)
+        _redis_health["last_error"] = str(e)
+        return False
+    redis_client = client
+    _redis_health["failures"] = 0
+    _set_redis_state("connected")
+    _redis_events()[0].set()
+    # 断开期间可能错过失效广播，丢弃本地缓存
+    _evict_all_local()
+    return True
+
+
+def _trip_redis(error: Exception, state: str = "open") -> None:
+    """熔断：立即停止使用当前连接，由后台任务退避重连"""
+    global redis_client
+    if redis_client is None:
+        return
+    _retired_clients.append(redis_client)
+    redis_client = None
+    connected, check_now = _redis_events()
+    connected.clear()
+    check_now.set()
+    _redis_health["trips"] += 1
+    _set_redis_state(state, error)
+    logger.warning(f"Redis circuit opened ({error}); cache degraded until reconnect")
+
+
+def _record_redis_failure(operation: str, error: Exception) -> None:
+    """记录一次 Redis 操作失败，短时间内失败过多时熔断"""
+    logger.warning(f"Cache {operation} error: {error}")
+    _redis_health["failures"] += 1
+    _redis_health["last_error"] = str(error)
+    if _redis_health["failures"] >= REDIS_FAILURE_THRESHOLD:
+        _trip_redis(error)
+
+
+def redis_health() -> Dict[str, Any]:
+    """Redis 连接状态（/health 使用）"""
+    return {
+        **_redis_health,
+        "available": redis_client is not None,
+        "max_connections": REDIS_MAX_CONNECTIONS,
+    }
+
+
+async def init_redis():
+    """启动时尝试连接；失败不致命，run_redis_supervisor 会在后台重连"""
+    if await _connect_redis():
         logger.info("Redis connected successfully")
+    else:
+        logger.warning(
+            f"Redis connection failed: {_redis_health['last_error']}. Cache disabled until reconnect."
+        )
+
+
+async def run_redis_supervisor() -> None:
+    """后台维护 Redis 连接：定期健康检查，断开/熔断后按指数退避（带抖动）重连"""
+    _, check_now = _redis_events()
+    delay = REDIS_RECONNECT_MIN_DELAY
+    while True:
+        while _retired_clients:
+            await _close_client(_retired_clients.pop())
+
+        if redis_client is None:
+            if await _connect_redis():
+                _redis_health["reconnects"] += 1
+                logger.info("Redis reconnected")
+                delay = REDIS_RECONNECT_MIN_DELAY
+                continue
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            delay = min(delay * 2, REDIS_RECONNECT_MAX_DELAY)
+            continue
+
+        try:
+            await asyncio.wait_for(check_now.wait(), timeout=REDIS_HEALTH_CHECK_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        check_now.clear()
+        client = redis_client
+        if client is None:
+            continue
+        try:
+            await client.ping()
+            _redis_health["failures"] = 0
+        except Exception as e:
+            _trip_redis(e, state="disconnected")
+
+
+async def close_redis() -> None:
+    """关闭连接池（lifespan 退出时调用）"""
+    global redis_client
+    client, redis_client = redis_client, None
+    _redis_events()[0].clear()
+    _set_redis_state("disconnected")
+    for retired in [client, *_retired_clients]:
+        if retired is not None:
+            await _close_client(retired)
+    _retired_clients.clear()
+
+
+class LocalTTLCache:
+    """进程内 TTL + LRU 缓存（每个 worker 独立，放在 Redis 前面挡热点读）。"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0, register: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+        if register:
+            _local_caches.append(self)
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取未过期的值，命中时刷新 LRU 顺序"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """写入值，超出容量时淘汰最久未使用的条目"""
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# 所有进程内缓存的注册表，收到失效广播时统一清理
+_local_caches: List[LocalTTLCache] = []
+
+# 跨 worker 缓存失效广播频道
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# pub/sub 频道 -> 处理函数（由 run_pubsub_listener 统一订阅分发）
+_channel_handlers: Dict[str, Callable[[str], None]] = {}
+# 每次（重新）订阅成功后执行的回调：用于补齐断开期间错过的广播
+_subscribe_hooks: List[Callable[[], Awaitable[None]]] = []
+_hook_tasks: Set["asyncio.Task[None]"] = set()
+_pubsub_state: Dict[str, Any] = {"subscribed": False, "since": None}
+
+
+def _to_str(value: Any) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def subscribe_channel(channel: str, handler: Callable[[str], None]) -> None:
+    """注册 Redis pub/sub 频道处理函数（需在监听任务启动前注册）"""
+    _channel_handlers[channel] = handler
+
+
+def on_pubsub_subscribed(hook: Callable[[], Awaitable[None]]) -> None:
+    """注册订阅（含断线重连后重新订阅）成功后的回调"""
+    _subscribe_hooks.append(hook)
+
+
+def pubsub_subscribed() -> bool:
+    """当前是否处于订阅状态（未订阅时跨 worker 广播可能丢失）"""
+    return bool(_pubsub_state["subscribed"])
+
+
+def _log_hook_error(task: "asyncio.Task[None]") -> None:
+    _hook_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Pub/sub subscribe hook error: {task.exception()}")
+
+
+def _run_subscribe_hooks() -> None:
+    # 回调在后台执行，不阻塞消息读取
+    for hook in _subscribe_hooks:
+        task = asyncio.create_task(hook())
+        _hook_tasks.add(task)
+        task.add_done_callback(_log_hook_error)
+
+
+def _evict_local(keys: List[str]) -> None:
+    for cache in _local_caches:
+        for key in keys:
+            cache.delete(key)
+
+
+def _evict_all_local() -> None:
+    for cache in _local_caches:
+        cache.clear()
+
+
+def _handle_invalidation(data: str) -> None:
+    try:
+        keys = json.loads(data)
+    except (TypeError, ValueError):
+        return
+    if isinstance(keys, list):
+        _evict_local([str(k) for k in keys])
+
+
+subscribe_channel(INVALIDATION_CHANNEL, _handle_invalidation)
+
+
+async def publish(channel: str, data: str) -> None:
+    """向 Redis 频道广播消息（Redis 不可用时静默跳过）"""
+    if not redis_client:
+        return
+    try:
+        await redis_client.publish(channel, data)
     except Exception as e:
-        logger.warning(f"Redis connection failed: {e}. Cache will be disabled.")
-        redis_client = None
+        _record_redis_failure(f"publish on {channel}", e)
+
+
+async def publish_invalidation(*keys: str) -> None:
+    """清理本进程的本地缓存，并通过 Redis pub/sub 通知其他 worker"""
+    if not keys:
+        return
+    _evict_local(list(keys))
+    await publish(INVALIDATION_CHANNEL, json.dumps(list(keys)))
+
+
+async def run_pubsub_listener() -> None:
+    """订阅已注册的频道并分发消息（在 lifespan 中作为后台任务运行）。
+
+    订阅连接独立于命令连接池；连接真正断开时重新订阅，断开期间可能错过失效广播，恢复时清空本地缓存。
+    """
+    if not _channel_handlers:
+        return
+    connected, check_now = _redis_events()
+    while True:
+        await connected.wait()
+        client = _build_pubsub_client()
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(*_channel_handlers.keys())
+            _pubsub_state["subscribed"] = True
+            _pubsub_state["since"] = time.time()
+            _run_subscribe_hooks()
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=REDIS_PUBSUB_POLL_TIMEOUT
+                )
+                if message is None:
+                    # 频道空闲
+                    continue
+                if message.get("type") != "message":
+                    continue
+                channel = _to_str(message.get("channel"))
+                handler = _channel_handlers.get(channel)
+                if handler is None:
+                    continue
+                try:
+                    handler(_to_str(message["data"]))
+                except Exception as e:
+                    logger.warning(f"Pub/sub handler error on {channel}: {e}")
+        except asyncio.CancelledError:
+            raise
+        except (RedisConnectionError, RedisTimeoutError, OSError) as e:
+            logger.warning(f"Pub/sub connection lost: {e}")
+        except Exception as e:
+            logger.warning(f"Pub/sub listener interrupted: {e}")
+        finally:
+            _pubsub_state["subscribed"] = False
+            try:
+                await pubsub.reset()
+            except Exception:
+                pass
+            await _close_client(client)
+        # 订阅中断期间的广播已丢失
+        _evict_all_local()
+        check_now.set()
+        await asyncio.sleep(REDIS_RECONNECT_MIN_DELAY)
+
+
+def _setting_list(name: str, default: List[str]) -> Tuple[str, ...]:
+    value = getattr(settings, name, default)
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(",")]
+    return tuple(item for item in value if item)
+
+
+def _namespace(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+# CacheService 的进程内 L1（仅对配置的命名空间生效，跨 worker 通过 pub/sub 失效）
+CACHE_L1_ENABLED = bool(getattr(settings, "CACHE_L1_ENABLED", True))
+CACHE_L1_NAMESPACES = frozenset(_setting_list("CACHE_L1_NAMESPACES", ["payment"]))
+_l1_cache = LocalTTLCache(
+    maxsize=getattr(settings, "CACHE_L1_SIZE", 20000),
+    ttl=getattr(settings, "CACHE_L1_TTL", 5),
+)
+
+# 命名空间 -> 编解码器（CACHE_CODECS="payment=msgpack,api_key=orjson"），未配置的使用 JSON
+CACHE_COMPRESS_THRESHOLD = getattr(settings, "CACHE_COMPRESS_THRESHOLD", 4096)
+_namespace_codecs: Dict[str, codecs.CacheCodec] = {}
+for _entry in _setting_list("CACHE_CODECS", ["payment=msgpack", "api_key=orjson", "product=orjson"]):
+    _ns, _, _codec_name = _entry.partition("=")
+    _namespace_codecs[_ns.strip()] = codecs.get_codec(_codec_name.strip())
+
+
+def _codec_for(namespace: str) -> codecs.CacheCodec:
+    return _namespace_codecs.get(namespace) or codecs.get_codec("json")
+
+
+# 命名空间 -> 命中/未命中统计
+_cache_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _record(namespace: str, field: str) -> None:
+    stats = _cache_stats.get(namespace)
+    if stats is None:
+        stats = _cache_stats[namespace] = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "sets": 0, "deletes": 0}
+    stats[field] += 1
+
+
+def _uses_l1(namespace: str) -> bool:
+    return CACHE_L1_ENABLED and namespace in CACHE_L1_NAMESPACES
+
+
+class CachePipeline:
+    """批量写命令：在一次 Redis 往返中执行（Redis 不可用时为空操作）。
+
+    用法：
+        async with CacheService.pipeline() as pipe:
+            pipe.set("product:1", data, ttl=300)
+            pipe.delete("product:2")
+    退出上下文时执行；执行结果保存在 ``results`` 中。
+    """
+
+    def __init__(self):
+        self._pipe = redis_client.pipeline(transaction=False) if redis_client else None
+        self._stats: List[Tuple[str, str]] = []
+        self._invalidate: List[str] = []
+        self._l1_values: Dict[str, Tuple[bytes, int]] = {}
+        self.results: List[Any] = []
+
+    def set(self, key: str, value: Any, ttl: int = 3600) -> "CachePipeline":
+        if self._pipe is None:
+            return self
+        namespace = _namespace(key)
+        encoded = codecs.encode(value, _codec_for(namespace), CACHE_COMPRESS_THRESHOLD)
+        self._pipe.setex(key, ttl, encoded)
+        self._stats.append((namespace, "sets"))
+        if _uses_l1(namespace):
+            self._invalidate.append(key)
+            self._l1_values[key] = (encoded, ttl)
+        return self
+
+    def delete(self, *keys: str) -> "CachePipeline":
+        if self._pipe is None or not keys:
+            return self
+        self._pipe.delete(*keys)
+        for key in keys:
+            namespace = _namespace(key)
+            self._stats.append((namespace, "deletes"))
+            if _uses_l1(namespace):
+                self._invalidate.append(key)
+                self._l1_values.pop(key, None)
+        return self
+
+    def increment(self, key: str, amount: int = 1) -> "CachePipeline":
+        if self._pipe is not None:
+            self._pipe.incrby(key, amount)
+        return self
+
+    def expire(self, key: str, ttl: int) -> "CachePipeline":
+        if self._pipe is not None:
+            self._pipe.expire(key, ttl)
+        return self
+
+    async def execute(self) -> List[Any]:
+        """执行已排队的命令（出错时返回空列表）"""
+        pipe, self._pipe = self._pipe, None
+        if pipe is None or not len(pipe):
+            return self.results
+        try:
+            self.results = await pipe.execute()
+        except Exception as e:
+            _record_redis_failure("pipeline", e)
+            self.results = []
+            return self.results
+        for namespace, field in self._stats:
+            _record(namespace, field)
+        if self._invalidate:
+            await publish_invalidation(*self._invalidate)
+        for key, (encoded, ttl) in self._l1_values.items():
+            _l1_cache.set(key, codecs.decode(encoded), ttl=min(ttl, _l1_cache.ttl))
+        return self.results
+
+    async def __aenter__(self) -> "CachePipeline":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.execute()
+        else:
+            self._pipe = None
 
 
 class CacheService:
+    @staticmethod
+    def available() -> bool:
+        """Redis 当前是否可用"""
+        return redis_client is not None
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        """按命名空间统计的 L1/L2 命中情况"""
+        return {
+            "l1_enabled": CACHE_L1_ENABLED,
+            "l1_namespaces": sorted(CACHE_L1_NAMESPACES),
+            "l1_size": len(_l1_cache),
+            "codecs": {ns: codec.name for ns, codec in _namespace_codecs.items()},
+            "namespaces": {ns: dict(values) for ns, values in _cache_stats.items()},
+            "cached_functions": {fn.__qualname__: dict(fn.stats) for fn in _cached_functions},
+        }
+
     @staticmethod
     async def get(key: str) -> Optional[Any]:
-        """获取缓存"""
+        """获取缓存（L1 命中的值为共享对象，调用方不应原地修改）"""
         if not redis_client:
             return None
+        namespace = _namespace(key)
+        use_l1 = _uses_l1(namespace)
+        if use_l1:
+            value = _l1_cache.get(key)
+            if value is not None:
+                _record(namespace, "l1_hits")
+                return value
         try:
             value = await redis_client.get(key)
-            if value:
-                return json.loads(value)
+        except Exception as e:
+            _record_redis_failure("get", e)
             return None
+        if not value:
+            _record(namespace, "misses")
+            return None
+        try:
+            decoded = codecs.decode(value)
         except Exception as e:
-            logger.warning(f"Cache get error: {e}")
+            # 数据损坏不是 Redis 故障：按未命中处理并删除坏值，不计入熔断
+            logger.warning(f"Cache decode error for {key}: {e}")
+            _record(namespace, "misses")
+            try:
+                await redis_client.delete(key)
+            except Exception:
+                pass
             return None
+        _record(namespace, "l2_hits")
+        if use_l1:
+            _l1_cache.set(key, decoded)
+        return decoded
     
     @staticmethod
     async def set(key: str, value: Any, ttl: int = 3600) -> bool:
         """设置缓存"""
         if not redis_client:
             return False
+        namespace = _namespace(key)
         try:
-            await redis_client.setex(key, ttl, json.dumps(value, default=str))
-            return True
+            encoded = codecs.encode(value, _codec_for(namespace), CACHE_COMPRESS_THRESHOLD)
+        except Exception as e:
+            logger.warning(f"Cache encode error for {key}: {e}")
+            return False
+        try:
+            await redis_client.setex(key, ttl, encoded)
+            _record(namespace, "sets")
         except Exception as e:
-            logger.warning(f"Cache set error: {e}")
+            _record_redis_failure("set", e)
             return False
+        if _uses_l1(namespace):
+            # 其他 worker 丢弃旧副本，本进程写入新值
+            await publish_invalidation(key)
+            # 存入解码后的副本，与从 Redis 读取的结果一致，且不受调用方后续修改影响
+            _l1_cache.set(key, codecs.decode(encoded), ttl=min(ttl, _l1_cache.ttl))
+        return True
     
     @staticmethod
     async def delete(key: str) -> bool:
         """删除缓存"""
         if not redis_client:
             return False
+        namespace = _namespace(key)
         try:
             await redis_client.delete(key)
-            return True
+            _record(namespace, "deletes")
         except Exception as e:
-            logger.warning(f"Cache delete error: {e}")
+            _record_redis_failure("delete", e)
             return False
+        if _uses_l1(namespace):
+            await publish_invalidation(key)
+        return True
     
+    @staticmethod
+    async def get_many(keys: List[str]) -> Dict[str, Any]:
+        """批量获取缓存（L1 之外的键一次 MGET），只返回命中的键"""
+        if not redis_client or not keys:
+            return {}
+        found: Dict[str, Any] = {}
+        remote: List[str] = []
+        for key in dict.fromkeys(keys):
+            namespace = _namespace(key)
+            if _uses_l1(namespace):
+                value = _l1_cache.get(key)
+                if value is not None:
+                    _record(namespace, "l1_hits")
+                    found[key] = value
+                    continue
+            remote.append(key)
+        if not remote:
+            return found
+        try:
+            values = await redis_client.mget(remote)
+        except Exception as e:
+            _record_redis_failure("get_many", e)
+            return found
+        for key, value in zip(remote, values):
+            namespace = _namespace(key)
+            if not value:
+                _record(namespace, "misses")
+                continue
+            try:
+                decoded = codecs.decode(value)
+            except Exception as e:
+                logger.warning(f"Cache decode error for {key}: {e}")
+                continue
+            _record(namespace, "l2_hits")
+            if _uses_l1(namespace):
+                _l1_cache.set(key, decoded)
+            found[key] = decoded
+        return found
+
+    @staticmethod
+    async def set_many(mapping: Dict[str, Any], ttl: int = 3600) -> bool:
+        """批量设置缓存（一次管道往返）"""
+        if not redis_client or not mapping:
+            return False
+        pipe = CachePipeline()
+        try:
+            for key, value in mapping.items():
+                pipe.set(key, value, ttl=ttl)
+        except Exception as e:
+            logger.warning(f"Cache set_many error: {e}")
+            return False
+        return bool(await pipe.execute())
+
+    @staticmethod
+    async def delete_many(keys: List[str]) -> int:
+        """批量删除缓存（一次 DEL），返回删除的键数"""
+        if not redis_client or not keys:
+            return 0
+        keys = list(dict.fromkeys(keys))
+        try:
+            deleted = await redis_client.delete(*keys)
+        except Exception as e:
+            _record_redis_failure("delete_many", e)
+            return 0
+        l1_keys = []
+        for key in keys:
+            namespace = _namespace(key)
+            _record(namespace, "deletes")
+            if _uses_l1(namespace):
+                l1_keys.append(key)
+        if l1_keys:
+            await publish_invalidation(*l1_keys)
+        return deleted
+
+    @staticmethod
+    def pipeline() -> CachePipeline:
+        """批量写入管道：``async with CacheService.pipeline() as pipe: ...``"""
+        return CachePipeline()
+
     @staticmethod
     async def exists(key: str) -> bool:
         """检查键是否存在"""
@@ -71,9 +697,21 @@ class CacheService:
         try:
             return bool(await redis_client.exists(key))
         except Exception as e:
-            logger.warning(f"Cache exists error: {e}")
+            _record_redis_failure("exists", e)
             return False
     
+    @staticmethod
+    async def get_counter(key: str) -> Optional[int]:
+        """读取计数器（不存在为 0；Redis 不可用或出错时返回 None）"""
+        if not redis_client:
+            return None
+        try:
+            value = await redis_client.get(key)
+            return int(value) if value else 0
+        except Exception as e:
+            _record_redis_failure("get_counter", e)
+            return None
+
     @staticmethod
     async def increment(key: str, amount: int = 1) -> int:
         """递增计数器"""
@@ -82,9 +720,64 @@ class CacheService:
         try:
             return await redis_client.incrby(key, amount)
         except Exception as e:
-            logger.warning(f"Cache increment error: {e}")
+            _record_redis_failure("increment", e)
             return 0
     
+    @staticmethod
+    async def get_version(key: str) -> Optional[str]:
+        """读取版本号，返回 "纪元.版本"；Redis 不可用或出错时返回 None。
+
+        版本号与纪元存放在同一个哈希中（v / e），纪元首次读取或递增时随机生成：
+        键被清空或丢失后重新计数，纪元随之变化，旧版本号不会被误认为仍然有效。
+        """
+        if not redis_client:
+            return None
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.hsetnx(key, "e", uuid.uuid4().hex[:12])
+                pipe.hmget(key, "v", "e")
+                _, (version, epoch) = await pipe.execute()
+        except Exception as e:
+            _record_redis_failure("get_version", e)
+            return None
+        return f"{_to_str(epoch)}.{int(version or 0)}"
+
+    @staticmethod
+    async def bump_version(key: str) -> None:
+        """递增 get_version 使用的版本号"""
+        if not redis_client:
+            return
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.hincrby(key, "v", 1)
+                pipe.hsetnx(key, "e", uuid.uuid4().hex[:12])
+                await pipe.execute()
+        except Exception as e:
+            _record_redis_failure("bump_version", e)
+
+    @staticmethod
+    async def acquire_lock(key: str, timeout: float) -> Optional[str]:
+        """获取跨 worker 互斥锁；被占用返回 None，Redis 不可用时视为获得（返回空串）"""
+        if not redis_client:
+            return ""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await redis_client.set(key, token, nx=True, px=int(timeout * 1000))
+        except Exception as e:
+            _record_redis_failure("lock", e)
+            return ""
+        return token if acquired else None
+
+    @staticmethod
+    async def release_lock(key: str, token: str) -> None:
+        """释放 acquire_lock 获得的锁（仅当仍由自己持有）"""
+        if not redis_client or not token:
+            return
+        try:
+            await redis_client.eval(_RELEASE_LOCK_LUA, 1, key, token)
+        except Exception as e:
+            _record_redis_failure("unlock", e)
+
     @staticmethod
     async def expire(key: str, ttl: int) -> bool:
         """设置过期时间"""
@@ -94,49 +787,451 @@ class CacheService:
             await redis_client.expire(key, ttl)
             return True
         except Exception as e:
-            logger.warning(f"Cache expire error: {e}")
+            _record_redis_failure("expire", e)
             return False
 
 
-class RateLimiter:
-    _memory_cache: Dict[str, Dict[int, int]] = defaultdict(dict)
+# 分布式锁释放：仅当锁仍由自己持有时删除
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 所有 cached() 包装函数，用于 CacheService.stats()
+_cached_functions: List["CachedFunction"] = []
+
+
+class CachedFunction:
+    """cached() 的实现：防击穿的读穿缓存。
+
+    - 进程内单飞：同一键的并发未命中共享一次加载；
+    - 跨 worker 单飞：SET NX 锁，未抢到锁的请求短暂等待持锁方写回结果；
+    - XFetch 概率提前刷新：越接近过期、加载越慢，越可能被某个请求提前刷新；
+    - stale-while-revalidate：逻辑过期后 stale_ttl 内继续返回旧值，后台刷新；
+    - 失效代数：invalidate 递增 gen:{键}，加载开始后代数变化的结果不会留在缓存中。
+
+    Redis 中存储 {"v": 值, "d": 加载耗时(秒), "t": 逻辑过期时间戳}，物理 TTL 为 ttl + stale_ttl。
+    """
+
+    def __init__(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        key: Callable[..., str],
+        ttl: int,
+        stale_ttl: int,
+        beta: float,
+        lock_timeout: float,
+        should_cache: Callable[[Any], bool],
+        is_valid: Optional[Callable[[Any], bool]],
+    ):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.key = key
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.beta = beta
+        self.lock_timeout = lock_timeout
+        self.should_cache = should_cache
+        self.is_valid = is_valid
+        # 前台加载（未命中时由调用方等待）与后台刷新分开登记：
+        # 后台刷新在其他 worker 持锁时直接放弃，结果不能交给前台调用方
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+        self._refreshing: Dict[str, "asyncio.Task[Any]"] = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "early_refreshes": 0, "loads": 0, "peer_waits": 0, "discarded": 0}
+        _cached_functions.append(self)
+
+    async def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        cache_key = self.key(*args, **kwargs)
+        entry = self._usable(await CacheService.get(cache_key))
+        if entry is not None:
+            now = time.time()
+            if now >= entry["t"]:
+                self.stats["stale_hits"] += 1
+                self._refresh_in_background(cache_key, args, kwargs)
+            elif self._should_refresh_early(now, entry):
+                self.stats["early_refreshes"] += 1
+                self._refresh_in_background(cache_key, args, kwargs)
+            else:
+                self.stats["hits"] += 1
+            return entry["v"]
+
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = self._start(self._inflight, cache_key, args, kwargs, wait_for_peer=True)
+        # shield：单个调用方被取消不影响其他等待同一加载的请求
+        return await asyncio.shield(task)
+
+    def __get__(self, instance: Any, owner: Optional[type] = None) -> Any:
+        # 支持装饰实例方法：key 与被装饰函数都会收到 self
+        if instance is None:
+            return self
+        return functools.partial(self, instance)
 
-    def __init__(self, max_requests: int = 1000, window: int = 60):
+    async def prime(self, *args: Any, value: Any, **kwargs: Any) -> None:
+        """直接写入已知的新值（例如刚创建/更新的记录）"""
+        await self._store(self.key(*args, **kwargs), value, 0.0)
+
+    async def invalidate(self, *args: Any, **kwargs: Any) -> None:
+        await self.invalidate_keys(self.key(*args, **kwargs))
+
+    async def invalidate_keys(self, *cache_keys: str) -> None:
+        """按缓存键失效：递增失效代数并删除条目（进行中的加载不会再写回旧值）"""
+        if not cache_keys:
+            return
+        async with CacheService.pipeline() as pipe:
+            for cache_key in cache_keys:
+                generation_key = self._generation_key(cache_key)
+                pipe.increment(generation_key)
+                pipe.expire(generation_key, self.ttl + self.stale_ttl + int(self.lock_timeout) + 60)
+            pipe.delete(*cache_keys)
+
+    @staticmethod
+    def _generation_key(cache_key: str) -> str:
+        return f"gen:{cache_key}"
+
+    def _usable(self, entry: Any) -> Optional[dict]:
+        if not isinstance(entry, dict) or "v" not in entry or "t" not in entry:
+            return None
+        if self.is_valid is not None and not self.is_valid(entry["v"]):
+            return None
+        return entry
+
+    def _should_refresh_early(self, now: float, entry: dict) -> bool:
+        # XFetch：now - delta * beta * ln(rand) >= expiry
+        delta = entry.get("d") or 0.0
+        return now - delta * self.beta * math.log(1.0 - random.random()) >= entry["t"]
+
+    def _start(
+        self, registry: Dict[str, "asyncio.Task[Any]"], cache_key: str, args: tuple, kwargs: dict, wait_for_peer: bool
+    ) -> "asyncio.Task[Any]":
+        task = asyncio.create_task(self._load(cache_key, args, kwargs, wait_for_peer))
+        registry[cache_key] = task
+        task.add_done_callback(lambda _: registry.pop(cache_key, None))
+        return task
+
+    def _refresh_in_background(self, cache_key: str, args: tuple, kwargs: dict) -> None:
+        if cache_key in self._inflight or cache_key in self._refreshing:
+            return
+        task = self._start(self._refreshing, cache_key, args, kwargs, wait_for_peer=False)
+        task.add_done_callback(self._log_refresh_error)
+
+    @staticmethod
+    def _log_refresh_error(task: "asyncio.Task[Any]") -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Cache background refresh error: {task.exception()}")
+
+    async def _load(self, cache_key: str, args: tuple, kwargs: dict, wait_for_peer: bool) -> Any:
+        lock_key = f"lock:{cache_key}"
+        token = await self._acquire_lock(lock_key)
+        if token is None:
+            if not wait_for_peer:
+                # 后台刷新：其他 worker 已在刷新，继续使用旧值即可
+                return None
+            self.stats["peer_waits"] += 1
+            entry = await self._wait_for_peer(cache_key, lock_key)
+            if entry is not None:
+                return entry["v"]
+        try:
+            self.stats["loads"] += 1
+            # 先读代数再加载：加载期间发生的失效会使本次结果作废
+            generation = await CacheService.get_counter(self._generation_key(cache_key))
+            started = time.monotonic()
+            value = await self.func(*args, **kwargs)
+            if generation is not None and self.should_cache(value):
+                await self._store(cache_key, value, time.monotonic() - started, generation)
+            return value
+        finally:
+            if token:
+                await self._release_lock(lock_key, token)
+
+    async def _store(self, cache_key: str, value: Any, delta: float, generation: Optional[int] = None) -> None:
+        entry = {"v": value, "d": round(delta, 4), "t": time.time() + self.ttl}
+        if not await CacheService.set(cache_key, entry, ttl=self.ttl + self.stale_ttl):
+            return
+        if generation is None:
+            return
+        # 写入后复核代数：invalidate 先递增代数再删除，
+        # 代数已变化时由这里删除旧值，否则 invalidate 的删除发生在本次写入之后
+        if await CacheService.get_counter(self._generation_key(cache_key)) != generation:
+            self.stats["discarded"] += 1
+            await CacheService.delete(cache_key)
+
+    async def _acquire_lock(self, lock_key: str) -> Optional[str]:
+        return await CacheService.acquire_lock(lock_key, self.lock_timeout)
+
+    async def _release_lock(self, lock_key: str, token: str) -> None:
+        await CacheService.release_lock(lock_key, token)
+
+    async def _wait_for_peer(self, cache_key: str, lock_key: str) -> Optional[dict]:
+        """等待持锁的 worker 写回结果；锁已释放仍无可用结果（例如结果为 None 不缓存）或超时返回 None，由调用方自行加载"""
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.02
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            entry = self._usable(await CacheService.get(cache_key))
+            if entry is not None:
+                return entry
+            if not await CacheService.exists(lock_key):
+                return None
+            delay = min(delay * 2, 0.2)
+        return None
+
+
+def cached(
+    key: Callable[..., str],
+    ttl: int = 3600,
+    stale_ttl: int = 60,
+    beta: float = 1.0,
+    lock_timeout: float = 5.0,
+    should_cache: Callable[[Any], bool] = lambda value: value is not None,
+    is_valid: Optional[Callable[[Any], bool]] = None,
+) -> Callable[[Callable[..., Awaitable[Any]]], CachedFunction]:
+    """防缓存击穿的异步读穿缓存装饰器。
+
+    Args:
+        key: 由被装饰函数的参数生成缓存键
+        ttl: 逻辑有效期（秒）
+        stale_ttl: 逻辑过期后仍可返回旧值的窗口（秒），期间后台刷新
+        beta: XFetch 提前刷新系数，越大越积极，0 表示关闭
+        lock_timeout: 跨 worker 重建锁的超时，也是等待其他 worker 结果的上限
+        should_cache: 判断加载结果是否写入缓存（默认不缓存 None）
+        is_valid: 校验缓存值，返回 False 时视为未命中
+    """
+    def decorator(func: Callable[..., Awaitable[Any]]) -> CachedFunction:
+        return CachedFunction(func, key, ttl, stale_ttl, beta, lock_timeout, should_cache, is_valid)
+    return decorator
+
+
+# GCRA（通用信元速率算法）限流脚本：一次往返完成判定与状态更新
+# KEYS[1]=限流键  ARGV: now_ms, period_ms, limit, cost
+# 返回 {allowed, remaining, reset_ms, retry_after_ms}
+GCRA_LUA = """
+local now = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local interval = period / limit
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local new_tat = tat + interval * cost
+local allow_at = new_tat - period
+if allow_at > now then
+    local remaining = math.floor((period - (tat - now)) / interval)
+    if remaining < 0 then remaining = 0 end
+    return {0, remaining, math.ceil(tat - now), math.ceil(allow_at - now)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now))
+return {1, math.floor((period - (new_tat - now)) / interval), math.ceil(new_tat - now), 0}
+"""
+
+
+class RateLimitResult:
+    """一次限流判定的结果，可直接生成 X-RateLimit-* 响应头。"""
+
+    __slots__ = ("allowed", "limit", "remaining", "reset_after", "retry_after")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset_after: float, retry_after: float = 0.0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = max(0, remaining)
+        self.reset_after = max(0.0, reset_after)
+        self.retry_after = max(0.0, retry_after)
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+    def __bool__(self) -> bool:
+        return self.allowed
+
+
+class _TokenLease:
+    """本地预取的令牌（高频密钥大部分请求无需访问 Redis）"""
+
+    __slots__ = ("tokens", "expires_at", "limit", "remaining", "reset_at")
+
+    def __init__(self, tokens: int, expires_at: float, limit: int, remaining: int, reset_at: float):
+        self.tokens = tokens
+        self.expires_at = expires_at
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+
+
+class MemoryRateLimiter:
+    """Redis 不可用时的降级限流：固定容量、数组存储的 GCRA，O(1) 更新。
+
+    每个标识符占用一个槽位（保存理论到达时间 TAT），槽位满时按 LRU
+    淘汰最久未访问的标识符，内存占用与运行时长无关。
+    """
+
+    # OrderedDict 条目 + 标识符字符串的粗略开销估计（字节）
+    _ENTRY_OVERHEAD = 200
+
+    def __init__(self, capacity: int = 50000, window: int = 60):
+        self.capacity = max(1, capacity)
+        self.window = window
+        self._tats = array("d", bytes(8 * self.capacity))
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self.evictions = 0
+        self.active_evictions = 0
+
+    def _slot_for(self, identifier: str, now: float) -> int:
+        slot = self._slots.get(identifier)
+        if slot is not None:
+            self._slots.move_to_end(identifier)
+            return slot
+        if self._free:
+            slot = self._free.pop()
+        else:
+            _, slot = self._slots.popitem(last=False)
+            self.evictions += 1
+            if self._tats[slot] > now:
+                # 被淘汰的标识符仍有未恢复的配额消耗
+                self.active_evictions += 1
+        self._tats[slot] = now
+        self._slots[identifier] = slot
+        return slot
+
+    def check(self, identifier: str, limit: int) -> "RateLimitResult":
+        now = time.monotonic()
+        slot = self._slot_for(identifier, now)
+        interval = self.window / limit
+        tat = max(self._tats[slot], now)
+        new_tat = tat + interval
+        allow_at = new_tat - self.window
+        if allow_at > now:
+            return RateLimitResult(
+                allowed=False,
+                limit=limit,
+                remaining=int((self.window - (tat - now)) / interval),
+                reset_after=tat - now,
+                retry_after=allow_at - now,
+            )
+        self._tats[slot] = new_tat
+        return RateLimitResult(
+            allowed=True,
+            limit=limit,
+            remaining=int((self.window - (new_tat - now)) / interval),
+            reset_after=new_tat - now,
+        )
+
+    def stats(self) -> Dict[str, int]:
+        size = len(self._slots)
+        return {
+            "capacity": self.capacity,
+            "size": size,
+            "evictions": self.evictions,
+            "active_evictions": self.active_evictions,
+            "approx_memory_bytes": self._tats.itemsize * self.capacity + size * self._ENTRY_OVERHEAD,
+        }
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        max_requests: int = 1000,
+        window: int = 60,
+        lease_size: int = 0,
+        lease_ttl: float = 1.0,
+        memory_capacity: int = 50000,
+    ):
         self.max_requests = max_requests
         self.window = window
-    
+        self._memory = MemoryRateLimiter(capacity=memory_capacity, window=window)
+        # lease_size > 1 时启用本地令牌租约；仅对 limit >= lease_size * 10 的密钥生效
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self._leases = LocalTTLCache(maxsize=10000, ttl=lease_ttl, register=False)
+        self._script = None
+        self._script_client = None
+
+    def _get_script(self):
+        if self._script is None or self._script_client is not redis_client:
+            self._script = redis_client.register_script(GCRA_LUA)
+            self._script_client = redis_client
+        return self._script
+
     async def is_allowed(self, identifier: str, max_requests: Optional[int] = None) -> bool:
         """检查是否允许请求"""
+        return (await self.check(identifier, max_requests)).allowed
+
+    async def check(self, identifier: str, max_requests: Optional[int] = None) -> RateLimitResult:
+        """判定是否允许请求，并返回剩余配额与重置时间"""
         limit = max_requests or self.max_requests
         if not redis_client:
-            return self._is_allowed_memory(identifier, limit)
-        
-        current_time = int(time.time())
-        key = f"rate_limit:{identifier}:{current_time // self.window}:{limit}"
-        
-        try:
-            requests = await redis_client.incr(key)
-            if requests == 1:
-                await redis_client.expire(key, self.window)
-            
-            return requests <= limit
-        except Exception as e:
-            logger.warning(f"Rate limiter error: {e}, falling back to memory cache")
-            return self._is_allowed_memory(identifier, limit)
-    
-    def _is_allowed_memory(self, identifier: str, limit: int) -> bool:
+            return self._check_memory(identifier, limit)
+
+        leased = self._take_lease(identifier, limit)
+        if leased is not None:
+            return leased
+
+        try:
+            if self.lease_size > 1 and limit >= self.lease_size * 10:
+                result = await self._reserve(identifier, limit, self.lease_size)
+                if result.allowed:
+                    now = time.monotonic()
+                    self._leases.set(identifier, _TokenLease(
+                        tokens=self.lease_size - 1,
+                        expires_at=now + self.lease_ttl,
+                        limit=limit,
+                        remaining=result.remaining,
+                        reset_at=now + result.reset_after,
+                    ))
+                    result.remaining += self.lease_size - 1
+                    return result
+            return await self._reserve(identifier, limit, 1)
+        except Exception as e:
+            _record_redis_failure("rate limiter (falling back to memory)", e)
+            return self._check_memory(identifier, limit)
+
+    async def _reserve(self, identifier: str, limit: int, cost: int) -> RateLimitResult:
+        allowed, remaining, reset_ms, retry_ms = await self._get_script()(
+            keys=[f"rate_limit:{identifier}"],
+            args=[int(time.time() * 1000), self.window * 1000, limit, cost],
+        )
+        return RateLimitResult(
+            allowed=bool(allowed),
+            limit=limit,
+            remaining=int(remaining),
+            reset_after=int(reset_ms) / 1000,
+            retry_after=int(retry_ms) / 1000,
+        )
+
+    def _take_lease(self, identifier: str, limit: int) -> Optional[RateLimitResult]:
+        lease = self._leases.get(identifier)
+        if lease is None:
+            return None
+        now = time.monotonic()
+        if lease.tokens <= 0 or lease.expires_at < now or lease.limit != limit:
+            self._leases.delete(identifier)
+            return None
+        lease.tokens -= 1
+        return RateLimitResult(
+            allowed=True,
+            limit=limit,
+            remaining=lease.remaining + lease.tokens,
+            reset_after=lease.reset_at - now,
+        )
+
+    def _check_memory(self, identifier: str, limit: int) -> RateLimitResult:
         """内存限流实现"""
-        current_time = int(time.time())
-        window_key = current_time // self.window
-        memory_key = f"{identifier}:{limit}"
-        bucket = self._memory_cache[memory_key]
-        
-        old_windows = [w for w in bucket.keys() if w < window_key]
-        for old_window in old_windows:
-            bucket.pop(old_window, None)
-        
-        bucket[window_key] = bucket.get(window_key, 0) + 1
-        return bucket[window_key] <= limit
+        return self._memory.check(identifier, limit)
+
+    def memory_stats(self) -> Dict[str, int]:
+        """降级内存限流器的容量/淘汰统计"""
+        return self._memory.stats()
 
 
 # 创建一个默认的限流器实例，避免Redis连接失败时的错误
@@ -0,0 +1,194 @@
+"""
+CacheService 序列化编解码器
+
+存储格式：3 字节头部（0x00 + 编码器ID + 压缩标记）+ 负载。
+不带头部的值视为旧版 JSON 文本，保持向后兼容。
+orjson / msgpack 为可选依赖，未安装时对应编码器回退到标准库 JSON。
+"""
+
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+_MAGIC = b"\x00"
+_COMPRESSED = b"z"
+_PLAIN = b"-"
+
+# 带类型标记的 JSON：{"$d": "1.23"} / {"$dt": "..."} / {"$date": "..."}
+_TYPE_TAGS = {
+    "$d": Decimal,
+    "$dt": datetime.fromisoformat,
+    "$date": date.fromisoformat,
+}
+
+
+def _typed_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return {"$d": str(value)}
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+
+def _typed_object_hook(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1:
+        tag, raw = next(iter(obj.items()))
+        parser = _TYPE_TAGS.get(tag)
+        if parser is not None and isinstance(raw, str):
+            try:
+                return parser(raw)
+            except (ValueError, ArithmeticError):
+                # 业务数据中恰好形如类型标记的字典（如 {"$d": "abc"}）原样保留
+                return obj
+    return obj
+
+
+def _restore_typed(value: Any) -> Any:
+    """orjson 没有 object_hook，解码后递归还原类型标记"""
+    if isinstance(value, dict):
+        restored = {k: _restore_typed(v) for k, v in value.items()}
+        return _typed_object_hook(restored)
+    if isinstance(value, list):
+        return [_restore_typed(v) for v in value]
+    return value
+
+
+class CacheCodec:
+    """编解码器基类：子类实现 dumps/loads（不含头部与压缩）。"""
+
+    codec_id = b"?"
+    name = "base"
+
+    def dumps(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JSONCodec(CacheCodec):
+    """标准库 JSON；Decimal/datetime 等按 str() 存储（旧行为）。"""
+
+    codec_id = b"j"
+    name = "json"
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, default=str, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class TypedJSONCodec(CacheCodec):
+    """带类型标记的 JSON，Decimal/datetime 往返后保持原类型；有 orjson 时使用 orjson。"""
+
+    codec_id = b"t"
+    name = "orjson" if orjson is not None else "typed-json"
+
+    def dumps(self, value: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(
+                value,
+                default=_typed_default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        return json.dumps(value, default=_typed_default, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        if orjson is not None:
+            value = orjson.loads(data)
+            return _restore_typed(value) if b'"$d' in data else value
+        return json.loads(data, object_hook=_typed_object_hook)
+
+
+_EXT_DECIMAL = 1
+_EXT_DATETIME = 2
+_EXT_DATE = 3
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(_EXT_DECIMAL, str(value).encode("ascii"))
+    if isinstance(value, datetime):
+        return msgpack.ExtType(_EXT_DATETIME, value.isoformat().encode("ascii"))
+    if isinstance(value, date):
+        return msgpack.ExtType(_EXT_DATE, value.isoformat().encode("ascii"))
+    return str(value)
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    if code == _EXT_DECIMAL:
+        return Decimal(data.decode("ascii"))
+    if code == _EXT_DATETIME:
+        return datetime.fromisoformat(data.decode("ascii"))
+    if code == _EXT_DATE:
+        return date.fromisoformat(data.decode("ascii"))
+    return msgpack.ExtType(code, data)
+
+
+class MsgpackCodec(CacheCodec):
+    """msgpack，Decimal/datetime 使用扩展类型。"""
+
+    codec_id = b"m"
+    name = "msgpack"
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+
+
+_json_codec = JSONCodec()
+_typed_codec = TypedJSONCodec()
+CODECS: Dict[str, CacheCodec] = {
+    "json": _json_codec,
+    "typed": _typed_codec,
+    "orjson": _typed_codec,
+}
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+_CODECS_BY_ID: Dict[bytes, CacheCodec] = {codec.codec_id: codec for codec in CODECS.values()}
+
+
+def get_codec(name: Optional[str]) -> CacheCodec:
+    """按名称获取编解码器；未知或依赖缺失时回退到带类型 JSON"""
+    if not name:
+        return _json_codec
+    return CODECS.get(name.lower(), _typed_codec)
+
+
+def encode(value: Any, codec: CacheCodec, compress_threshold: int = 0) -> bytes:
+    payload = codec.dumps(value)
+    if compress_threshold and len(payload) >= compress_threshold:
+        return _MAGIC + codec.codec_id + _COMPRESSED + zlib.compress(payload, 1)
+    return _MAGIC + codec.codec_id + _PLAIN + payload
+
+
+def decode(data: Any) -> Any:
+    """解码任意编解码器写入的值（含无头部的旧版 JSON 文本）"""
+    if isinstance(data, str):
+        return json.loads(data)
+    if not data.startswith(_MAGIC):
+        return json.loads(data)
+    codec = _CODECS_BY_ID.get(data[1:2])
+    if codec is None:
+        raise ValueError(f"Unknown cache codec id {data[1:2]!r}")
+    payload = data[3:]
+    if data[2:3] == _COMPRESSED:
+        payload = zlib.decompress(payload)
+    return codec.loads(payload)
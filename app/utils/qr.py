@@ -0,0 +1,69 @@
+"""
+本地二维码渲染
+
+使用 segno（纯 Python，SVG/PNG 均无需 Pillow）在进程内生成二维码，
+按内容哈希缓存渲染结果；同一内容的图片字节与 ETag 始终一致，可长期缓存。
+segno 为可选依赖，未安装时 available() 返回 False，由调用方回退。
+"""
+
+import base64
+import hashlib
+import io
+from typing import Optional
+
+from app.core.config import settings
+from app.utils.cache import LocalTTLCache
+
+try:
+    import segno
+except ImportError:  # pragma: no cover - optional dependency
+    segno = None
+
+QR_CACHE_SIZE = getattr(settings, "QR_CACHE_SIZE", 2000)
+QR_SCALE = getattr(settings, "QR_SCALE", 5)
+QR_BORDER = 2
+
+_MEDIA_TYPES = {"svg": "image/svg+xml", "png": "image/png"}
+_rendered = LocalTTLCache(maxsize=QR_CACHE_SIZE, ttl=24 * 3600, register=False)
+
+
+class QRImage:
+    """渲染结果：图片字节、MIME 类型与基于内容哈希的 ETag"""
+
+    __slots__ = ("content", "media_type", "etag")
+
+    def __init__(self, content: bytes, media_type: str, etag: str):
+        self.content = content
+        self.media_type = media_type
+        self.etag = etag
+
+    def data_uri(self) -> str:
+        return f"data:{self.media_type};base64,{base64.b64encode(self.content).decode('ascii')}"
+
+
+def available() -> bool:
+    return segno is not None
+
+
+def render(data: str, kind: str = "svg", scale: Optional[int] = None) -> QRImage:
+    """渲染二维码（kind: svg / png），相同内容直接命中缓存"""
+    if segno is None:
+        raise RuntimeError("segno is not installed")
+    if kind not in _MEDIA_TYPES:
+        raise ValueError(f"Unsupported QR image kind: {kind}")
+    scale = scale or QR_SCALE
+    digest = hashlib.sha256(f"{kind}:{scale}:{data}".encode("utf-8")).hexdigest()
+    image = _rendered.get(digest)
+    if image is not None:
+        return image
+
+    buffer = io.BytesIO()
+    options = {"xmldecl": False} if kind == "svg" else {}
+    segno.make(data, error="m").save(buffer, kind=kind, scale=scale, border=QR_BORDER, **options)
+    image = QRImage(content=buffer.getvalue(), media_type=_MEDIA_TYPES[kind], etag=f'"{digest[:32]}"')
+    _rendered.set(digest, image)
+    return image
+
+
+def cache_stats() -> dict:
+    return {"size": len(_rendered), "maxsize": _rendered.maxsize, "evictions": _rendered.evictions}
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+CacheService 编解码器基准：真实结构的支付记录与 API Key 记录
+
+对每个可用编解码器（含压缩）统计编码/解码耗时与存储大小。
+负载结构与 CryptoPaymentService._create_cryptomus_payment / SessionService 缓存记录一致。
+
+用法: python benchmark_cache_codecs.py [迭代次数]
+"""
+
+import sys
+import time
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from app.utils import codecs
+
+
+def payment_payload() -> dict:
+    payment_uuid = str(uuid.uuid4())
+    result = {
+        "uuid": payment_uuid,
+        "order_id": "PAY20251201123045A1B2C3D4E5F6",
+        "amount": "25.00",
+        "payment_amount": None,
+        "payer_amount": "25.00",
+        "discount_percent": 0,
+        "discount": "0.00000000",
+        "payer_currency": "USDT",
+        "currency": "USDT",
+        "merchant_amount": "24.50",
+        "network": "tron",
+        "address": "TXguLRFtrAFrEDA17WuPfrxB84jVzJcNNV",
+        "from": None,
+        "txid": None,
+        "payment_status": "check",
+        "url": f"https://pay.cryptomus.com/pay/{payment_uuid}",
+        "expired_at": 1764592245,
+        "status": "check",
+        "is_final": False,
+        "additional_data": None,
+        "created_at": "2025-12-01 12:30:45",
+        "updated_at": "2025-12-01 12:30:45",
+        "address_qr_code": "data:image/png;base64," + "iVBORw0KGgoAAAANSUhEUgAA" * 120,
+    }
+    return {
+        "payment_id": payment_uuid,
+        "order_id": result["order_id"],
+        "wallet_address": result["address"],
+        "address_qr_code": result["address_qr_code"],
+        "crypto_amount": Decimal("25.00"),
+        "crypto_currency": "USDT",
+        "usd_amount": "25.0",
+        "network": "tron",
+        "payment_url": result["url"],
+        "status": "pending",
+        "cryptomus_status": "check",
+        "confirmations": 0,
+        "required_confirmations": 1,
+        "payer_amount": "25.00",
+        "payer_currency": "USDT",
+        "payment_amount": None,
+        "merchant_amount": "24.50",
+        "is_final": False,
+        "expires_at": datetime(2025, 12, 1, 13, 0, 45),
+        "created_at": datetime(2025, 12, 1, 12, 30, 45),
+        "updated_at": datetime(2025, 12, 1, 12, 30, 45),
+        "provider": "cryptomus",
+        "merchant_uuid": str(uuid.uuid4()),
+        "cryptomus_uuid": payment_uuid,
+        "cryptomus_data": result,
+    }
+
+
+def api_key_payload() -> dict:
+    return {
+        "user_id": 1024,
+        "rate_limit": 1000,
+        "is_active": True,
+        "api_key_id": 77,
+        "expires_at": None,
+        "user_is_active": True,
+        "user_is_admin": False,
+        "version": 2,
+    }
+
+
+def bench(name: str, value: dict, iterations: int) -> None:
+    print(f"== {name} ==")
+    variants = [(codec_name, codec, 0) for codec_name, codec in sorted(codecs.CODECS.items())]
+    variants.append(("json+zlib", codecs.get_codec("json"), 1024))
+    variants.append(("typed+zlib", codecs.get_codec("typed"), 1024))
+    if "msgpack" in codecs.CODECS:
+        variants.append(("msgpack+zlib", codecs.get_codec("msgpack"), 1024))
+
+    for label, codec, threshold in variants:
+        encoded = codecs.encode(value, codec, threshold)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            codecs.encode(value, codec, threshold)
+        enc_us = (time.perf_counter() - start) / iterations * 1e6
+        start = time.perf_counter()
+        for _ in range(iterations):
+            codecs.decode(encoded)
+        dec_us = (time.perf_counter() - start) / iterations * 1e6
+        decoded = codecs.decode(encoded)
+        typed = isinstance(decoded.get("crypto_amount", Decimal(0)), Decimal)
+        print(
+            f"{label:>13} ({codec.name:>10}): encode {enc_us:7.1f} us  decode {dec_us:7.1f} us  "
+            f"size {len(encoded):6d} B  types preserved={typed}"
+        )
+    print()
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    bench("payment", payment_payload(), n)
+    bench("api_key", api_key_payload(), n * 5)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+登录风暴基准：bcrypt 在事件循环内同步执行 vs 线程池执行
+
+模拟 N 个并发登录（每个执行一次 verify_password），同时用一个探针协程
+每 10ms 模拟一次“其他接口”的请求，统计探针的调度延迟（p50/p99/max）。
+同步版本会让探针在整个登录风暴期间停摆；线程池版本探针延迟应保持在毫秒级。
+
+用法: python benchmark_login.py [并发登录数]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from app.core.security import (
+    get_password_hash,
+    password_hash_stats,
+    verify_password,
+    verify_password_async,
+)
+
+
+async def probe(latencies, stop: asyncio.Event, interval: float = 0.01) -> None:
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        latencies.append((time.perf_counter() - expected) * 1000)
+
+
+async def sync_login(password: str, hashed: str) -> bool:
+    return verify_password(password, hashed)
+
+
+async def run(mode: str, logins: int, hashed: str):
+    latencies = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(latencies, stop))
+    await asyncio.sleep(0.05)
+
+    login = sync_login if mode == "sync" else verify_password_async
+    start = time.perf_counter()
+    await asyncio.gather(*(login("correct horse", hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe_task
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else float("nan")
+    print(
+        f"{mode:>8}: {logins / elapsed:7.1f} logins/s, "
+        f"probe delay p50={statistics.median(latencies):7.1f}ms "
+        f"p99={p99:7.1f}ms max={max(latencies):7.1f}ms (samples={len(latencies)})"
+    )
+
+
+async def main(logins: int) -> None:
+    hashed = get_password_hash("correct horse")
+    await run("sync", logins, hashed)
+    await run("executor", logins, hashed)
+    print("hash pool stats:", password_hash_stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+中间件单请求开销基准：BaseHTTPMiddleware（旧实现） vs 纯 ASGI（app.core.middleware）
+
+直接以 ASGI 协议调用应用，不经过网络栈，只测量中间件本身的开销；
+同时检查流式响应的首块数据是否在生成器结束前就被下发。
+
+用法: python benchmark_middleware.py [请求数]
+"""
+
+import asyncio
+import sys
+import time
+import uuid
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.core.middleware import APIKeyAuthMiddleware, RequestLoggingMiddleware
+
+
+async def hello(request):
+    return PlainTextResponse("ok")
+
+
+async def stream(request):
+    async def chunks():
+        yield b"first"
+        await asyncio.sleep(0.2)
+        yield b"second"
+    return StreamingResponse(chunks())
+
+
+ROUTES = [Route("/bench", hello), Route("/stream", stream)]
+
+
+async def legacy_logging(request, call_next):
+    """旧 request_logging_middleware 的等价实现"""
+    request.state.request_id = uuid.uuid4().hex[:8]
+    start = time.time()
+    response = await call_next(request)
+    int((time.time() - start) * 1000)
+    return response
+
+
+async def legacy_auth(request, call_next):
+    """旧 api_key_auth_middleware 在非保护路径上的等价实现（每次重建匹配列表）"""
+    path = request.url.path
+    skip_auth_patterns = [
+        "/api/v1/session/login", "/api/v1/session/register", "/docs", "/redoc",
+        "/openapi.json", "/health", "/", "/frontend/", "/css/", "/js/", "/pages/",
+        "/public/docs", "/public/redoc", "/public/openapi.json", "/public/info",
+    ]
+    for pattern in skip_auth_patterns:
+        if pattern == "/":
+            if path == pattern:
+                break
+        elif pattern.endswith("/"):
+            if path.startswith(pattern):
+                break
+        elif path == pattern:
+            break
+    any(path.startswith(prefix) for prefix in ["/api/v1/proxy"])
+    return await call_next(request)
+
+
+def build_app(kind: str) -> Starlette:
+    app = Starlette(routes=ROUTES)
+    if kind == "legacy":
+        app.add_middleware(BaseHTTPMiddleware, dispatch=legacy_auth)
+        app.add_middleware(BaseHTTPMiddleware, dispatch=legacy_logging)
+    elif kind == "asgi":
+        app.add_middleware(APIKeyAuthMiddleware)
+        app.add_middleware(RequestLoggingMiddleware)
+    return app
+
+
+def make_scope(path: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+
+
+async def call(app, path: str, on_message=None) -> None:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if on_message:
+            on_message(message)
+
+    await app(make_scope(path), receive, send)
+
+
+async def measure(app, requests: int) -> float:
+    for _ in range(200):
+        await call(app, "/bench")
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call(app, "/bench")
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def first_chunk_latency(app) -> float:
+    start = time.perf_counter()
+    first = {}
+
+    def on_message(message):
+        if message["type"] == "http.response.body" and message.get("body") and "t" not in first:
+            first["t"] = time.perf_counter() - start
+
+    await call(app, "/stream", on_message)
+    return first.get("t", float("nan")) * 1000
+
+
+async def main(requests: int) -> None:
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    for kind in ("bare", "legacy", "asgi"):
+        app = build_app(kind)
+        results[kind] = await measure(app, requests)
+        chunk_ms = await first_chunk_latency(app)
+        print(f"{kind:>6}: {results[kind]:8.1f} us/request, stream first chunk after {chunk_ms:6.1f} ms")
+
+    print()
+    print(f"middleware overhead  legacy: {results['legacy'] - results['bare']:8.1f} us/request")
+    print(f"middleware overhead  asgi:   {results['asgi'] - results['bare']:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
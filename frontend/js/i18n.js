@@ -287,6 +287,7 @@ const i18n = {
             'recharge.status.confirm_check': '等待区块确认',
             'recharge.status.wrong_amount_waiting': '金额不足，等待补款',
             'recharge.status.check': '等待支付',
+            'recharge.status.creating': '正在生成支付地址',
             'recharge.status.pending': '等待支付',
             'recharge.status.confirmed': '支付已确认',
             'recharge.status.fail': '支付失败',
@@ -617,6 +618,7 @@ const i18n = {
             'recharge.status.confirm_check': 'Waiting for confirmations',
             'recharge.status.wrong_amount_waiting': 'Underpaid, awaiting additional payment',
             'recharge.status.check': 'Payment pending',
+            'recharge.status.creating': 'Preparing payment address',
             'recharge.status.pending': 'Payment pending',
             'recharge.status.confirmed': 'Payment confirmed',
             'recharge.status.fail': 'Payment failed',
@@ -29,6 +29,11 @@ class RechargePage {
         this.currentPaymentAmount = null;
         this.currentExpiresAt = null;
         this.paymentTimer = null;
+        this.paymentEventsController = null;
+        this.qrObjectUrl = null;
+        this.paymentEventsSupported = typeof window.fetch === 'function'
+            && typeof window.AbortController === 'function'
+            && typeof window.TextDecoder === 'function';
         this.countdownTimer = null;
         this.paymentPollIntervalMs = 3000;
         this.paymentLinkAutoOpenAttempted = false;
@@ -313,6 +318,7 @@ class RechargePage {
             confirm_check: 'Waiting for confirmations',
             wrong_amount_waiting: 'Underpaid, awaiting additional payment',
             check: 'Payment pending',
+            creating: 'Preparing payment address',
             fail: 'Payment failed',
             cancel: 'Payment cancelled',
             system_fail: 'System error',
@@ -483,15 +489,21 @@ class RechargePage {
             typeof normalizedQrData === 'string' &&
             normalizedQrData.startsWith('iVBOR') &&
             /^[A-Za-z0-9+/=]+$/.test(normalizedQrData);
-        const qrUrl = isImageData
-            ? normalizedQrData
-            : looksLikePngBase64
-                ? `data:image/png;base64,${normalizedQrData}`
-                : `https://api.qrserver.com/v1/create-qr-code/?size=220x220&data=${encodeURIComponent(normalizedQrData || address || '')}`;
         const displayAddr = address || qrData;
         const fallbackData = address || normalizedQrData || '';
         const fallbackUrl = `https://api.qrserver.com/v1/create-qr-code/?size=220x220&data=${encodeURIComponent(fallbackData)}`;
 
+        if (isImageData || looksLikePngBase64) {
+            const qrUrl = isImageData ? normalizedQrData : `data:image/png;base64,${normalizedQrData}`;
+            this.renderQRImage(qrCodeDiv, qrUrl, displayAddr, fallbackUrl);
+            return;
+        }
+        // 没有现成的二维码图片时使用服务端本地渲染的 SVG（失败时才回退到外部服务）
+        this.loadServerQRCode()
+            .then((objectUrl) => this.renderQRImage(qrCodeDiv, objectUrl || fallbackUrl, displayAddr, fallbackUrl));
+    }
+
+    renderQRImage(qrCodeDiv, qrUrl, displayAddr, fallbackUrl) {
         qrCodeDiv.innerHTML = `
             <div class="border rounded p-3 text-center">
                 <img src="${qrUrl}" alt="QR Code" class="mb-2"
@@ -502,6 +514,30 @@ class RechargePage {
         `;
     }
 
+    async loadServerQRCode() {
+        const paymentId = this.currentPayment?.payment?.payment_id;
+        if (!paymentId) return null;
+        const headers = {};
+        if (api.token) {
+            headers.Authorization = `Bearer ${api.token}`;
+        }
+        try {
+            const response = await fetch(
+                `${api.baseURL}/api/v1/orders/payments/${encodeURIComponent(paymentId)}/qrcode?format=svg`,
+                { headers }
+            );
+            if (!response.ok) return null;
+            if (this.qrObjectUrl) {
+                URL.revokeObjectURL(this.qrObjectUrl);
+            }
+            this.qrObjectUrl = URL.createObjectURL(await response.blob());
+            return this.qrObjectUrl;
+        } catch (error) {
+            console.warn('Failed to load QR code:', error);
+            return null;
+        }
+    }
+
     startCountdown(expiresAt) {
         if (this.countdownTimer) clearInterval(this.countdownTimer);
         
@@ -573,11 +609,90 @@ class RechargePage {
     }
 
     startPaymentMonitoring() {
+        this.stopPaymentMonitoring();
+        if (this.paymentEventsSupported) {
+            this.subscribePaymentEvents();
+        } else {
+            this.startPaymentPolling();
+        }
+    }
+
+    startPaymentPolling() {
         if (this.paymentTimer) clearInterval(this.paymentTimer);
         this.checkPaymentStatus();
         this.paymentTimer = setInterval(() => this.checkPaymentStatus(), this.paymentPollIntervalMs);
     }
 
+    stopPaymentMonitoring() {
+        if (this.paymentTimer) {
+            clearInterval(this.paymentTimer);
+            this.paymentTimer = null;
+        }
+        if (this.paymentEventsController) {
+            this.paymentEventsController.abort();
+            this.paymentEventsController = null;
+        }
+    }
+
+    // 通过 SSE 接收支付状态推送（fetch 流式读取，以便携带 Authorization 头）
+    async subscribePaymentEvents() {
+        const paymentId = this.currentPayment?.payment?.payment_id;
+        if (!paymentId) return;
+        const controller = new AbortController();
+        this.paymentEventsController = controller;
+        const headers = { Accept: 'text/event-stream' };
+        if (api.token) {
+            headers.Authorization = `Bearer ${api.token}`;
+        }
+
+        let failed = false;
+        try {
+            const response = await fetch(
+                `${api.baseURL}/api/v1/orders/payments/${encodeURIComponent(paymentId)}/events`,
+                { headers, signal: controller.signal }
+            );
+            if (!response.ok || !response.body) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary = buffer.indexOf('\n\n');
+                while (boundary >= 0) {
+                    const block = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    const data = block
+                        .split('\n')
+                        .filter((line) => line.startsWith('data:'))
+                        .map((line) => line.slice(5).trimStart())
+                        .join('\n');
+                    if (data) {
+                        this.applyPaymentStatus(JSON.parse(data));
+                    }
+                    boundary = buffer.indexOf('\n\n');
+                }
+            }
+        } catch (error) {
+            if (controller.signal.aborted) return;
+            failed = true;
+            console.warn('Payment event stream failed, falling back to polling:', error);
+        }
+
+        // 已到终态时 applyPaymentStatus 会停止监控；否则服务端超时断开则重连，出错则回退到轮询
+        if (this.paymentEventsController !== controller) return;
+        this.paymentEventsController = null;
+        if (!this.currentPayment) return;
+        if (failed) {
+            this.startPaymentPolling();
+        } else {
+            this.subscribePaymentEvents();
+        }
+    }
+
     applyPaymentStatus(statusData) {
         if (!statusData) return;
         const status = (statusData.status || 'pending').toLowerCase();
@@ -657,7 +772,7 @@ class RechargePage {
     }
 
     paymentSuccess() {
-        clearInterval(this.paymentTimer);
+        this.stopPaymentMonitoring();
         clearInterval(this.countdownTimer);
         this.updateStatusDisplay('confirmed', 'paid');
         this.showToast(i18n?.t('recharge.toast.success') || '充值成功！', 'success');
@@ -670,27 +785,27 @@ class RechargePage {
     }
 
     paymentFailed() {
-        clearInterval(this.paymentTimer);
+        this.stopPaymentMonitoring();
         clearInterval(this.countdownTimer);
         this.updateStatusDisplay('failed', 'fail');
         this.showToast(i18n?.t('recharge.toast.failed') || '支付失败，请重试', 'error');
     }
 
     paymentExpired() {
-        clearInterval(this.paymentTimer);
+        this.stopPaymentMonitoring();
         this.updateStatusDisplay('expired', 'expired');
         this.showToast(i18n?.t('recharge.toast.expired') || '支付已过期，请重新创建订单', 'warning');
     }
 
     paymentCancelled() {
-        clearInterval(this.paymentTimer);
+        this.stopPaymentMonitoring();
         clearInterval(this.countdownTimer);
         this.updateStatusDisplay('cancelled', 'cancel');
         this.showToast(i18n?.t('recharge.toast.cancelled') || '支付已取消', 'info');
     }
 
     cancelPayment() {
-        clearInterval(this.paymentTimer);
+        this.stopPaymentMonitoring();
         clearInterval(this.countdownTimer);
         document.getElementById('paymentCard').style.display = 'none';
         this.currentPayment = null;